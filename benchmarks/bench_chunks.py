@@ -0,0 +1,69 @@
+"""Town membership check per deposit tick: scanning townBlocks vs the hashed chunk index.
+
+    python benchmarks/bench_chunks.py --players 500 --blocks 3000 --towns 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.Chunks import ChunkIndex, TownIndex  # noqa: E402
+from synthetic import make_players_json, make_town_blocks  # noqa: E402
+
+
+# libs.util.isInChunk, copied so the benchmark doesn't need the bot's .env
+def isInChunk(chunk_coords, player_pos):
+    chunk_x, chunk_z = chunk_coords
+    player_x, player_z = player_pos
+    return player_x // 16 == chunk_x and player_z // 16 == chunk_z
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=500)
+    parser.add_argument('--blocks', type=int, default=3000, help='claimed chunks per town')
+    parser.add_argument('--towns', type=int, default=20, help='towns for the batched lookup')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    towns = [make_town_blocks(args.blocks, cx=260 + i * 200, cz=-540, seed=i) for i in range(args.towns)]
+    players = make_players_json(args.players, towns, in_town=0.2)['players']
+    positions = {p['name']: (p['x'], p['z']) for p in players}
+    town_blocks = towns[0]
+
+    scan_time, scan = best_of(lambda: [n for n, pos in positions.items() if [x for x in town_blocks if isInChunk(x, pos)]], 1)
+
+    start = time.perf_counter()
+    index = ChunkIndex(town_blocks)
+    build_time = time.perf_counter() - start
+    index_time, indexed = best_of(lambda: [n for n, pos in positions.items() if pos in index], args.repeat)
+    assert scan == indexed
+
+    town_index = TownIndex()
+    start = time.perf_counter()
+    for i, blocks in enumerate(towns):
+        town_index.update(f'Town{i}', blocks)
+    multi_build = time.perf_counter() - start
+    locate_time, located = best_of(lambda: town_index.locate(positions), args.repeat)
+    assert sorted(located.get('Town0', {})) == sorted(indexed)
+
+    print(f'{args.players} players, {args.blocks} blocks per town')
+    print(f'  townBlocks scan   {scan_time * 1000:10.3f} ms per tick')
+    print(f'  ChunkIndex        {index_time * 1000:10.3f} ms per tick (built once in {build_time * 1000:.2f} ms)')
+    print(f'  TownIndex.locate  {locate_time * 1000:10.3f} ms per tick for {args.towns} towns '
+          f'(built in {multi_build * 1000:.2f} ms, {sum(len(v) for v in located.values())} players in towns)')
+
+
+if __name__ == '__main__':
+    main()
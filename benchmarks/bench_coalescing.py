@@ -0,0 +1,123 @@
+"""Commit rate and latency of balance writes with group commit on and off.
+
+Worker threads hammer change_balance/transfer the way a burst of coinflips and
+payments would. With coalescing off every op is its own transaction, with it on
+they go through Bank.WriteCoalescer and share commits.
+
+    python benchmarks/bench_coalescing.py --threads 32 --ops 200 --window-ms 2
+
+Before timing anything it checks that an op failing inside a batch (a debit the user
+can't cover) rejects only its own future while the rest of the batch commits, the exit
+status is 1 if it doesn't.
+
+Set CASINO_DB_PATH to a file on the disk the bot really runs on, the difference
+comes from fsyncs and a tmpfs has none. --durable fsyncs every commit.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CASINO_DB_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from libs import Bank  # noqa: E402
+from libs.Database import connection  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def worker(index, ops, submit, latencies):
+    a, b = f'bench{index}', f'bench{index + 1}'
+    for i in range(ops):
+        start = time.perf_counter()
+        if i % 4 == 0:
+            try:
+                submit(Bank.transfer, a, b, 1)
+            except ValueError:
+                pass
+        else:
+            submit(Bank.change_balance, a, 1)
+        latencies.append(time.perf_counter() - start)
+
+
+def run(threads, ops, submit):
+    latencies = []
+    workers = [threading.Thread(target=worker, args=(i, ops, submit, latencies)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start, latencies
+
+
+# One batch of credits with an overdraft in the middle: only the overdraft may fail
+def check_rejection(window):
+    coalescer = Bank.WriteCoalescer(max(window, 0.05), 16)
+    users = [f'check{i}' for i in range(5)]
+    before = [Bank.get_user_balance(userid) for userid in users]
+    futures = [coalescer.submit(Bank.change_balance, userid, 1) for userid in users[:2]]
+    overdraft = coalescer.submit(Bank.change_balance, users[2], -(before[2] + 1))
+    futures += [coalescer.submit(Bank.change_balance, userid, 1) for userid in users[3:]]
+    coalescer.stop()
+
+    rejected = isinstance(overdraft.exception(), ValueError)
+    applied = all(future.exception() is None for future in futures)
+    after = [Bank.get_user_balance(userid) for userid in users]
+    expected = [b + 1 for b in before[:2]] + [before[2]] + [b + 1 for b in before[3:]]
+    ok = rejected and applied and after == expected and coalescer.commits == 1
+    print(f'Rejection check: overdraft {"rejected" if rejected else "NOT rejected"}, '
+          f'{sum(f.exception() is None for f in futures)}/{len(futures)} others applied in '
+          f'{coalescer.commits} commit(s): {"ok" if ok else "FAIL"}')
+    return ok
+
+
+def report(label, elapsed, latencies, commits):
+    print(f'{label:>11}: {len(latencies) / elapsed:9.0f} ops/s | {commits / elapsed:8.0f} commits/s | '
+          f'p50 {percentile(latencies, 50) * 1000:7.2f} ms p99 {percentile(latencies, 99) * 1000:7.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--ops', type=int, default=200, help='ops per thread')
+    parser.add_argument('--window-ms', type=float, default=2.0)
+    parser.add_argument('--max-ops', type=int, default=128)
+    parser.add_argument('--durable', action='store_true', help='synchronous=FULL for both runs')
+    args = parser.parse_args()
+
+    print(f'Database: {Bank.DB_PATH}')
+    if not check_rejection(args.window_ms / 1000):
+        return 1
+    total = args.threads * args.ops
+
+    # Without coalescing: every op commits on its own (guarded by a lock, as the
+    # single Ledger writer thread would)
+    lock = threading.Lock()
+
+    def direct(func, *fargs):
+        with lock:
+            if args.durable:
+                connection().execute('PRAGMA synchronous=FULL')
+            return func(*fargs)
+
+    elapsed, latencies = run(args.threads, args.ops, direct)
+    report('coalesce off', elapsed, latencies, total)
+
+    coalescer = Bank.WriteCoalescer(args.window_ms / 1000, args.max_ops, durable=args.durable)
+    elapsed, latencies = run(args.threads, args.ops, lambda func, *fargs: coalescer.submit(func, *fargs).result())
+    coalescer.stop()
+    report('coalesce on', elapsed, latencies, coalescer.commits)
+    print(f'{"":>11}  {coalescer.ops} ops in {coalescer.commits} commits '
+          f'({coalescer.ops / max(coalescer.commits, 1):.1f} ops per commit)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""End to end auto-deposit benchmark against the local EarthMC simulator.
+
+Steps a synthetic (or replayed) world and runs one DepositWatcher tick per step,
+then compares what the watcher credited with the payments the world really made.
+
+    python benchmarks/bench_deposits.py --players 3000 --towns 10 --ticks 200 --pay-rate 1
+    python benchmarks/bench_deposits.py --replay trace.jsonl --latency-ms 80 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs import EarthMC as earthmc_module  # noqa: E402
+from libs.Deposits import DepositWatcher  # noqa: E402
+from libs.EarthMC import EarthMC, RateLimited  # noqa: E402
+from earthmc_sim import ReplayWorld, Simulator, World  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def drive(sim, ticks, tick_seconds):
+    client = EarthMC()
+    client.budget.rate = client.budget.burst = 10 ** 6  # The simulator has no budget to protect
+    detected = []
+
+    async def on_deposit(payer, receiver, amount, watch):
+        detected.append({'step': sim.world.step_number, 'payer': payer, 'receiver': receiver, 'amount': amount})
+
+    watches = [(x['town'], x['receiver'], tuple(x['chest'])) for x in sim.world.shops]
+    watcher = DepositWatcher(client, watches, on_deposit)
+    await watcher.refresh_towns()
+
+    cpu_per_tick, rate_limited = [], 0
+    for _ in range(ticks):
+        sim.step()
+        start = time.thread_time()
+        try:
+            await watcher.tick()
+        except RateLimited:
+            rate_limited += 1
+        cpu_per_tick.append(time.thread_time() - start)
+
+    await client.close()
+    return detected, cpu_per_tick, rate_limited, client.stats
+
+
+# Payments after last_step are too recent to count as missed, but can still be matched
+def score(payments, detected, tick_seconds, last_step):
+    outstanding = {}
+    for payment in payments:
+        outstanding.setdefault((payment['payer'], payment['receiver'], payment['amount']), []).append(payment['step'])
+
+    latencies, false_positives = [], 0
+    for found in detected:
+        key = (found['payer'], found['receiver'], float(found['amount']))
+        steps = outstanding.get(key)
+        if steps:
+            latencies.append((found['step'] - steps.pop(0)) * tick_seconds)
+        else:
+            false_positives += 1
+    missed = sum(1 for steps in outstanding.values() for step in steps if step <= last_step)
+    return latencies, missed, false_positives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--towns', type=int, default=5)
+    parser.add_argument('--blocks', type=int, default=800)
+    parser.add_argument('--ticks', type=int, default=100)
+    parser.add_argument('--pay-rate', type=float, default=0.5, help='payments started per tick')
+    parser.add_argument('--split-rate', type=float, default=0.1, help='chance the shop is credited a tick late')
+    parser.add_argument('--simultaneous', type=float, default=0.2, help='chance of a second customer in the same tick')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--tick-seconds', type=float, default=3.0, help='wall time one tick stands for')
+    parser.add_argument('--replay', help='replay a trace recorded with earthmc_sim.py --record')
+    parser.add_argument('--port', type=int, default=8767)
+    args = parser.parse_args()
+
+    if args.replay:
+        world = ReplayWorld(args.replay)
+    else:
+        world = World(args.players, args.towns, args.blocks, args.pay_rate, args.split_rate, args.simultaneous)
+    sim = Simulator(world, args.latency_ms / 1000, args.error_rate, args.rate_limit_rate)
+    url = sim.start(port=args.port)
+    earthmc_module.API_URL = f'{url}/v3/aurora'
+    earthmc_module.MAP_URL = url
+
+    detected, cpu, rate_limited, stats = asyncio.run(drive(sim, args.ticks, args.tick_seconds))
+    # Payments made on the last couple of steps had no chance to be seen yet
+    last_step = world.step_number - 2
+    latencies, missed, false_positives = score(world.payments, detected, args.tick_seconds, last_step)
+
+    print(f'{len(world.balances)} players, {len(world.shops)} shops, {args.ticks} ticks')
+    print(f'  CPU per tick       p50 {percentile(cpu, 50) * 1000:.2f} ms  p99 {percentile(cpu, 99) * 1000:.2f} ms')
+    print(f'  payments           {len(world.payments)} made, {len(latencies)} matched, {missed} missed, {false_positives} wrong')
+    print(f'  detection latency  p50 {percentile(latencies, 50):.1f} s  p99 {percentile(latencies, 99):.1f} s')
+    print(f'  traffic            {stats["requests"]} requests, {stats["bytes"] / 1024:.0f} KiB received, '
+          f'{stats["not_modified"]} not modified, {rate_limited} ticks rate limited')
+
+
+if __name__ == '__main__':
+    main()
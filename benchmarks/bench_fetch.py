@@ -0,0 +1,147 @@
+"""Bytes transferred and client CPU per deposit tick, full refetch vs conditional fetching.
+
+Runs a stand-in for map.earthmc.net and api.earthmc.net on localhost (in its own
+thread, so its CPU isn't counted) whose players.json only changes every few ticks.
+
+    python benchmarks/bench_fetch.py --players 2000 --ticks 40 --change-every 3
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from libs import EarthMC as earthmc_module  # noqa: E402
+from libs.Chunks import TownIndex  # noqa: E402
+from libs.EarthMC import EarthMC  # noqa: E402
+from synthetic import make_players_json, make_town_blocks  # noqa: E402
+
+PORT = 8766
+
+
+# Positions of the players.json entries inside the town, {name: (x, z)}
+def players_in(players, index):
+    online = {p['name']: (p['x'], p['z']) for p in players if isinstance(p, dict)}
+    return index.locate(online).get('Town', {})
+
+
+class StandIn:
+    def __init__(self, players, town_blocks, change_every, etags):
+        self.players = players
+        self.town_blocks = town_blocks
+        self.change_every = change_every
+        self.etags = etags
+        self.version = 0
+        self.body = b''
+        self.refresh()
+
+    def refresh(self):
+        self.body = json.dumps(make_players_json(self.players, [self.town_blocks], in_town=0.02, seed=self.version)).encode()
+
+    def tick(self, number):
+        if number % self.change_every == 0:
+            self.version += 1
+            self.refresh()
+
+    async def players_json(self, request):
+        etag = f'"{hashlib.md5(self.body).hexdigest()}"'
+        if self.etags and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        headers = {'ETag': etag} if self.etags else {}
+        return web.Response(body=self.body, content_type='application/json', headers=headers)
+
+    async def players_api(self, request):
+        query = (await request.json())['query']
+        return web.json_response([{'name': name, 'stats': {'balance': 1000}} for name in query])
+
+    def serve(self, ready):
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get('/tiles/players.json', self.players_json)
+        app.router.add_post('/players', self.players_api)
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', PORT).start())
+        ready.set()
+        loop.run_forever()
+
+
+async def old_loop(server, index, receiver, ticks):
+    received = 0
+    async with aiohttp.ClientSession() as session:
+        seen = {}
+        for tick in range(ticks):
+            server.tick(tick)
+            async with session.get(f'http://127.0.0.1:{PORT}/tiles/players.json') as resp:
+                body = await resp.read()
+                received += len(body)
+                response = json.loads(body)
+            positions = players_in(response['players'], index)
+            seen.update(positions)
+            query = [receiver, *seen]
+            payload = json.dumps({"query": query, "template": {"stats": True}}).encode()
+            async with session.post(f'http://127.0.0.1:{PORT}/players', data=payload, headers={'Content-Type': 'application/json'}) as resp:
+                received += len(await resp.read())
+    return received
+
+
+async def new_loop(server, index, receiver, ticks, full_every=4):
+    client = EarthMC()
+    seen, last_balances, positions = {}, {}, {}
+    for tick in range(ticks):
+        server.tick(tick)
+        players = await client.fetch_players()
+        if players is not None:
+            positions = players_in(players['players'], index)
+        seen.update(positions)
+        watched = [receiver, *seen]
+        query = watched if (tick + 1) % full_every == 0 else [x for x in watched if x == receiver or x not in last_balances]
+        last_balances.update(await client.balances(query))
+    await client.close()
+    return client.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--blocks', type=int, default=1500)
+    parser.add_argument('--ticks', type=int, default=40)
+    parser.add_argument('--change-every', type=int, default=3, help='players.json changes every N ticks')
+    parser.add_argument('--no-etag', action='store_true', help='server sends no validators, only body hashing helps')
+    args = parser.parse_args()
+
+    town = make_town_blocks(args.blocks)
+    index = TownIndex()
+    index.update('Town', town)
+    server = StandIn(args.players, town, args.change_every, etags=not args.no_etag)
+    ready = threading.Event()
+    threading.Thread(target=server.serve, args=(ready,), daemon=True).start()
+    ready.wait()
+    earthmc_module.MAP_URL = f'http://127.0.0.1:{PORT}'
+    earthmc_module.API_URL = f'http://127.0.0.1:{PORT}'
+
+    cpu = time.thread_time()
+    received = asyncio.run(old_loop(server, index, 'Receiver', args.ticks))
+    old_cpu = time.thread_time() - cpu
+
+    cpu = time.thread_time()
+    stats = asyncio.run(new_loop(server, index, 'Receiver', args.ticks))
+    new_cpu = time.thread_time() - cpu
+
+    print(f'{args.players} players, players.json {len(server.body) / 1024:.0f} KiB, changes every {args.change_every} ticks, '
+          f'{"no " if args.no_etag else ""}ETag, json decoder {earthmc_module.loads.__module__}')
+    print(f'  full refetch  {received / args.ticks / 1024:9.1f} KiB/tick {old_cpu / args.ticks * 1000:8.2f} ms CPU/tick')
+    print(f'  conditional   {stats["bytes"] / args.ticks / 1024:9.1f} KiB/tick {new_cpu / args.ticks * 1000:8.2f} ms CPU/tick '
+          f'({stats["not_modified"]} not modified, {stats["unchanged"]} identical bodies, {stats["requests"]} requests)')
+
+
+if __name__ == '__main__':
+    main()
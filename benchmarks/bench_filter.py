@@ -0,0 +1,63 @@
+"""Per-tick cost of placing the players.json players in the watched towns, Python vs NumPy.
+
+    python benchmarks/bench_filter.py --players 100 1000 5000 --blocks 3000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs import Chunks  # noqa: E402
+from libs.Chunks import TownIndex  # noqa: E402
+from synthetic import make_players_json, make_town_blocks  # noqa: E402
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--blocks', type=int, default=3000)
+    parser.add_argument('--towns', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if Chunks.np is None:
+        print('NumPy is not installed, only the pure Python path can be measured')
+
+    towns = [make_town_blocks(args.blocks, cx=260 + i * 200, cz=-540, seed=i) for i in range(args.towns)]
+    town_index = TownIndex()
+    for i, blocks in enumerate(towns):
+        town_index.update(f'Town{i}', blocks)
+
+    numpy = Chunks.np
+    print(f'{"players":>8} {"python":>10} {"numpy":>10}  (TownIndex.locate, ms per tick for {args.towns} towns)')
+    for count in args.players:
+        players = make_players_json(count, towns, in_town=0.1, seed=count)['players']
+        positions = {p['name']: (p['x'], p['z']) for p in players}
+
+        Chunks.np = None
+        py_time, py_located = best_of(lambda: town_index.locate(positions), args.repeat)
+        Chunks.np = numpy
+
+        row = f'{count:>8} {py_time * 1000:>10.3f}'
+        if numpy is not None and count >= Chunks.NUMPY_MIN_PLAYERS:
+            np_time, np_located = best_of(lambda: town_index.locate(positions), args.repeat)
+            assert np_located == py_located
+            row += f' {np_time * 1000:>10.3f}'
+        else:
+            row += f' {"-":>10}'
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
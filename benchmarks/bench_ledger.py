@@ -0,0 +1,289 @@
+"""Throughput, latency and correctness of libs/Bank.py under concurrent load.
+
+Seeds --users accounts, then runs a mix of get_user_balance, change_balance,
+transfer and bank_transfer at every concurrency level given, once with plain
+threads calling Bank directly and once with asyncio tasks going through Ledger.
+After every run it checks that the users' total plus the bank only moved by what
+change_balance added (transfers and bank transfers conserve money) and that the
+journal agrees with the balances.
+
+    python benchmarks/bench_ledger.py --users 100000 --ops 20000 --concurrency 1,8,32
+    python benchmarks/bench_ledger.py --users 1000000 --modes threads --json results.json
+    python benchmarks/bench_ledger.py --busy-timeout-ms 50 --concurrency 64 --hot 0.5
+
+--json writes the results as one JSON document (use - for stdout) so runs can be
+compared between commits. The exit status is 1 if an invariant is broken.
+Set CASINO_DB_PATH to a file on the disk the bot really runs on, on a tmpfs the
+fsyncs are free.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CASINO_DB_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from libs import Bank, Database, Ledger  # noqa: E402
+from libs.Database import connection, transaction  # noqa: E402
+
+START_BALANCE = 1000
+OPS = ('read', 'change', 'transfer', 'bank')
+HOT_USERS = 100
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def user_id(i):
+    return str(10 ** 17 + i)
+
+
+def seed(users):
+    with transaction() as conn:
+        conn.execute('DELETE FROM users')
+        conn.execute('DELETE FROM transactions')
+        conn.executemany(
+            'INSERT INTO users (userid, balance) VALUES (?, ?)',
+            ((user_id(i), START_BALANCE) for i in range(users))
+        )
+        conn.execute('UPDATE bank SET balance = ?', (users * START_BALANCE,))
+    Bank.cache.clear()
+
+
+def db_size():
+    return sum(os.path.getsize(Bank.DB_PATH + suffix) for suffix in ('', '-wal') if os.path.exists(Bank.DB_PATH + suffix))
+
+
+def totals():
+    conn = connection()
+    users = conn.execute('SELECT TOTAL(balance) FROM users').fetchone()[0]
+    bank = conn.execute('SELECT balance FROM bank').fetchone()[0]
+    journal = conn.execute('SELECT TOTAL(amount) FROM transactions').fetchone()[0]
+    return users, bank, journal
+
+
+def is_lock_error(error):
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+
+# Everything one worker does and counts, merged into the run's result at the end
+class Tally:
+    def __init__(self):
+        self.latencies = {op: [] for op in OPS}
+        self.minted = 0
+        self.rejected = 0
+        self.lock_errors = 0
+        self.errors = 0
+
+    def merge(self, other):
+        for op in OPS:
+            self.latencies[op].extend(other.latencies[op])
+        self.minted += other.minted
+        self.rejected += other.rejected
+        self.lock_errors += other.lock_errors
+        self.errors += other.errors
+
+
+class Workload:
+    def __init__(self, users, mix, hot, seed=0):
+        self.users = users
+        self.ops = [op for op, weight in zip(OPS, mix) for _ in range(weight)]
+        self.hot = hot
+        self.seed = seed
+
+    def picker(self, worker):
+        rng = random.Random(self.seed * 1000003 + worker)
+
+        def pick():
+            if rng.random() < self.hot:
+                user = rng.randrange(min(HOT_USERS, self.users))
+            else:
+                user = rng.randrange(self.users)
+            amount = rng.randint(1, 20)
+            return rng.choice(self.ops), user_id(user), user_id(rng.randrange(self.users)), amount, rng.random() < 0.5
+        return pick
+
+
+def record(tally, op, start, error, amount=0):
+    if error is None:
+        tally.latencies[op].append(time.perf_counter() - start)
+        if op == 'change':
+            tally.minted += amount
+    elif isinstance(error, ValueError):
+        tally.rejected += 1
+    elif is_lock_error(error):
+        tally.lock_errors += 1
+    else:
+        tally.errors += 1
+
+
+def thread_worker(pick, ops, tally):
+    for _ in range(ops):
+        op, a, b, amount, sign = pick()
+        amount = amount if sign else -amount
+        start = time.perf_counter()
+        error = None
+        try:
+            if op == 'read':
+                Bank.get_user_balance(a)
+            elif op == 'change':
+                Bank.change_balance(a, amount, 'adjust')
+            elif op == 'transfer':
+                Bank.transfer(a, b, abs(amount))
+            else:
+                Bank.bank_transfer(a, amount)
+        except Exception as e:
+            error = e
+        record(tally, op, start, error, amount)
+
+
+async def task_worker(pick, ops, tally):
+    for _ in range(ops):
+        op, a, b, amount, sign = pick()
+        amount = amount if sign else -amount
+        start = time.perf_counter()
+        error = None
+        try:
+            if op == 'read':
+                await Ledger.get_user_balance(a)
+            elif op == 'change':
+                await Ledger.change_balance(a, amount, 'adjust')
+            elif op == 'transfer':
+                await Ledger.transfer(a, b, abs(amount))
+            else:
+                await Ledger.bank_transfer(a, amount)
+        except Exception as e:
+            error = e
+        record(tally, op, start, error, amount)
+
+
+def run_threads(workload, concurrency, ops):
+    tallies = [Tally() for _ in range(concurrency)]
+    threads = [
+        threading.Thread(target=thread_worker, args=(workload.picker(i), ops // concurrency, tallies[i]))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return tallies
+
+
+def run_tasks(workload, concurrency, ops):
+    tallies = [Tally() for _ in range(concurrency)]
+
+    async def main():
+        await asyncio.gather(*(task_worker(workload.picker(i), ops // concurrency, tallies[i]) for i in range(concurrency)))
+    asyncio.run(main())
+    return tallies
+
+
+def scenario(mode, workload, concurrency, ops):
+    seed(workload.users)
+    users_before, bank_before, journal_before = totals()
+    size_before = db_size()
+
+    start = time.perf_counter()
+    tallies = (run_threads if mode == 'threads' else run_tasks)(workload, concurrency, ops)
+    elapsed = time.perf_counter() - start
+
+    tally = Tally()
+    for other in tallies:
+        tally.merge(other)
+    users_after, bank_after, journal_after = totals()
+    completed = sum(len(x) for x in tally.latencies.values())
+    conserved = users_after + bank_after - (users_before + bank_before) == tally.minted
+    journal_matches = journal_after - journal_before == users_after - users_before
+
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'ops': completed + tally.rejected + tally.lock_errors + tally.errors,
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(completed / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            op: {
+                'count': len(values),
+                'p50': round(percentile(values, 50) * 1000, 3),
+                'p99': round(percentile(values, 99) * 1000, 3),
+            }
+            for op, values in tally.latencies.items()
+        },
+        'rejected': tally.rejected,
+        'lock_errors': tally.lock_errors,
+        'errors': tally.errors,
+        'db_growth_bytes': db_size() - size_before,
+        'conserved': conserved,
+        'journal_matches': journal_matches,
+    }
+
+
+def report(result):
+    print(f"{result['mode']:>7} x{result['concurrency']:<4} {result['ops_per_sec']:>10.1f} ops/s  "
+          + '  '.join(f"{op} p50 {x['p50']:.2f}/p99 {x['p99']:.2f} ms" for op, x in result['latency_ms'].items() if x['count'])
+          + f"  | {result['lock_errors']} locked, {result['errors']} errors, {result['rejected']} rejected, "
+          f"+{result['db_growth_bytes'] / 1024:.0f} KiB, "
+          f"{'conserved' if result['conserved'] and result['journal_matches'] else 'INVARIANT BROKEN'}",
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=10000, help='operations per run, split across the workers')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma separated worker counts')
+    parser.add_argument('--modes', default='threads,asyncio', help='threads (Bank directly), asyncio (Ledger) or both')
+    parser.add_argument('--mix', default='50,20,20,10', help='weights of read,change,transfer,bank')
+    parser.add_argument('--hot', type=float, default=0.0, help=f'fraction of ops on the {HOT_USERS} hottest users')
+    parser.add_argument('--cache-size', type=int, default=Bank.cache.size, help='balance cache entries, 0 disables it')
+    parser.add_argument('--busy-timeout-ms', type=int, help='override busy_timeout to surface lock contention')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file, - for stdout')
+    args = parser.parse_args()
+
+    if args.busy_timeout_ms is not None:
+        Database.PRAGMAS = tuple(x for x in Database.PRAGMAS if 'busy_timeout' not in x) + (f'PRAGMA busy_timeout={args.busy_timeout_ms}',)
+        Database.close_all()
+    Bank.cache.size = args.cache_size
+    workload = Workload(args.users, [int(x) for x in args.mix.split(',')], args.hot, args.seed)
+
+    print(f'Database: {Bank.DB_PATH}, {args.users} users, {args.ops} ops per run', file=sys.stderr)
+    results = []
+    for mode in args.modes.split(','):
+        for concurrency in (int(x) for x in args.concurrency.split(',')):
+            results.append(scenario(mode, workload, concurrency, args.ops))
+            report(results[-1])
+    Ledger.shutdown()
+
+    document = {
+        'benchmark': 'ledger',
+        'timestamp': int(time.time()),
+        'sqlite': sqlite3.sqlite_version,
+        'config': {k: v for k, v in vars(args).items() if k != 'json'},
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    if not all(x['conserved'] and x['journal_matches'] for x in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
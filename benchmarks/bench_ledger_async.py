@@ -0,0 +1,94 @@
+"""Command latency under concurrent interactions, sync Bank calls vs the async Ledger.
+
+Each simulated interaction does what /coinflip does against the ledger: read two
+balances, apply two balance changes and read the balances back. A heartbeat task
+measures how late the event loop wakes up while the interactions run.
+
+    python benchmarks/bench_ledger_async.py --interactions 200
+
+Set CASINO_DB_PATH to a file on the disk the bot really runs on, on a tmpfs the
+fsyncs are free and the blocking sync path looks far better than it is.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CASINO_DB_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from libs import Bank, Ledger  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def interaction_sync(i):
+    a, b = f'user{i}', f'user{i + 1}'
+    Bank.get_user_balance(a)
+    Bank.get_user_balance(b)
+    Bank.change_balance(a, 1)
+    Bank.change_balance(b, -1)
+    Bank.get_user_balance(a)
+    Bank.get_user_balance(b)
+
+
+async def interaction_async(i):
+    a, b = f'user{i}', f'user{i + 1}'
+    await asyncio.gather(Ledger.get_user_balance(a), Ledger.get_user_balance(b))
+    await Ledger.change_balance(a, 1)
+    await Ledger.change_balance(b, -1)
+    await asyncio.gather(Ledger.get_user_balance(a), Ledger.get_user_balance(b))
+
+
+async def heartbeat(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.005)
+        lags.append(loop.time() - start - 0.005)
+
+
+async def run(mode, interactions):
+    handler = interaction_sync if mode == 'sync' else interaction_async
+    latencies, lags = [], []
+    stop = asyncio.Event()
+
+    # Every interaction arrives at the same moment, latency is measured from arrival
+    async def timed(i):
+        await handler(i)
+        latencies.append(time.perf_counter() - start)
+
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(interactions)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+
+    print(f'{mode:>5}: {interactions} interactions in {elapsed * 1000:.1f} ms | '
+          f'latency p50 {percentile(latencies, 50) * 1000:.2f} ms '
+          f'p99 {percentile(latencies, 99) * 1000:.2f} ms | '
+          f'loop lag max {max(lags or [0]) * 1000:.2f} ms ({len(lags)} heartbeats)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interactions', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'Database: {Bank.DB_PATH}')
+    # Enough for every debit of both runs
+    Bank.settle({f'user{i}': 10 for i in range(args.interactions + 1)}, 'seed')
+    asyncio.run(run('sync', args.interactions))
+    asyncio.run(run('async', args.interactions))
+    Ledger.shutdown()
+
+
+if __name__ == '__main__':
+    main()
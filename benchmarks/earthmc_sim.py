@@ -0,0 +1,321 @@
+"""Local stand-in for the EarthMC API and map, for load testing the deposit pipeline.
+
+Serves /v3/aurora/towns, /v3/aurora/players, /v3/aurora/discord and
+/tiles/players.json from a synthetic world: thousands of players wandering around,
+customers walking up to shop chests and paying, with optional latency and error
+injection. A world can be recorded to a JSONL trace and replayed later.
+
+Run it on its own and point the bot at it (libs.EarthMC.API_URL/MAP_URL):
+
+    python benchmarks/earthmc_sim.py --port 8080 --players 3000 --towns 10
+    python benchmarks/earthmc_sim.py --port 8080 --replay trace.jsonl
+
+or drive it from bench_deposits.py.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import uuid
+
+from aiohttp import web
+
+from synthetic import make_town_blocks
+
+WORLD_X = 33000
+WORLD_Z = 16500
+
+
+class World:
+    # pay_rate: payments started per step, split_rate: chance the receiver is credited a
+    # step after the payer is debited, simultaneous: chance a second customer pays the
+    # same shop in the same step
+    def __init__(self, players=2000, towns=5, blocks=800, pay_rate=0.3, split_rate=0.1, simultaneous=0.2, seed=0):
+        self.rng = random.Random(seed)
+        self.pay_rate = pay_rate
+        self.split_rate = split_rate
+        self.simultaneous = simultaneous
+        self.step_number = 0
+        self.towns = {}
+        self.shops = []
+        for i in range(towns):
+            cx, cz = self.rng.randint(-2000, 2000), self.rng.randint(-1000, 1000)
+            name = f'Town{i}'
+            self.towns[name] = make_town_blocks(blocks, cx, cz, seed=seed + i)
+            chest = (cx * 16 + 8, cz * 16 + 8)
+            self.shops.append({'town': name, 'receiver': f'Shop{i}', 'chest': chest})
+
+        self.players = {}
+        for i in range(players):
+            self.players[f'Player{i}'] = {
+                'x': self.rng.uniform(-WORLD_X, WORLD_X),
+                'z': self.rng.uniform(-WORLD_Z, WORLD_Z),
+                'uuid': str(uuid.UUID(int=self.rng.getrandbits(128))),
+                'busy': 0,
+            }
+        for shop in self.shops:
+            x, z = shop['chest']
+            self.players[shop['receiver']] = {'x': x + 2, 'z': z + 2, 'uuid': str(uuid.UUID(int=self.rng.getrandbits(128))), 'busy': -1}
+
+        self.balances = {name: float(self.rng.randint(100, 100000)) for name in self.players}
+        self.discord_ids = {p['uuid']: str(10 ** 17 + i) for i, p in enumerate(self.players.values())}
+        self.payments = []        # Ground truth: {'step', 'payer', 'receiver', 'amount'}
+        self._late_credits = []   # (receiver, amount) applied next step
+        self._arriving = []       # (payer, shop) standing at the chest, they pay next step
+        self.body = b''
+        self.render()
+
+    def step(self):
+        self.step_number += 1
+        for receiver, amount in self._late_credits:
+            self.balances[receiver] += amount
+        self._late_credits = []
+        for payer, shop in self._arriving:
+            self.pay(payer, shop)
+        self._arriving = []
+
+        for name, player in self.players.items():
+            if player['busy'] < 0:
+                continue
+            if player['busy'] > 0:
+                player['busy'] -= 1
+                if player['busy'] == 0:
+                    player['x'] = self.rng.uniform(-WORLD_X, WORLD_X)
+                    player['z'] = self.rng.uniform(-WORLD_Z, WORLD_Z)
+                continue
+            player['x'] += self.rng.uniform(-15, 15)
+            player['z'] += self.rng.uniform(-15, 15)
+
+        payments = int(self.pay_rate_budget()) if self.shops else 0
+        for _ in range(payments):
+            shop = self.rng.choice(self.shops)
+            self.arrive(shop)
+            if self.rng.random() < self.simultaneous:
+                self.arrive(shop)
+        self.render()
+
+    def pay_rate_budget(self):
+        whole, fraction = divmod(self.pay_rate, 1)
+        return whole + (1 if self.rng.random() < fraction else 0)
+
+    # A customer walks up to the chest this step and pays on the next one
+    def arrive(self, shop):
+        idle = [name for name, p in self.players.items() if p['busy'] == 0]
+        if not idle:
+            return
+        payer = self.rng.choice(idle)
+        player = self.players[payer]
+        x, z = shop['chest']
+        player['x'], player['z'] = x + self.rng.uniform(-4, 4), z + self.rng.uniform(-4, 4)
+        player['busy'] = self.rng.randint(3, 7)
+        self._arriving.append((payer, shop))
+
+    def pay(self, payer, shop):
+        amount = float(self.rng.choice([1, 2, 5, 10, 16, 20, 32, 50, 64, 100, 128, 250]))
+        if self.balances[payer] < amount:
+            return
+        self.balances[payer] -= amount
+        if self.rng.random() < self.split_rate:
+            self._late_credits.append((shop['receiver'], amount))
+        else:
+            self.balances[shop['receiver']] += amount
+        self.payments.append({'step': self.step_number, 'payer': payer, 'receiver': shop['receiver'], 'amount': amount})
+
+    def render(self):
+        self.body = json.dumps({'max': len(self.players), 'players': [
+            {'world': 'minecraft_overworld', 'name': name, 'uuid': p['uuid'], 'x': round(p['x'], 2), 'y': 64, 'z': round(p['z'], 2), 'yaw': 0}
+            for name, p in self.players.items()
+        ]}).encode()
+
+    def snapshot(self):
+        return {'step': self.step_number, 'players_json': self.body.decode(), 'balances': self.balances,
+                'payments': [x for x in self.payments if x['step'] == self.step_number]}
+
+
+# Serves a recorded trace step by step instead of simulating
+class ReplayWorld:
+    def __init__(self, path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            self.frames = [json.loads(line) for line in f]
+        self.towns = header['towns']
+        self.shops = header['shops']
+        self.discord_ids = header['discord_ids']
+        self.uuids = header['uuids']
+        self.step_number = -1
+        self.payments = []
+        self.step()
+
+    def step(self):
+        if self.step_number + 1 >= len(self.frames):
+            return
+        self.step_number += 1
+        frame = self.frames[self.step_number]
+        self.body = frame['players_json'].encode()
+        self.balances = frame['balances']
+        self.payments.extend(frame['payments'])
+
+
+def record(world, path, steps):
+    with open(path, 'w') as f:
+        f.write(json.dumps({
+            'towns': world.towns, 'shops': world.shops, 'discord_ids': world.discord_ids,
+            'uuids': {name: p['uuid'] for name, p in world.players.items()},
+        }) + '\n')
+        for _ in range(steps):
+            f.write(json.dumps(world.snapshot()) + '\n')
+            world.step()
+
+
+def uuids_of(world):
+    if hasattr(world, 'uuids'):
+        return world.uuids
+    return {name: p['uuid'] for name, p in world.players.items()}
+
+
+class Simulator:
+    def __init__(self, world, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.world = world
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.loop = None
+
+    async def _inject(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return web.Response(status=500)
+        return None
+
+    def _json(self, data):
+        body = json.dumps(data).encode()
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type='application/json')
+
+    async def players_json(self, request):
+        failure = await self._inject()
+        if failure:
+            return failure
+        etag = f'"{hashlib.blake2b(self.world.body, digest_size=8).hexdigest()}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        self.bytes_sent += len(self.world.body)
+        return web.Response(body=self.world.body, content_type='application/json', headers={'ETag': etag})
+
+    async def towns(self, request):
+        failure = await self._inject()
+        if failure:
+            return failure
+        query = (await request.json())['query']
+        return self._json([{'name': x, 'coordinates': {'townBlocks': self.world.towns[x]}} for x in query if x in self.world.towns])
+
+    async def players(self, request):
+        failure = await self._inject()
+        if failure:
+            return failure
+        payload = await request.json()
+        template = payload.get('template', {})
+        uuids = uuids_of(self.world)
+        result = []
+        for name in payload['query']:
+            if name not in self.world.balances:
+                continue
+            entry = {}
+            if template.get('name'):
+                entry['name'] = name
+            if template.get('uuid'):
+                entry['uuid'] = uuids[name]
+            if template.get('stats'):
+                entry['stats'] = {'balance': self.world.balances[name]}
+            result.append(entry)
+        return self._json(result)
+
+    async def discord(self, request):
+        failure = await self._inject()
+        if failure:
+            return failure
+        query = (await request.json())['query']
+        return self._json([{'id': self.world.discord_ids.get(x['target']), 'uuid': x['target']} for x in query])
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/tiles/players.json', self.players_json)
+        app.router.add_post('/v3/aurora/towns', self.towns)
+        app.router.add_post('/v3/aurora/players', self.players)
+        app.router.add_post('/v3/aurora/discord', self.discord)
+        return app
+
+    # Serve from a background thread with its own loop, so the caller's CPU numbers
+    # don't include the simulator
+    def start(self, host='127.0.0.1', port=8080):
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            runner = web.AppRunner(self.app(), access_log=None)
+            self.loop.run_until_complete(runner.setup())
+            self.loop.run_until_complete(web.TCPSite(runner, host, port).start())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return f'http://{host}:{port}'
+
+    # Advance the world on the simulator's loop so requests never see a half-made step
+    def step(self):
+        done = threading.Event()
+
+        def advance():
+            self.world.step()
+            done.set()
+
+        self.loop.call_soon_threadsafe(advance)
+        done.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--towns', type=int, default=5)
+    parser.add_argument('--blocks', type=int, default=800)
+    parser.add_argument('--pay-rate', type=float, default=0.3, help='payments started per step')
+    parser.add_argument('--step-seconds', type=float, default=3.0, help='wall time between world steps')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--record', help='write a trace of --steps steps to this file and exit')
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--replay', help='serve a recorded trace')
+    args = parser.parse_args()
+
+    world = ReplayWorld(args.replay) if args.replay else World(args.players, args.towns, args.blocks, args.pay_rate)
+    if args.record:
+        record(world, args.record, args.steps)
+        print(f'Recorded {args.steps} steps to {args.record}')
+        return
+
+    sim = Simulator(world, args.latency_ms / 1000, args.error_rate)
+    url = sim.start(port=args.port)
+    print(f'Serving on {url}')
+    print('DEPOSIT_WATCHES=' + ';'.join(f"{x['town']}:{x['receiver']}:{x['chest'][0]}:{x['chest'][1]}" for x in world.shops))
+    try:
+        while True:
+            threading.Event().wait(args.step_seconds)
+            sim.step()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
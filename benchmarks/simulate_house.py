@@ -0,0 +1,113 @@
+"""RTP, house edge and risk of ruin of the house games in libs/House.py, by Monte Carlo.
+
+Runs --rounds rounds of every game for the RTP, then --paths bankroll paths of
+--ruin-rounds max bets in a row for the chance the bank goes broke at each bet size
+(as a fraction of the bank), and the largest bet that keeps that chance at --target.
+Then checks the limits House.calibrate() sets, every game and every dice target, on
+--check-paths fresh paths: the ruin chance at House.max_bet() has to stay under --target
+(give or take the check's own sampling error), the exit status is 1 if it doesn't.
+Also times the vectorised blackjack against the table's pure Python engine.
+
+    python benchmarks/simulate_house.py --rounds 5000000
+    python benchmarks/simulate_house.py --ruin-rounds 10000 --paths 2000 --target 0.001
+    HOUSE_DEALER_HITS_SOFT_17=1 HOUSE_COINFLIP_PAYOUT=1.9 python benchmarks/simulate_house.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CASINO_DB_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+import numpy as np  # noqa: E402
+
+from libs import House, Simulation  # noqa: E402
+from libs.Blackjack import hand_value  # noqa: E402
+
+
+# Ruin chance at House.max_bet() for every game and dice target on fresh paths, returns
+# the ones over target
+def check_limits(args, rng):
+    bank = 1000000.0
+    House.calibrate(args.ruin_rounds, args.paths, args.target, args.seed)
+    tolerance = 3 * np.sqrt(args.target * (1 - args.target) / args.check_paths)
+    cases = [(game, None, sampler) for game, sampler in House.samplers().items() if game != 'dice']
+    cases += [('dice', target, House.dice_sampler(target)) for target in range(House.DICE_TARGETS[0], House.DICE_TARGETS[1] + 1)]
+
+    failed = []
+    worst = (-1.0, '')
+    for game, target, sampler in cases:
+        bet = House.max_bet(game, bank, target)
+        peaks = Simulation.path_peaks(sampler, args.ruin_rounds, args.check_paths, rng)
+        ruin = Simulation.ruin_probability(peaks, bet / bank)
+        name = f'{game} {target}' if target else game
+        worst = max(worst, (ruin, name))
+        if ruin > args.target + tolerance:
+            failed.append((name, bet / bank, ruin))
+    print(f'\nLimit check over {args.check_paths} paths: worst ruin {worst[0]:.2%} ({worst[1]}), '
+          f'target {args.target:.2%} + {tolerance:.2%} sampling error')
+    for name, fraction, ruin in failed:
+        print(f'  FAIL {name}: max bet {fraction:.3%} of the bank, ruin {ruin:.2%}')
+    return failed
+
+
+# Play n hands on the table's own engine with the simulator's player strategy
+def python_blackjack(n, rng):
+    shoe = House.Shoe(rng=rng)
+    total = 0.0
+    for _ in range(n):
+        hand = House.Hand(shoe)
+        if not hand.settled_on_deal():
+            while hand_value(hand.player) < House.PLAYER_STANDS_ON:
+                hand.hit(shoe)
+            hand.play_dealer(shoe)
+        total += hand.result()
+    return 1 + total / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=2000000, help='rounds per game for the RTP')
+    parser.add_argument('--ruin-rounds', type=int, default=House.RUIN_ROUNDS, help='max bets in a row per bankroll path')
+    parser.add_argument('--paths', type=int, default=House.RUIN_PATHS)
+    parser.add_argument('--target', type=float, default=House.RUIN_TARGET, help='acceptable chance of ruin')
+    parser.add_argument('--fractions', default='0.001,0.005,0.01,0.02,0.05', help='bet sizes to report the ruin chance of')
+    parser.add_argument('--python-hands', type=int, default=200000, help='hands for the pure Python cross-check, 0 skips it')
+    parser.add_argument('--check-paths', type=int, default=2000, help='paths per game and dice target for the limit check, 0 skips it')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fractions = [float(x) for x in args.fractions.split(',')]
+    print(f'{args.rounds} rounds per game, ruin over {args.paths} paths of {args.ruin_rounds} max bets\n')
+    print(f"{'game':<10} {'RTP':>8} {'edge':>7} {'±95%':>7} {'rounds/s':>11} {'max bet':>8} {'max payout':>10}  " +
+          ' '.join(f'ruin@{x:g}'.rjust(10) for x in fractions))
+    for game, sampler in House.samplers().items():
+        start = time.perf_counter()
+        net = sampler(args.rounds, rng)
+        elapsed = time.perf_counter() - start
+        rtp = Simulation.rtp(net)
+        error = 1.96 * float(net.std()) / np.sqrt(len(net))
+
+        peaks = Simulation.path_peaks(sampler, args.ruin_rounds, args.paths, rng)
+        bet = Simulation.max_bet_fraction(peaks, args.target)
+        ruin = ' '.join(f'{Simulation.ruin_probability(peaks, x):>10.2%}' for x in fractions)
+        print(f'{game:<10} {rtp:>8.4f} {1 - rtp:>7.2%} {error:>7.2%} {args.rounds / elapsed:>11,.0f} '
+              f'{bet:>8.3%} {bet * (House.max_multiplier(game) - 1):>10.3%}  {ruin}')
+
+    if args.python_hands:
+        start = time.perf_counter()
+        rtp = python_blackjack(args.python_hands, random.Random(args.seed))
+        elapsed = time.perf_counter() - start
+        print(f'\nPure Python blackjack: RTP {rtp:.4f} over {args.python_hands} hands, {args.python_hands / elapsed:,.0f} hands/s')
+
+    if args.check_paths and check_limits(args, rng):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""Synthetic EarthMC data shaped like the real API responses, shared by the benchmarks."""
+import random
+import uuid
+
+
+# A roughly round blob of `blocks` claimed chunks around chunk (cx, cz), like a real town
+def make_town_blocks(blocks, cx=260, cz=-540, seed=0):
+    rng = random.Random(seed)
+    claimed = {(cx, cz)}
+    frontier = [(cx, cz)]
+    while len(claimed) < blocks:
+        x, z = rng.choice(frontier)
+        nx, nz = rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+        chunk = (x + nx, z + nz)
+        if chunk not in claimed:
+            claimed.add(chunk)
+            frontier.append(chunk)
+    return [list(chunk) for chunk in claimed]
+
+
+# A tiles/players.json body: `count` players, `in_town` of them standing in the given towns
+def make_players_json(count, towns=(), in_town=0.05, seed=0):
+    rng = random.Random(seed)
+    chunks = [chunk for blocks in towns for chunk in blocks]
+    players = []
+    for i in range(count):
+        if chunks and rng.random() < in_town:
+            cx, cz = rng.choice(chunks)
+            x, z = cx * 16 + rng.uniform(0, 16), cz * 16 + rng.uniform(0, 16)
+        else:
+            x, z = rng.uniform(-33000, 33000), rng.uniform(-16500, 16500)
+        players.append({
+            'world': 'minecraft_overworld',
+            'name': f'Player{i}',
+            'uuid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'x': round(x, 2),
+            'y': 64,
+            'z': round(z, 2),
+            'yaw': rng.randint(-180, 180),
+        })
+    return {'max': count, 'players': players}
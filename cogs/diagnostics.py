@@ -0,0 +1,111 @@
+import discord
+from discord.ext import commands
+import time
+
+from libs import Metrics, Notify, Profiling
+from libs.util import is_admin, create_embed, logchannel
+
+# Histogram families shown by /stats, in order, with the embed field they go in
+STATS_SECTIONS = (
+    ('Commands', 'casino_command_seconds'),
+    ('Database', 'casino_db_call_seconds'),
+    ('EarthMC', 'casino_earthmc_request_seconds'),
+    ('Deposit tick', 'casino_deposit_phase_seconds'),
+    ('Event loop lag', 'casino_event_loop_lag_seconds'),
+    ('Notifications', 'casino_notify_delay_seconds'),
+)
+
+def format_seconds(value):
+    if value == float('inf'):
+        return 'slow'
+    return f'{value * 1000:.0f}ms' if value >= 0.01 else f'{value * 1000:.1f}ms'
+
+class Diagnostics(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    # Latency summary and counters (Admin only, ephemeral)
+    @discord.app_commands.command(name="stats", description="Show bot latency and load statistics (Admin only).")
+    async def stats(self, interaction: discord.Interaction):
+        if not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+        embed = create_embed("Stats", "Counts with p50 / p99 (bucket upper bounds).")
+        rows = Metrics.summary()
+        for title, family in STATS_SECTIONS:
+            lines = [
+                f"`{'/'.join(str(x) for x in values) or 'all'}` {count}× {format_seconds(p50)} / {format_seconds(p99)}"
+                for name, values, count, p50, p99 in rows if name == family
+            ]
+            if lines:
+                embed.add_field(name=title, value="\n".join(lines)[:1024], inline=False)
+
+        startup = Metrics.registry.families.get('casino_startup_seconds')
+        if startup and startup.series:
+            embed.add_field(name="Startup", value="\n".join(f"{phase}: {series.value:.2f}s" for (phase,), series in startup.series.items()), inline=True)
+
+        collected = Metrics.registry.collect()
+        for name, values in collected.items():
+            if values:
+                text = "\n".join(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}" for key, value in values.items())
+                embed.add_field(name=name.replace('_', ' ').capitalize(), value=text[:1024], inline=True)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    # Queue a text report for the log channel (or the current channel if it can't be found)
+    async def send_report(self, ctx, text, name):
+        channel = self.bot.get_channel(int(logchannel() or 0)) or ctx.channel
+        filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        Notify.send(channel.id, f"{name} requested by {ctx.author.mention}", file=(filename, text.encode()))
+        if channel != ctx.channel:
+            await ctx.send(f"Sending **{filename}** to {channel.mention}.")
+
+    @commands.command(name='profile')
+    async def profile(self, ctx, seconds: str = '30', top: int = Profiling.TOP):
+        """Profile the bot for a number of seconds (or `stop` a running profile)."""
+        if not is_admin(ctx.author.id):
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        if seconds == 'stop':
+            await ctx.send("Stopping the profile." if Profiling.stop_window() else "No profile is running.")
+            return
+
+        try:
+            await ctx.send(f"Profiling for up to **{float(seconds):.0f}s**, `!profile stop` ends it early.")
+            report = await Profiling.profile_window(float(seconds), top)
+            await self.send_report(ctx, report, 'profile')
+        except (Profiling.ProfilerBusy, ValueError) as e:
+            await ctx.send(f"Error: {e}")
+
+    @commands.command(name='tasks')
+    async def tasks(self, ctx):
+        """Dump every asyncio task and where it is waiting."""
+        if not is_admin(ctx.author.id):
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        await self.send_report(ctx, Profiling.task_dump(), 'tasks')
+
+    @commands.command(name='tracemalloc')
+    async def tracemalloc(self, ctx, action: str = 'snapshot', top: int = Profiling.TOP):
+        """Start, snapshot or stop allocation tracing."""
+        if not is_admin(ctx.author.id):
+            await ctx.send("You do not have permission to use this command.")
+            return
+
+        if action == 'start':
+            started = Profiling.tracemalloc_start()
+            await ctx.send("Tracing allocations." if started else "Already tracing allocations.")
+        elif action == 'stop':
+            stopped = Profiling.tracemalloc_stop()
+            await ctx.send("Stopped tracing allocations." if stopped else "Allocations were not being traced.")
+        elif action == 'snapshot':
+            try:
+                await self.send_report(ctx, Profiling.tracemalloc_report(top), 'tracemalloc')
+            except RuntimeError as e:
+                await ctx.send(f"Error: {e}. Use `!tracemalloc start` first.")
+        else:
+            await ctx.send("Usage: `!tracemalloc start|snapshot|stop`")
+async def setup(bot):
+    await bot.add_cog(Diagnostics(bot))
@@ -1,102 +1,284 @@
-import discord
-from discord import app_commands
-from discord.ext import commands
-
-from libs.Bank import get_bank_balance, change_balance, transfer, bank_transfer, get_user_balance, init_db
-from libs.util import is_admin, create_embed
-import random
-
-class EconomyManagement(commands.Cog):  # Corrected class name to 'EconomyManagement' and 'Cog'
-    def __init__(self, bot):
-        self.bot = bot
-
-    # Adjust command (Admin only, ephemeral)
-    @discord.app_commands.command(name="adjust", description="Adjust a user's balance (Admin only).")
-    @app_commands.describe(user="User to adjust", amount="Amount to adjust (can be negative).")
-    async def adjust(self, interaction: discord.Interaction, user: discord.Member, amount: float):
-        # Comprehensive permission checks
-        if not interaction.guild:
-            return await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
-
-        if not is_admin(interaction.user.id):
-            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
-
-        # Adjust the balance
-        try:
-            new_balance = change_balance(str(user.id), amount)
-            embed = create_embed("Balance Adjusted", f"{user.mention}'s balance has been updated to **{new_balance:.2f}**.")
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-        except Exception as e:
-            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
-
-    # Check balance command with improved permission handling
-    @discord.app_commands.command(name="balance", description="Check your balance or another user's balance.")
-    @app_commands.describe(user="User to check balance for (optional).")
-    async def balance(self, interaction: discord.Interaction, user: discord.Member = None):
-        # If no user specified, check own balance
-        target = user or interaction.user
-
-        # Only admins can check others' balances
-        if user and not is_admin(interaction.user.id):
-            return await interaction.response.send_message("You do not have permission to check others' balances.", ephemeral=True)
-
-        try:
-            balance = get_user_balance(str(target.id))
-            embed = create_embed("Balance", f"{target.mention}'s balance is **{balance:.2f}**.")
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-        except Exception as e:
-            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
-
-    # Reward command (Admin only, ephemeral)
-    @discord.app_commands.command(name="reward", description="Reward a user from the bank (Admin only).")
-    @app_commands.describe(user="User to reward", amount="Amount to reward.")
-    async def reward(self, interaction: discord.Interaction, user: discord.Member, amount: float):
-        # Comprehensive admin check
-        if not is_admin(interaction.user.id):
-            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
-
-        try:
-            _, bank_balance = bank_transfer(str(user.id), amount)
-            embed = create_embed(
-                "Reward Given",
-                f"Rewarded {user.mention} **{amount:.2f} gold** from the bank.\n"
-                f"Bank's remaining balance: **{bank_balance:.2f}**."
-            )
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-        except ValueError as e:
-            embed = create_embed("Reward Failed", str(e), color=discord.Color.red())
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-        except Exception as e:
-            await interaction.response.send_message(f"An unexpected error occurred: {str(e)}", ephemeral=True)
-    
-    @discord.app_commands.command(name="pay", description="Send money to another user.")
-    @app_commands.describe(receiver="User to send money to", amount="Amount to send.")
-    async def pay(self, interaction: discord.Interaction, receiver: discord.Member, amount: int):
-        if not interaction.guild:
-            return await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
-
-        sender_id = str(interaction.user.id)
-        receiver_id = str(receiver.id)
-
-        if sender_id == receiver_id:
-            return await interaction.response.send_message("You cannot send money to yourself.", ephemeral=True)
-
-        if amount <= 0:
-            return await interaction.response.send_message("You must send a positive amount.", ephemeral=True)
-
-        try:
-            sender_new_balance, receiver_new_balance = transfer(sender_id, receiver_id, amount)
-            embed = create_embed(
-                "Transaction Successful",
-                f"{interaction.user.mention} sent **{amount:.2f} gold** to {receiver.mention}.\n"
-                f"Your new balance: **{sender_new_balance:.2f}**.\n"
-                f"{receiver.mention}'s new balance: **{receiver_new_balance:.2f}**."
-            )
-            await interaction.response.send_message(embed=embed)
-        except ValueError as e:
-            embed = create_embed("Transaction Failed", str(e), color=discord.Color.red())
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-        except Exception as e:
-            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
-async def setup(bot):
-    await bot.add_cog(EconomyManagement(bot))  # Corrected to 'EconomyManagement'
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+
+from libs import Ledger as ledger
+from libs import Bulk, Notify
+from libs.util import is_admin, create_embed, journal_retention, is_primary
+from typing import Literal
+import io
+import random
+import tempfile
+import time
+
+HISTORY_PAGE_SIZE = 10
+LEADERBOARD_PAGE_SIZE = 10
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024  # Exports bigger than this are spooled to a temp file
+
+class EconomyManagement(commands.Cog):  # Corrected class name to 'EconomyManagement' and 'Cog'
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        if is_primary():
+            self.compact_journal.start()
+
+    async def cog_unload(self):
+        self.compact_journal.cancel()
+
+    # Keep the transaction journal bounded, old rows are folded into per-user snapshots
+    @tasks.loop(hours=24)
+    async def compact_journal(self):
+        try:
+            removed = await ledger.compact_journal(journal_retention())
+            if removed:
+                print(f'Compacted {removed} journal entries')
+        except Exception as e:
+            print(f'JOURNAL COMPACTION ERROR: {e}')
+
+    # Adjust command (Admin only, ephemeral)
+    @discord.app_commands.command(name="adjust", description="Adjust a user's balance (Admin only).")
+    @app_commands.describe(user="User to adjust", amount="Amount to adjust (can be negative).")
+    async def adjust(self, interaction: discord.Interaction, user: discord.Member, amount: float):
+        # Comprehensive permission checks
+        if not interaction.guild:
+            return await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+
+        if not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+        # Adjust the balance
+        try:
+            new_balance = await ledger.change_balance(str(user.id), amount)
+            embed = create_embed("Balance Adjusted", f"{user.mention}'s balance has been updated to **{new_balance:.2f}**.")
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+
+    # Check balance command with improved permission handling
+    @discord.app_commands.command(name="balance", description="Check your balance or another user's balance.")
+    @app_commands.describe(user="User to check balance for (optional).")
+    async def balance(self, interaction: discord.Interaction, user: discord.Member = None):
+        # If no user specified, check own balance
+        target = user or interaction.user
+
+        # Only admins can check others' balances
+        if user and not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to check others' balances.", ephemeral=True)
+
+        try:
+            balance = await ledger.get_user_balance(str(target.id))
+            embed = create_embed("Balance", f"{target.mention}'s balance is **{balance:.2f}**.")
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+
+    # Transaction history command, newest first with a button to page back
+    @discord.app_commands.command(name="history", description="Show your recent transactions or another user's.")
+    @app_commands.describe(user="User to show history for (optional).")
+    async def history(self, interaction: discord.Interaction, user: discord.Member = None):
+        target = user or interaction.user
+
+        # Only admins can check others' history
+        if user and not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to check others' history.", ephemeral=True)
+
+        def history_embed(entries, page):
+            lines = []
+            for entry in entries:
+                counterparty = entry['counterparty']
+                if counterparty and counterparty.isdigit():
+                    counterparty = f"<@{counterparty}>"
+                line = f"`{entry['amount']:+.2f}` {entry['kind']}"
+                if counterparty:
+                    line += f" ({counterparty})"
+                if entry['memo']:
+                    line += f" — {entry['memo']}"
+                lines.append(f"{line} → **{entry['balance']:.2f}** <t:{entry['ts']}:R>")
+            description = "\n".join(lines) if lines else "No transactions yet."
+            return create_embed(f"History (page {page})", f"{target.mention}\n\n{description}")
+
+        class HistoryView(discord.ui.View):
+            def __init__(self, cursor):
+                super().__init__(timeout=120)
+                self.cursor = cursor
+                self.page = 1
+                self.older.disabled = cursor is None
+
+            @discord.ui.button(label="Older", style=discord.ButtonStyle.grey)
+            async def older(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                entries, self.cursor = await ledger.get_history(str(target.id), HISTORY_PAGE_SIZE, self.cursor)
+                self.page += 1
+                button.disabled = self.cursor is None
+                await button_interaction.response.edit_message(embed=history_embed(entries, self.page), view=self)
+
+        try:
+            entries, cursor = await ledger.get_history(str(target.id), HISTORY_PAGE_SIZE)
+            await interaction.response.send_message(embed=history_embed(entries, 1), view=HistoryView(cursor), ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+
+    # Richest players, a page at a time, with the caller's own rank
+    @discord.app_commands.command(name="leaderboard", description="Show the richest players and your rank.")
+    @app_commands.describe(page="Page to start on (optional).")
+    async def leaderboard(self, interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+        user_id = str(interaction.user.id)
+
+        async def leaderboard_embed(page):
+            rows = await ledger.get_leaderboard((page - 1) * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE)
+            rank, ranked = await ledger.get_rank(user_id)
+            lines = [
+                f"**#{position}** <@{userid}> **{balance:.2f}**" + (" ← you" if userid == user_id else "")
+                for position, userid, balance in rows
+            ]
+            description = "\n".join(lines) if lines else "Nobody on this page."
+            you = f"You are **#{rank}** of {ranked}." if rank else "You are not on the leaderboard yet."
+            return create_embed(f"Leaderboard (page {page})", f"{description}\n\n{you}"), ranked
+
+        class LeaderboardView(discord.ui.View):
+            def __init__(self, page, ranked):
+                super().__init__(timeout=120)
+                self.page = page
+                self.update_buttons(ranked)
+
+            def update_buttons(self, ranked):
+                self.previous.disabled = self.page <= 1
+                self.next.disabled = self.page * LEADERBOARD_PAGE_SIZE >= ranked
+
+            async def show(self, button_interaction, page):
+                self.page = page
+                embed, ranked = await leaderboard_embed(page)
+                self.update_buttons(ranked)
+                await button_interaction.response.edit_message(embed=embed, view=self)
+
+            @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
+            async def previous(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                await self.show(button_interaction, max(1, self.page - 1))
+
+            @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
+            async def next(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                await self.show(button_interaction, self.page + 1)
+
+            @discord.ui.button(label="My rank", style=discord.ButtonStyle.blurple)
+            async def mine(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                rank, _ = await ledger.get_rank(user_id)
+                await self.show(button_interaction, (rank - 1) // LEADERBOARD_PAGE_SIZE + 1 if rank else 1)
+
+        try:
+            embed, ranked = await leaderboard_embed(page)
+            await interaction.response.send_message(embed=embed, view=LeaderboardView(page, ranked), ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+
+    # Reward command (Admin only, ephemeral)
+    @discord.app_commands.command(name="reward", description="Reward a user from the bank (Admin only).")
+    @app_commands.describe(user="User to reward", amount="Amount to reward.")
+    async def reward(self, interaction: discord.Interaction, user: discord.Member, amount: float):
+        # Comprehensive admin check
+        if not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+        try:
+            _, bank_balance = await ledger.bank_transfer(str(user.id), amount)
+            embed = create_embed(
+                "Reward Given",
+                f"Rewarded {user.mention} **{amount:.2f} gold** from the bank.\n"
+                f"Bank's remaining balance: **{bank_balance:.2f}**."
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except ValueError as e:
+            embed = create_embed("Reward Failed", str(e), color=discord.Color.red())
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An unexpected error occurred: {str(e)}", ephemeral=True)
+    
+    # Apply an attached CSV of userid,delta,memo in one transaction (Admin only, ephemeral)
+    # Runs as a dry run unless dry_run is turned off, either way the result is attached
+    @discord.app_commands.command(name="import_balances", description="Apply a CSV of userid,delta,memo to balances (Admin only).")
+    @app_commands.describe(
+        file="CSV with userid,delta,memo per line.",
+        dry_run="Only report the resulting balances (default on).",
+        source="adjust mints and burns, bank pays and collects the net total from the bank.",
+    )
+    async def import_balances(self, interaction: discord.Interaction, file: discord.Attachment, dry_run: bool = True, source: Literal['adjust', 'bank'] = 'adjust'):
+        if not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+        if file.size > Bulk.MAX_IMPORT_BYTES:
+            return await interaction.response.send_message(f"The file is too large, the limit is {Bulk.MAX_IMPORT_BYTES // 1024 // 1024} MB.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            rows, errors = Bulk.parse_rows(await file.read())
+            if errors:
+                embed = create_embed("Import Failed", "\n".join(errors[:15]) + (f"\n…and {len(errors) - 15} more" if len(errors) > 15 else ""), color=discord.Color.red())
+                return await interaction.followup.send(embed=embed, ephemeral=True)
+            if not rows:
+                return await interaction.followup.send("The file has no rows.", ephemeral=True)
+
+            report = await ledger.bulk_adjust(rows, 'import', source, dry_run)
+            embed = create_embed(
+                "Import Dry Run" if dry_run else "Import Applied",
+                f"{report['rows']} rows over {report['users']} users, net **{report['total']:+.2f}** gold" +
+                (f" from the bank.\nBank balance after: **{report['bank_balance']:.2f}**." if source == 'bank' else ".") +
+                ("\n\nNothing was changed, run again with `dry_run: False` to apply." if dry_run else ""),
+                color=discord.Color.gold() if dry_run else discord.Color.green()
+            )
+            filename = f"import-{'dry-run' if dry_run else 'applied'}-{time.strftime('%Y%m%d-%H%M%S')}.csv"
+            await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(Bulk.report_csv(report)), filename=filename), ephemeral=True)
+            if not dry_run:
+                Notify.log(f"📥 {interaction.user.mention} imported {report['rows']} balance changes ({file.filename}, net {report['total']:+.2f}, {source}).")
+        except ValueError as e:
+            embed = create_embed("Import Failed", str(e), color=discord.Color.red())
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.followup.send(f"An unexpected error occurred: {str(e)}", ephemeral=True)
+
+    # Every balance and the bank as an attachment, read in pages (Admin only, ephemeral)
+    @discord.app_commands.command(name="export_balances", description="Export every balance and the bank (Admin only).")
+    @app_commands.describe(format="csv or jsonl.", compress="gzip the file.")
+    async def export_balances(self, interaction: discord.Interaction, format: Literal['csv', 'jsonl'] = 'csv', compress: bool = False):
+        if not is_admin(interaction.user.id):
+            return await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            with tempfile.SpooledTemporaryFile(EXPORT_SPOOL_BYTES) as out:
+                count = await ledger.read(Bulk.export_balances, out, format, compress)
+                out.seek(0)
+                filename = f"balances-{time.strftime('%Y%m%d-%H%M%S')}.{format}" + (".gz" if compress else "")
+                await interaction.followup.send(f"Exported {count} users and the bank.", file=discord.File(out, filename=filename), ephemeral=True)
+        except Exception as e:
+            await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
+
+    @discord.app_commands.command(name="pay", description="Send money to another user.")
+    @app_commands.describe(receiver="User to send money to", amount="Amount to send.")
+    async def pay(self, interaction: discord.Interaction, receiver: discord.Member, amount: int):
+        if not interaction.guild:
+            return await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+
+        sender_id = str(interaction.user.id)
+        receiver_id = str(receiver.id)
+
+        if sender_id == receiver_id:
+            return await interaction.response.send_message("You cannot send money to yourself.", ephemeral=True)
+
+        if amount <= 0:
+            return await interaction.response.send_message("You must send a positive amount.", ephemeral=True)
+
+        try:
+            sender_new_balance, receiver_new_balance = await ledger.transfer(sender_id, receiver_id, amount)
+            embed = create_embed(
+                "Transaction Successful",
+                f"{interaction.user.mention} sent **{amount:.2f} gold** to {receiver.mention}.\n"
+                f"Your new balance: **{sender_new_balance:.2f}**.\n"
+                f"{receiver.mention}'s new balance: **{receiver_new_balance:.2f}**."
+            )
+            await interaction.response.send_message(embed=embed)
+        except ValueError as e:
+            embed = create_embed("Transaction Failed", str(e), color=discord.Color.red())
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+async def setup(bot):
+    await bot.add_cog(EconomyManagement(bot))  # Corrected to 'EconomyManagement'
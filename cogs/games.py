@@ -1,297 +1,558 @@
-import discord
-from discord import app_commands
-from discord.ext import commands
-import random
-
-from libs.Bank import get_bank_balance, change_balance, transfer, bank_transfer, get_user_balance, init_db
-from libs.util import is_admin, create_embed
-
-# Utility to create styled embeds
-def create_embed(title, description, color=discord.Color.blue()):
-    return discord.Embed(title=title, description=description, color=color)
-
-class Games(commands.Cog):
-    def __init__(self, bot):
-        self.bot = bot
-
-    # Coinflip command
-    @discord.app_commands.command(name="coinflip", description="Challenge another player to a coinflip game.")
-    @app_commands.describe(bet="Amount of gold to bet.", opponent="The player you want to challenge.")
-    async def coinflip(self, interaction: discord.Interaction, bet: float, opponent: discord.Member):
-        if bet <= 0:
-            return await interaction.response.send_message("Bet amount must be positive.", ephemeral=True)
-
-        user_id = str(interaction.user.id)
-        opponent_id = str(opponent.id)
-
-        user_balance = get_user_balance(user_id)
-        opponent_balance = get_user_balance(opponent_id)
-
-        if user_balance < bet:
-            return await interaction.response.send_message(f"You do not have enough balance. Your current balance is **{user_balance:.2f}**.", ephemeral=True)
-
-        if opponent_balance < bet:
-            return await interaction.response.send_message(f"{opponent.display_name} does not have enough balance to accept the bet.", ephemeral=True)
-
-        # Create the challenge message
-        embed = create_embed(
-            "Coinflip Challenge!",
-            f"{interaction.user.mention} has challenged {opponent.mention} to a coinflip for {bet} gold!\nClick 'Accept' to play!",
-            color=discord.Color.gold()
-        )
-
-        # Create the button
-        class AcceptButton(discord.ui.View):
-            def __init__(self):
-                super().__init__(timeout=30)  # Button times out after 30 seconds
-                self.accepted = False
-
-            @discord.ui.button(label="Accept", style=discord.ButtonStyle.green)
-            async def accept(self, button_interaction: discord.Interaction, button: discord.ui.Button):
-                if button_interaction.user != opponent:
-                    await button_interaction.response.send_message("You are not the challenged player!", ephemeral=True)
-                    return
-
-                self.accepted = True
-                await button_interaction.response.defer()
-                self.stop()
-
-        view = AcceptButton()
-        await interaction.response.send_message(embed=embed, view=view)
-        message = await interaction.original_response()
-
-        # Wait for button interaction or timeout
-        await view.wait()
-
-        if not view.accepted:
-            if message:
-                await message.delete()
-            return await interaction.followup.send("The coinflip challenge was not accepted in time.")
-
-        # Coinflip logic
-        winner = random.choice([interaction.user, opponent])
-        loser = opponent if winner == interaction.user else interaction.user
-
-        try:
-            change_balance(str(winner.id), bet)
-            change_balance(str(loser.id), -bet)
-
-            result_embed = create_embed(
-                "Coinflip Result",
-                f"The coin landed! {winner.mention} wins {bet:.2f} gold!\n\nBalances:\n{interaction.user.mention}: **{get_user_balance(user_id):.2f}**\n{opponent.mention}: **{get_user_balance(opponent_id):.2f}**",
-                color=discord.Color.green()
-            )
-            await interaction.followup.send(embed=result_embed)
-
-        except Exception as e:
-            await interaction.followup.send(f"An error occurred while processing the coinflip: {str(e)}")
-
-    @discord.app_commands.command(name="blackjack", description="Challenge another player to a game of blackjack.")
-    @app_commands.describe(bet="Amount of gold to bet.", opponent="The player you want to challenge.")
-    async def blackjack(self, interaction: discord.Interaction, bet: float, opponent: discord.Member):
-        if bet <= 0:
-            return await interaction.response.send_message("Bet amount must be positive.", ephemeral=True)
-
-        if interaction.user == opponent:
-            return await interaction.response.send_message("You can't challenge yourself!", ephemeral=True)
-
-        user_id = str(interaction.user.id)
-        opponent_id = str(opponent.id)
-
-        user_balance = get_user_balance(user_id)
-        opponent_balance = get_user_balance(opponent_id)
-
-        if user_balance < bet:
-            return await interaction.response.send_message(f"You do not have enough balance. Your current balance is **{user_balance:.2f}**.", ephemeral=True)
-
-        if opponent_balance < bet:
-            return await interaction.response.send_message(f"{opponent.display_name} does not have enough balance to accept the bet.", ephemeral=True)
-
-        embed = create_embed(
-            "Blackjack Challenge!",
-            f"{interaction.user.mention} has challenged {opponent.mention} to a game of blackjack for {bet} gold!\nClick 'Accept' to play!\n\n**Challenge expires in 30 seconds**",
-            color=discord.Color.gold()
-        )
-
-        class AcceptButton(discord.ui.View):
-            def __init__(self, challenger, challenged, bet):
-                super().__init__(timeout=30)
-                self.accepted = False
-                self.challenger = challenger
-                self.challenged = challenged
-                self.bet = bet
-
-            @discord.ui.button(label="Accept", style=discord.ButtonStyle.green)
-            async def accept(self, button_interaction: discord.Interaction, button: discord.ui.Button):
-                if button_interaction.user != self.challenged:
-                    await button_interaction.response.send_message("You are not the challenged player!", ephemeral=True)
-                    return
-
-                self.accepted = True
-                await button_interaction.response.defer()
-                self.stop()
-
-            async def on_timeout(self):
-                try:
-                    await self.message.edit(
-                        embed=create_embed(
-                            "Challenge Expired",
-                            f"{self.challenger.mention}'s blackjack challenge to {self.challenged.mention} has expired.",
-                            color=discord.Color.red()
-                        ),
-                        view=None
-                    )
-                except:
-                    pass
-
-        view = AcceptButton(interaction.user, opponent, bet)
-        await interaction.response.send_message(embed=embed, view=view)
-        view.message = await interaction.original_response()
-
-        await view.wait()
-
-        if not view.accepted:
-            return
-
-        deck = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11] * 4
-        random.shuffle(deck)
-
-        player1_hand = [deck.pop(), deck.pop()]
-        player2_hand = [deck.pop(), deck.pop()]
-
-        def hand_value(hand):
-            value = sum(hand)
-            aces = hand.count(11)
-            while value > 21 and aces:
-                value -= 10
-                aces -= 1
-            return value
-
-        def hand_to_string(hand):
-            return ", ".join(map(str, hand))
-
-        class BlackjackView(discord.ui.View):
-            def __init__(self, interaction, bet, player1, player2, player1_hand, player2_hand):
-                super().__init__(timeout=60)
-                self.interaction = interaction
-                self.bet = bet
-                self.player1 = player1
-                self.player2 = player2
-                self.player1_hand = player1_hand
-                self.player2_hand = player2_hand
-                self.current_player = player1
-                self.current_hand = player1_hand
-                self.other_player = player2
-                self.other_hand = player2_hand
-                self.game_over = False
-
-            async def interaction_check(self, interaction: discord.Interaction) -> bool:
-                if interaction.user != self.current_player:
-                    await interaction.response.send_message(f"It's {self.current_player.mention}'s turn!", ephemeral=True)
-                    return False
-                return True
-
-            @discord.ui.button(label="Hit", style=discord.ButtonStyle.green)
-            async def hit(self, interaction: discord.Interaction, button: discord.ui.Button):
-                self.current_hand.append(deck.pop())
-                current_value = hand_value(self.current_hand)
-
-                if current_value > 21:
-                    self.game_over = True
-                    await self.end_game(interaction)
-                    return
-
-                await interaction.response.edit_message(embed=create_embed(
-                    "Blackjack",
-                    f"{self.current_player.mention}'s turn\n\n" +
-                    f"{self.current_player.mention}'s hand: {hand_to_string(self.current_hand)} (Value: {current_value})\n" +
-                    f"{self.other_player.mention}'s hand: {self.other_hand[0]}, ?",
-                    color=discord.Color.blue()
-                ), view=self)
-
-            @discord.ui.button(label="Stand", style=discord.ButtonStyle.red)
-            async def stand(self, interaction: discord.Interaction, button: discord.ui.Button):
-                if self.current_player == self.player1:
-                    self.current_player = self.player2
-                    self.current_hand = self.player2_hand
-                    self.other_player = self.player1
-                    self.other_hand = self.player1_hand
-
-                    await interaction.response.edit_message(embed=create_embed(
-                        "Blackjack",
-                        f"{self.current_player.mention}'s turn\n\n" +
-                        f"{self.current_player.mention}'s hand: {hand_to_string(self.current_hand)} (Value: {hand_value(self.current_hand)})\n" +
-                        f"{self.other_player.mention}'s hand: {hand_value(self.other_hand)}",
-                        color=discord.Color.blue()
-                    ), view=self)
-                else:
-                    self.game_over = True
-                    await self.end_game(interaction)
-
-            async def end_game(self, interaction: discord.Interaction):
-                player1_value = hand_value(self.player1_hand)
-                player2_value = hand_value(self.player2_hand)
-
-                if player1_value > 21:
-                    winner = self.player2
-                    loser = self.player1
-                elif player2_value > 21:
-                    winner = self.player1
-                    loser = self.player2
-                elif player1_value > player2_value:
-                    winner = self.player1
-                    loser = self.player2
-                elif player2_value > player1_value:
-                    winner = self.player2
-                    loser = self.player1
-                else:
-                    try:
-                        result_embed = create_embed(
-                            "Blackjack Result",
-                            f"It's a tie! 🤝\nThe {self.bet:.2f} gold bet is split equally.\n\n" +
-                            f"Final hands:\n" +
-                            f"{self.player1.mention}: {hand_to_string(self.player1_hand)} (Value: {player1_value})\n" +
-                            f"{self.player2.mention}: {hand_to_string(self.player2_hand)} (Value: {player2_value})\n\n" +
-                            f"Balances:\n" +
-                            f"{self.player1.mention}: **{get_user_balance(str(self.player1.id)):.2f}**\n" +
-                            f"{self.player2.mention}: **{get_user_balance(str(self.player2.id)):.2f}**",
-                            color=discord.Color.gold()
-                        )
-                        await interaction.edit_original_response(embed=result_embed, view=None)
-                        return
-                    except Exception as e:
-                        await interaction.followup.send(f"An error occurred: {str(e)}")
-                        return
-
-                try:
-                    change_balance(str(winner.id), self.bet)
-                    change_balance(str(loser.id), -self.bet)
-
-                    result_embed = create_embed(
-                        "Blackjack Result",
-                        f"{winner.mention} wins {self.bet:.2f} gold! 🎉\n\n" +
-                        f"Final hands:\n" +
-                        f"{self.player1.mention}: {hand_to_string(self.player1_hand)} (Value: {player1_value})\n" +
-                        f"{self.player2.mention}: {hand_to_string(self.player2_hand)} (Value: {player2_value})\n\n" +
-                        f"Balances:\n" +
-                        f"{self.player1.mention}: **{get_user_balance(str(self.player1.id)):.2f}**\n" +
-                        f"{self.player2.mention}: **{get_user_balance(str(self.player2.id)):.2f}**",
-                        color=discord.Color.green()
-                    )
-                    await interaction.edit_original_response(embed=result_embed, view=None)
-                except Exception as e:
-                    await interaction.followup.send(f"An error occurred: {str(e)}")
-
-        # Initial game view
-        view = BlackjackView(interaction, bet, interaction.user, opponent, player1_hand, player2_hand)
-        initial_embed = create_embed(
-            "Blackjack",
-            f"{interaction.user.mention}'s turn\n\n" +
-            f"{interaction.user.mention}'s hand: {hand_to_string(player1_hand)} (Value: {hand_value(player1_hand)})\n" +
-            f"{opponent.mention}'s hand: {player2_hand[0]}, ?",
-            color=discord.Color.blue()
-        )
-        await interaction.followup.send(embed=initial_embed, view=view)
-
-async def setup(bot):
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+import random
+import asyncio
+from typing import Literal
+
+from libs import Ledger as ledger
+from libs import Blackjack, House, Notify
+from libs.Blackjack import CARD_VALUES, hand_value, hand_to_string
+from libs.util import is_admin, create_embed, is_primary
+
+HOLD_SWEEP_INTERVAL = 60  # Seconds between sweeps for expired bet holds
+GAME_SWEEP_INTERVAL = 15  # Seconds between sweeps for blackjack games nobody is playing
+
+# Utility to create styled embeds
+def create_embed(title, description, color=discord.Color.blue()):
+    return discord.Embed(title=title, description=description, color=color)
+
+# Give back the bets of a game that won't be settled, holds already gone are skipped
+async def release_holds(hold_ids):
+    for hold_id in hold_ids:
+        try:
+            await ledger.release_hold(hold_id)
+        except Exception as e:
+            print(f'HOLD RELEASE ERROR: {e}')
+
+# Embed for a blackjack game in progress
+def blackjack_turn_embed(session):
+    current, other = session.turn, 1 - session.turn
+    # The second player already saw the first player's cards get played out
+    other_hand = f"{hand_value(session.hands[other])}" if session.turn else f"{CARD_VALUES[session.hands[other][0]]}, ?"
+    return create_embed(
+        "Blackjack",
+        f"<@{session.players[current]}>'s turn\n\n" +
+        f"<@{session.players[current]}>'s hand: {hand_to_string(session.hands[current])} (Value: {hand_value(session.hands[current])})\n" +
+        f"<@{session.players[other]}>'s hand: {other_hand}",
+        color=discord.Color.blue()
+    )
+
+def blackjack_result_embed(session, balances):
+    player1, player2 = session.players
+    winner = session.winner()
+    if winner is None:
+        headline, color = f"It's a tie! 🤝\nThe {session.bet:.2f} gold bet is split equally.", discord.Color.gold()
+    else:
+        headline, color = f"<@{session.players[winner]}> wins {session.bet:.2f} gold! 🎉", discord.Color.green()
+    return create_embed(
+        "Blackjack Result",
+        f"{headline}\n\n" +
+        f"Final hands:\n" +
+        f"<@{player1}>: {hand_to_string(session.hands[0])} (Value: {hand_value(session.hands[0])})\n" +
+        f"<@{player2}>: {hand_to_string(session.hands[1])} (Value: {hand_value(session.hands[1])})\n\n" +
+        f"Balances:\n" +
+        f"<@{player1}>: **{balances[player1]:.2f}**\n" +
+        f"<@{player2}>: **{balances[player2]:.2f}**",
+        color=color
+    )
+
+# Hit and Stand buttons of one session, the custom ids carry the session id so clicks are
+# routed to the game even after a restart (BlackjackButton is registered in cog_load)
+class BlackjackButton(discord.ui.DynamicItem[discord.ui.Button], template=r'blackjack:(?P<action>hit|stand):(?P<session>[0-9]+)'):
+    def __init__(self, action, session_id):
+        super().__init__(discord.ui.Button(
+            label=action.capitalize(),
+            style=discord.ButtonStyle.green if action == 'hit' else discord.ButtonStyle.red,
+            custom_id=f'blackjack:{action}:{session_id}',
+        ))
+        self.action = action
+        self.session_id = session_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['action'], int(match['session']))
+
+    async def callback(self, interaction: discord.Interaction):
+        await play_blackjack(interaction, self.action, self.session_id)
+
+def blackjack_view(session):
+    view = discord.ui.View(timeout=None)
+    view.add_item(BlackjackButton('hit', session.id))
+    view.add_item(BlackjackButton('stand', session.id))
+    return view
+
+async def play_blackjack(interaction: discord.Interaction, action, session_id):
+    session = Blackjack.sessions.get(session_id)
+    if session is None:
+        loaded = await ledger.read(Blackjack.load_session, session_id)
+        if loaded is not None:
+            Blackjack.sessions.put(loaded)
+        session = Blackjack.sessions.get(session_id)
+    if session is None:
+        return await interaction.response.send_message("This game is over.", ephemeral=True)
+
+    if str(interaction.user.id) != session.current_player:
+        return await interaction.response.send_message(f"It's <@{session.current_player}>'s turn!", ephemeral=True)
+
+    game_over = session.hit() if action == 'hit' else session.stand()
+    if not game_over:
+        await ledger.write(Blackjack.save_session, session)
+        return await interaction.response.edit_message(embed=blackjack_turn_embed(session), view=blackjack_view(session))
+
+    if not Blackjack.sessions.close(session_id):
+        return await interaction.response.send_message("This game is over.", ephemeral=True)
+    try:
+        balances = await ledger.write(Blackjack.finish_session, session)
+        if not balances:
+            player1_balance, player2_balance = await asyncio.gather(*(ledger.get_user_balance(x) for x in session.players))
+            balances = dict(zip(session.players, (player1_balance, player2_balance)))
+        await interaction.response.edit_message(embed=blackjack_result_embed(session, balances), view=None)
+    except Exception as e:
+        try:
+            await ledger.write(Blackjack.abandon_session, session)
+        except Exception as abandon_error:
+            print(f'BLACKJACK ABANDON ERROR: {abandon_error}')
+        send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
+        await send(f"An error occurred: {str(e)}")
+    finally:
+        Blackjack.sessions.closed(session_id)
+
+# Reserve the stake of a game against the casino along with the most the bank could pay
+# out on it. Returns (hold id, exposure), or None after telling the player why not
+async def open_house_bet(interaction: discord.Interaction, game, bet, target=None):
+    if bet <= 0:
+        await interaction.response.send_message("Bet amount must be positive.", ephemeral=True)
+        return None
+
+    bank_balance = await ledger.get_bank_balance()
+    limit = House.max_bet(game, bank_balance, target)
+    if bet > limit:
+        await interaction.response.send_message(f"The casino takes bets of up to **{limit:.2f}** gold on this game right now.", ephemeral=True)
+        return None
+
+    exposure = round(bet * (House.max_multiplier(game, target) - 1), 2)
+    if not House.exposure.reserve(exposure, bank_balance):
+        await interaction.response.send_message("The casino can't cover this bet right now, try a smaller one.", ephemeral=True)
+        return None
+
+    try:
+        hold = await ledger.place_hold(str(interaction.user.id), bet, f'house_{game}')
+    except ValueError:
+        House.exposure.release(exposure)
+        user_balance = await ledger.get_available_balance(str(interaction.user.id))
+        await interaction.response.send_message(f"You do not have enough balance. Your available balance is **{user_balance:.2f}**.", ephemeral=True)
+        return None
+    return hold, exposure
+
+# Pay out (or collect) a finished house game, returns (user_balance, bank_balance)
+# The stake goes back to the player if the settlement fails
+async def close_house_bet(hold, exposure, net, game):
+    try:
+        return await ledger.settle_house(hold, net, f'house_{game}')
+    except Exception:
+        await release_holds([hold])
+        raise
+    finally:
+        House.exposure.release(exposure)
+
+def house_result_line(net):
+    if net > 0:
+        return f"You win **{net:.2f}** gold! 🎉", discord.Color.green()
+    if net < 0:
+        return f"The house wins **{-net:.2f}** gold.", discord.Color.red()
+    return "Push, your bet is returned. 🤝", discord.Color.gold()
+
+def house_blackjack_embed(hand, bet, reveal=False):
+    dealer = f"{hand_to_string(hand.dealer)} (Value: {hand_value(hand.dealer)})" if reveal else f"{CARD_VALUES[hand.dealer[0]]}, ?"
+    return create_embed(
+        "Blackjack vs House",
+        f"Bet: {bet:.2f} gold\n\n" +
+        f"Your hand: {hand_to_string(hand.player)} (Value: {hand_value(hand.player)})\n" +
+        f"Dealer's hand: {dealer}",
+        color=discord.Color.blue()
+    )
+
+class Games(commands.Cog):
+    house = app_commands.Group(name="house", description="Play against the casino.")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.calibration = None
+
+    async def cog_load(self):
+        self.bot.add_dynamic_items(BlackjackButton)
+        # With several processes the shared jobs run once, on the primary
+        if is_primary():
+            resumed = await ledger.write(Blackjack.resume_sessions)
+            if resumed:
+                print(f'Resumed {resumed} blackjack games')
+            self.sweep_holds.start()
+        self.expire_games.start()
+        self.calibration = asyncio.create_task(self.calibrate_house())
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(BlackjackButton)
+        self.sweep_holds.cancel()
+        self.expire_games.cancel()
+        if self.calibration:
+            self.calibration.cancel()
+
+    # Size the house bet limits from the Monte Carlo, off the event loop and once per process
+    # (a reload reuses the result). Until it finishes (or without numpy) House.DEFAULT_WIN_FRACTION applies
+    async def calibrate_house(self):
+        try:
+            results = await asyncio.to_thread(House.calibrate_once)
+        except ImportError:
+            print('numpy is not installed, house bet limits stay at the defaults')
+            return
+        except Exception as e:
+            print(f'HOUSE CALIBRATION ERROR: {e}')
+            return
+        for game, result in results.items():
+            lowest = ' (lowest over the targets)' if game == 'dice' else ''
+            print(f"House {game}: RTP {result['rtp']:.2%}, max payout {result['win_fraction']:.2%} of the bank{lowest}")
+
+    # Free the bets of games that never finished (bot restarted, view lost)
+    @tasks.loop(seconds=HOLD_SWEEP_INTERVAL)
+    async def sweep_holds(self):
+        try:
+            released = await ledger.release_expired_holds()
+            if released:
+                print(f'Released {released} expired bet holds')
+        except Exception as e:
+            print(f'HOLD SWEEP ERROR: {e}')
+
+    # Whether a game was started in a channel this process can see (always, unsharded)
+    def owns(self, session):
+        if self.bot.shard_count is None:
+            return True
+        if not session.channel_id:
+            return is_primary()
+        return self.bot.get_channel(session.channel_id) is not None
+
+    # Call off blackjack games where the player to act went quiet, both bets go back
+    @tasks.loop(seconds=GAME_SWEEP_INTERVAL)
+    async def expire_games(self):
+        try:
+            stale = await ledger.read(Blackjack.stale_sessions)
+        except Exception as e:
+            print(f'GAME SWEEP ERROR: {e}')
+            return
+
+        for session in stale:
+            # Each process calls off the games in its own shards' channels
+            if not self.owns(session) or not Blackjack.sessions.close(session.id):
+                continue
+            try:
+                await ledger.write(Blackjack.abandon_session, session)
+            except Exception as e:
+                print(f'GAME SWEEP ERROR: {e}')
+                continue
+            finally:
+                Blackjack.sessions.closed(session.id)
+
+            if session.channel_id and session.message_id:
+                Notify.edit(session.channel_id, session.message_id, embed=create_embed(
+                    "Blackjack",
+                    f"<@{session.current_player}> took too long, the game is called off and both bets are returned.",
+                    color=discord.Color.red()
+                ), view=None)
+
+    # Coinflip command
+    @discord.app_commands.command(name="coinflip", description="Challenge another player to a coinflip game.")
+    @app_commands.describe(bet="Amount of gold to bet.", opponent="The player you want to challenge.")
+    async def coinflip(self, interaction: discord.Interaction, bet: float, opponent: discord.Member):
+        if bet <= 0:
+            return await interaction.response.send_message("Bet amount must be positive.", ephemeral=True)
+
+        if interaction.user == opponent:
+            return await interaction.response.send_message("You can't challenge yourself!", ephemeral=True)
+
+        user_id = str(interaction.user.id)
+        opponent_id = str(opponent.id)
+
+        if await ledger.get_available_balance(opponent_id) < bet:
+            return await interaction.response.send_message(f"{opponent.display_name} does not have enough balance to accept the bet.", ephemeral=True)
+
+        # The challenger's bet is reserved until the game is settled or called off
+        try:
+            user_hold = await ledger.place_hold(user_id, bet, 'coinflip')
+        except ValueError:
+            user_balance = await ledger.get_available_balance(user_id)
+            return await interaction.response.send_message(f"You do not have enough balance. Your available balance is **{user_balance:.2f}**.", ephemeral=True)
+
+        # Create the challenge message
+        embed = create_embed(
+            "Coinflip Challenge!",
+            f"{interaction.user.mention} has challenged {opponent.mention} to a coinflip for {bet} gold!\nClick 'Accept' to play!",
+            color=discord.Color.gold()
+        )
+
+        # Create the button
+        class AcceptButton(discord.ui.View):
+            def __init__(self):
+                super().__init__(timeout=30)  # Button times out after 30 seconds
+                self.accepted = False
+                self.hold = None
+
+            @discord.ui.button(label="Accept", style=discord.ButtonStyle.green)
+            async def accept(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                if button_interaction.user != opponent:
+                    await button_interaction.response.send_message("You are not the challenged player!", ephemeral=True)
+                    return
+
+                # Claimed before the first await so a double click can't place two holds
+                if self.accepted:
+                    return await button_interaction.response.defer()
+                self.accepted = True
+                try:
+                    hold = await ledger.place_hold(opponent_id, bet, 'coinflip')
+                except ValueError:
+                    self.accepted = False
+                    await button_interaction.response.send_message("You do not have enough balance to accept the bet.", ephemeral=True)
+                    return
+                if self.is_finished():  # Timed out while the hold was placed
+                    await release_holds([hold])
+                    return await button_interaction.response.defer()
+
+                self.hold = hold
+                await button_interaction.response.defer()
+                self.stop()
+
+        view = AcceptButton()
+        await interaction.response.send_message(embed=embed, view=view)
+        message = await interaction.original_response()
+
+        # Wait for button interaction or timeout
+        await view.wait()
+
+        if view.hold is None:
+            await release_holds([user_hold])
+            if message:
+                await message.delete()
+            return await interaction.followup.send("The coinflip challenge was not accepted in time.")
+
+        # Coinflip logic
+        winner = random.choice([interaction.user, opponent])
+        loser = opponent if winner == interaction.user else interaction.user
+
+        try:
+            balances = await ledger.capture_holds([user_hold, view.hold], {str(winner.id): bet, str(loser.id): -bet}, 'coinflip')
+            user_balance, opponent_balance = balances[user_id], balances[opponent_id]
+
+            result_embed = create_embed(
+                "Coinflip Result",
+                f"The coin landed! {winner.mention} wins {bet:.2f} gold!\n\nBalances:\n{interaction.user.mention}: **{user_balance:.2f}**\n{opponent.mention}: **{opponent_balance:.2f}**",
+                color=discord.Color.green()
+            )
+            await interaction.followup.send(embed=result_embed)
+
+        except Exception as e:
+            await release_holds([user_hold, view.hold])
+            await interaction.followup.send(f"An error occurred while processing the coinflip: {str(e)}")
+
+    @discord.app_commands.command(name="blackjack", description="Challenge another player to a game of blackjack.")
+    @app_commands.describe(bet="Amount of gold to bet.", opponent="The player you want to challenge.")
+    async def blackjack(self, interaction: discord.Interaction, bet: float, opponent: discord.Member):
+        if bet <= 0:
+            return await interaction.response.send_message("Bet amount must be positive.", ephemeral=True)
+
+        if interaction.user == opponent:
+            return await interaction.response.send_message("You can't challenge yourself!", ephemeral=True)
+
+        user_id = str(interaction.user.id)
+        opponent_id = str(opponent.id)
+
+        if await ledger.get_available_balance(opponent_id) < bet:
+            return await interaction.response.send_message(f"{opponent.display_name} does not have enough balance to accept the bet.", ephemeral=True)
+
+        # The challenger's bet is reserved until the game is settled or called off
+        try:
+            user_hold = await ledger.place_hold(user_id, bet, 'blackjack')
+        except ValueError:
+            user_balance = await ledger.get_available_balance(user_id)
+            return await interaction.response.send_message(f"You do not have enough balance. Your available balance is **{user_balance:.2f}**.", ephemeral=True)
+
+        embed = create_embed(
+            "Blackjack Challenge!",
+            f"{interaction.user.mention} has challenged {opponent.mention} to a game of blackjack for {bet} gold!\nClick 'Accept' to play!\n\n**Challenge expires in 30 seconds**",
+            color=discord.Color.gold()
+        )
+
+        class AcceptButton(discord.ui.View):
+            def __init__(self, challenger, challenged, bet):
+                super().__init__(timeout=30)
+                self.accepted = False
+                self.challenger = challenger
+                self.challenged = challenged
+                self.bet = bet
+                self.hold = None
+
+            @discord.ui.button(label="Accept", style=discord.ButtonStyle.green)
+            async def accept(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                if button_interaction.user != self.challenged:
+                    await button_interaction.response.send_message("You are not the challenged player!", ephemeral=True)
+                    return
+
+                # Claimed before the first await so a double click can't place two holds
+                if self.accepted:
+                    return await button_interaction.response.defer()
+                self.accepted = True
+                try:
+                    hold = await ledger.place_hold(str(self.challenged.id), self.bet, 'blackjack')
+                except ValueError:
+                    self.accepted = False
+                    await button_interaction.response.send_message("You do not have enough balance to accept the bet.", ephemeral=True)
+                    return
+                if self.is_finished():  # Timed out while the hold was placed
+                    await release_holds([hold])
+                    return await button_interaction.response.defer()
+
+                self.hold = hold
+                await button_interaction.response.defer()
+                self.stop()
+
+            async def on_timeout(self):
+                try:
+                    await self.message.edit(
+                        embed=create_embed(
+                            "Challenge Expired",
+                            f"{self.challenger.mention}'s blackjack challenge to {self.challenged.mention} has expired.",
+                            color=discord.Color.red()
+                        ),
+                        view=None
+                    )
+                except:
+                    pass
+
+        view = AcceptButton(interaction.user, opponent, bet)
+        await interaction.response.send_message(embed=embed, view=view)
+        view.message = await interaction.original_response()
+
+        await view.wait()
+
+        if view.hold is None:
+            await release_holds([user_hold])
+            return
+
+        # From here the game lives in a checkpointed session, the buttons find it by id
+        session = Blackjack.Session.deal(user_id, opponent_id, bet, (user_hold, view.hold))
+        try:
+            await ledger.write(Blackjack.save_session, session)
+            message = await interaction.followup.send(embed=blackjack_turn_embed(session), view=blackjack_view(session))
+            session.channel_id, session.message_id = message.channel.id, message.id
+            await ledger.write(Blackjack.save_session, session)
+            Blackjack.sessions.put(session)
+        except Exception as e:
+            if session.id is not None:
+                await ledger.write(Blackjack.abandon_session, session)
+            else:
+                await release_holds(session.holds)
+            await interaction.followup.send(f"An error occurred: {str(e)}")
+
+    @house.command(name="coinflip", description="Flip a coin against the casino.")
+    @app_commands.describe(bet="Amount of gold to bet.", side="Heads or tails.")
+    async def house_coinflip(self, interaction: discord.Interaction, bet: float, side: Literal['heads', 'tails']):
+        opened = await open_house_bet(interaction, 'coinflip', bet)
+        if opened is None:
+            return
+        hold, exposure = opened
+
+        landed = random.choice(['heads', 'tails'])
+        net = bet * (House.COINFLIP_PAYOUT - 1) if landed == side else -bet
+        try:
+            user_balance, _ = await close_house_bet(hold, exposure, net, 'coinflip')
+        except Exception as e:
+            return await interaction.response.send_message(f"An error occurred while processing the coinflip: {str(e)}", ephemeral=True)
+
+        line, color = house_result_line(net)
+        await interaction.response.send_message(embed=create_embed(
+            "Coinflip vs House",
+            f"The coin landed on **{landed}**! {line}\n\nYour balance: **{user_balance:.2f}**",
+            color=color
+        ))
+
+    @house.command(name="dice", description="Roll 1-100 against the casino, win if the roll is at most your target.")
+    @app_commands.describe(bet="Amount of gold to bet.", target="Win when the roll is at or below this, lower pays more.")
+    async def house_dice(self, interaction: discord.Interaction, bet: float, target: app_commands.Range[int, House.DICE_TARGETS[0], House.DICE_TARGETS[1]]):
+        opened = await open_house_bet(interaction, 'dice', bet, target)
+        if opened is None:
+            return
+        hold, exposure = opened
+
+        roll = House.roll_dice()
+        multiplier = House.dice_multiplier(target)
+        net = bet * (multiplier - 1) if roll <= target else -bet
+        try:
+            user_balance, _ = await close_house_bet(hold, exposure, net, 'dice')
+        except Exception as e:
+            return await interaction.response.send_message(f"An error occurred while processing the roll: {str(e)}", ephemeral=True)
+
+        line, color = house_result_line(net)
+        await interaction.response.send_message(embed=create_embed(
+            "Dice vs House",
+            f"Rolled **{roll}** (target ≤ {target}, pays {multiplier:.2f}×). {line}\n\nYour balance: **{user_balance:.2f}**",
+            color=color
+        ))
+
+    @house.command(name="blackjack", description="Play blackjack against the casino's dealer.")
+    @app_commands.describe(bet="Amount of gold to bet.")
+    async def house_blackjack(self, interaction: discord.Interaction, bet: float):
+        opened = await open_house_bet(interaction, 'blackjack', bet)
+        if opened is None:
+            return
+        hold, exposure = opened
+        hand = House.Hand()
+
+        class HouseBlackjackView(discord.ui.View):
+            def __init__(self):
+                super().__init__(timeout=Blackjack.TURN_TIMEOUT)  # Standing when the player goes quiet
+
+            async def interaction_check(self, button_interaction: discord.Interaction):
+                if button_interaction.user != interaction.user:
+                    await button_interaction.response.send_message("This isn't your game!", ephemeral=True)
+                    return False
+                return True
+
+            @discord.ui.button(label="Hit", style=discord.ButtonStyle.green)
+            async def hit(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                if self.is_finished():
+                    return await button_interaction.response.defer()
+                if hand.hit():
+                    self.stop()
+                    return await button_interaction.response.defer()
+                await button_interaction.response.edit_message(embed=house_blackjack_embed(hand, bet), view=self)
+
+            @discord.ui.button(label="Stand", style=discord.ButtonStyle.red)
+            async def stand(self, button_interaction: discord.Interaction, button: discord.ui.Button):
+                self.stop()
+                await button_interaction.response.defer()
+
+        try:
+            if hand.settled_on_deal():
+                await interaction.response.send_message(embed=house_blackjack_embed(hand, bet, reveal=True))
+            else:
+                view = HouseBlackjackView()
+                await interaction.response.send_message(embed=house_blackjack_embed(hand, bet), view=view)
+                await view.wait()
+                hand.play_dealer()
+        except Exception:
+            House.exposure.release(exposure)
+            await release_holds([hold])
+            raise
+
+        net = round(hand.result() * bet, 2)
+        try:
+            user_balance, _ = await close_house_bet(hold, exposure, net, 'blackjack')
+        except Exception as e:
+            return await interaction.followup.send(f"An error occurred while settling the game: {str(e)}")
+
+        line, color = house_result_line(net)
+        embed = house_blackjack_embed(hand, bet, reveal=True)
+        embed.title, embed.color = "Blackjack vs House Result", color
+        embed.description += f"\n\n{line}\nYour balance: **{user_balance:.2f}**"
+        await interaction.edit_original_response(embed=embed, view=None)
+
+async def setup(bot):
     await bot.add_cog(Games(bot))
\ No newline at end of file
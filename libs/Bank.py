@@ -1,96 +1,681 @@
-import os
-import sqlite3
-
-# Define paths
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # Parent directory of 'libs'
-DB_PATH = os.path.join(BASE_DIR, 'store', 'users.db')
-
-# Initialize the database if not exists
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                userid TEXT PRIMARY KEY,
-                balance REAL DEFAULT 0.0
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bank (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                balance REAL DEFAULT 0.0
-            )
-        ''')
-        # Initialize the bank balance if not exists
-        cursor.execute('''
-            INSERT INTO bank (balance)
-            SELECT 0.0 WHERE NOT EXISTS (SELECT 1 FROM bank)
-        ''')
-        conn.commit()
-
-# Get user balance
-def get_user_balance(userid):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT balance FROM users WHERE userid = ?', (userid,))
-        result = cursor.fetchone()
-        if result is None:
-            cursor.execute('INSERT INTO users (userid) VALUES (?)', (userid,))
-            conn.commit()
-            return 0.0
-        return result[0]
-
-# Get bank balance
-def get_bank_balance():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT balance FROM bank')
-        result = cursor.fetchone()
-        return result[0] if result else 0.0    
-
-# Update user balance
-def change_balance(userid, amount):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        current_balance = get_user_balance(userid)
-        new_balance = current_balance + amount
-        cursor.execute('UPDATE users SET balance = ? WHERE userid = ?', (new_balance, userid))
-        conn.commit()
-        return new_balance
-
-# Transfer between users
-def transfer(sender, receiver, amount):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        sender_balance = get_user_balance(sender)
-        if sender_balance < amount:
-            raise ValueError(f"{sender} has insufficient funds.")
-        receiver_balance = get_user_balance(receiver)
-        cursor.execute('UPDATE users SET balance = ? WHERE userid = ?', (sender_balance - amount, sender))
-        cursor.execute('UPDATE users SET balance = ? WHERE userid = ?', (receiver_balance + amount, receiver))
-        conn.commit()
-        return sender_balance - amount, receiver_balance + amount
-
-# Transfer to/from bank
-def bank_transfer(userid, amount):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        current_balance = get_user_balance(userid)
-        cursor.execute('SELECT balance FROM bank')
-        bank_balance = cursor.fetchone()[0]
-
-        # Moving money from user to bank
-        if amount < 0 and current_balance >= abs(amount):
-            cursor.execute('UPDATE users SET balance = ? WHERE userid = ?', (current_balance + amount, userid))
-            cursor.execute('UPDATE bank SET balance = ?', (bank_balance - amount,))
-        # Moving money from bank to user
-        elif amount > 0 and bank_balance >= amount:
-            cursor.execute('UPDATE users SET balance = ? WHERE userid = ?', (current_balance + amount, userid))
-            cursor.execute('UPDATE bank SET balance = ?', (bank_balance - amount,))
-        else:
-            raise ValueError("Insufficient funds in bank or user account.")
-        conn.commit()
-        return current_balance + amount, bank_balance - amount
-
-# Ensure database is ready
-init_db()
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+from libs import Leaderboard, Metrics
+from libs.Database import DB_PATH, connection, transaction, savepoint, snapshot, after_commit
+
+_db_seconds = Metrics.histogram('casino_db_call_seconds', 'Time spent in libs.Bank calls', ('call',))
+_db_errors = Metrics.counter('casino_db_call_errors_total', 'libs.Bank calls that raised', ('call',))
+
+# Time a public Bank function under its own name
+def _timed(func):
+    return Metrics.timed(_db_seconds, func.__name__, _db_errors)(func)
+
+# In-process LRU of balances, filled by reads and kept current by every write
+# Writes store their new balance once the transaction commits, so a read never sees a
+# value that was rolled back. Reads only fill the cache if no write landed while they
+# were reading, otherwise a slow read could put back an older balance. It assumes this
+# process is the only writer to the database
+class BalanceCache:
+    def __init__(self, size=10000):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None, self._epoch
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, self._epoch
+
+    # Like get, but a miss is not counted (the caller falls back to a counted get)
+    def peek(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    # Store a value read from the database at `epoch` (as returned by get)
+    def fill(self, key, value, epoch):
+        with self._lock:
+            if epoch == self._epoch:
+                self._store(key, value)
+
+    # Store committed balances from a write
+    def update(self, values):
+        with self._lock:
+            self._epoch += 1
+            for key, value in values.items():
+                self._store(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._entries),
+            'capacity': self.size,
+        }
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+# Cache key for the bank balance, user ids are discord snowflakes so they never clash
+BANK_KEY = ':bank'
+
+cache = BalanceCache(int(os.getenv('BALANCE_CACHE_SIZE') or 10000))
+
+def cache_stats():
+    return cache.stats()
+
+# Seconds a hold lasts unless captured or released first, the sweeper frees what is left
+# over from games that never finished (bot restarts, abandoned views)
+HOLD_TTL = int(os.getenv('HOLD_TTL') or 900)
+
+# Funds reserved by open holds, {userid: amount}, mirrors users.held
+# Updated after commit like the balance cache, so the available balance of a cached user
+# is two dictionary lookups
+held = {}
+_held_lock = threading.Lock()
+
+def _set_held(values):
+    with _held_lock:
+        for userid, amount in values.items():
+            if amount > 1e-9:
+                held[userid] = amount
+            else:
+                held.pop(userid, None)
+
+Metrics.register_collector('balance_cache', cache_stats)
+
+# Users with a positive balance ordered richest first, loaded by init_db() and kept current
+# by _record() after every commit, so /leaderboard and rank lookups never touch the disk
+leaderboard = Leaderboard.RankIndex()
+
+# Initialize the database if not exists
+def init_db():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                userid TEXT PRIMARY KEY,
+                balance REAL DEFAULT 0.0
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS bank (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                balance REAL DEFAULT 0.0
+            )
+        ''')
+        # Initialize the bank balance if not exists
+        conn.execute('''
+            INSERT INTO bank (balance)
+            SELECT 0.0 WHERE NOT EXISTS (SELECT 1 FROM bank)
+        ''')
+        # Append-only journal, one row per balance change written in the same transaction
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                userid TEXT NOT NULL,
+                amount REAL NOT NULL,
+                balance REAL NOT NULL,
+                kind TEXT NOT NULL,
+                counterparty TEXT,
+                ts INTEGER NOT NULL
+            )
+        ''')
+        # Funds reserved for a game in progress, users.held is the sum of a user's rows
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS holds (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                userid TEXT NOT NULL,
+                amount REAL NOT NULL,
+                reason TEXT NOT NULL,
+                created INTEGER NOT NULL,
+                expires INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_holds_expires ON holds (expires)')
+        if 'held' not in [row[1] for row in conn.execute('PRAGMA table_info(users)')]:
+            conn.execute('ALTER TABLE users ADD COLUMN held REAL NOT NULL DEFAULT 0.0')
+        # Free text note on a journal row, e.g. the memo column of a bulk import
+        if 'memo' not in [row[1] for row in conn.execute('PRAGMA table_info(transactions)')]:
+            conn.execute('ALTER TABLE transactions ADD COLUMN memo TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (userid, ts, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_ts ON transactions (ts)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)')
+        # Journal rows folded away by compact_journal(), one running total per user
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS journal_snapshots (
+                userid TEXT PRIMARY KEY,
+                amount REAL NOT NULL,
+                entries INTEGER NOT NULL,
+                ts INTEGER NOT NULL
+            )
+        ''')
+        # Holds outlive a restart, reload what they reserve
+        rows = conn.execute('SELECT userid, SUM(amount) FROM holds GROUP BY userid').fetchall()
+        # Everyone with money goes on the leaderboard, a range scan of idx_users_balance
+        ranked = conn.execute('SELECT userid, balance FROM users WHERE balance > 0').fetchall()
+    leaderboard.reset(dict(ranked))
+    with _held_lock:
+        held.clear()
+    _set_held(dict(rows))
+
+# Journal kinds used by the bot, kind is free text so new games can add their own
+KINDS = ('deposit', 'pay', 'coinflip', 'blackjack', 'adjust', 'reward', 'import')
+
+# Record balance changes, rows are (userid, amount, new_balance, counterparty)
+# Every write goes through here, it journals the change and refreshes the balance cache
+# memos, if given, holds one note per row
+def _record(conn, kind, rows, memos=None):
+    ts = int(time.time())
+    memos = memos or [None] * len(rows)
+    conn.executemany(
+        'INSERT INTO transactions (userid, amount, balance, kind, counterparty, ts, memo) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [
+            (str(userid), amount, balance, kind, None if other is None else str(other), ts, memo)
+            for (userid, amount, balance, other), memo in zip(rows, memos)
+        ]
+    )
+    balances = {str(userid): balance for userid, _, balance, _ in rows}
+    after_commit(lambda: cache.update(balances))
+    after_commit(lambda: leaderboard.update(balances))
+
+# Read a balance on an open connection, creating the user row if needed
+def _balance(conn, userid):
+    result = conn.execute('SELECT balance FROM users WHERE userid = ?', (userid,)).fetchone()
+    if result is None:
+        conn.execute('INSERT INTO users (userid) VALUES (?)', (userid,))
+        return 0.0
+    return result[0]
+
+# Funds a user has on hold, on an open connection (0 for unknown users)
+def _held(conn, userid):
+    result = conn.execute('SELECT held FROM users WHERE userid = ?', (userid,)).fetchone()
+    return result[0] if result else 0.0
+
+# Get user balance, 0 for users without a row (only the write paths create rows, so reads
+# never take the write lock)
+@_timed
+def get_user_balance(userid):
+    balance, epoch = cache.get(str(userid))
+    if balance is not None:
+        return balance
+
+    result = connection().execute('SELECT balance FROM users WHERE userid = ?', (str(userid),)).fetchone()
+    balance = result[0] if result else 0.0
+    cache.fill(str(userid), balance, epoch)
+    return balance
+
+# Balance minus what is on hold, what a user can still bet or pay with
+@_timed
+def get_available_balance(userid):
+    return get_user_balance(userid) - held.get(str(userid), 0.0)
+
+# Get bank balance
+@_timed
+def get_bank_balance():
+    balance, epoch = cache.get(BANK_KEY)
+    if balance is not None:
+        return balance
+
+    result = connection().execute('SELECT balance FROM bank').fetchone()
+    balance = result[0] if result else 0.0
+    cache.fill(BANK_KEY, balance, epoch)
+    return balance
+
+# Update user balance, a debit the user's available balance can't cover raises ValueError
+@_timed
+def change_balance(userid, amount, kind='adjust', counterparty=None):
+    with transaction() as conn:
+        new_balance = _balance(conn, userid) + amount
+        if amount < 0 and new_balance - _held(conn, userid) < 0:
+            raise ValueError(f"{userid} has insufficient funds.")
+        conn.execute('UPDATE users SET balance = ? WHERE userid = ?', (new_balance, userid))
+        _record(conn, kind, [(userid, amount, new_balance, counterparty)])
+        return new_balance
+
+# Transfer between users
+@_timed
+def transfer(sender, receiver, amount, kind='pay'):
+    # Both balances are read before either is written, to oneself that would mint `amount`
+    if str(sender) == str(receiver):
+        raise ValueError("You cannot send money to yourself.")
+    with transaction() as conn:
+        sender_balance = _balance(conn, sender)
+        if sender_balance - _held(conn, sender) < amount:
+            raise ValueError(f"{sender} has insufficient funds.")
+        receiver_balance = _balance(conn, receiver)
+        conn.execute('UPDATE users SET balance = ? WHERE userid = ?', (sender_balance - amount, sender))
+        conn.execute('UPDATE users SET balance = ? WHERE userid = ?', (receiver_balance + amount, receiver))
+        _record(conn, kind, [
+            (sender, -amount, sender_balance - amount, receiver),
+            (receiver, amount, receiver_balance + amount, sender),
+        ])
+        return sender_balance - amount, receiver_balance + amount
+
+# Transfer to/from bank
+@_timed
+def bank_transfer(userid, amount, kind='reward'):
+    with transaction() as conn:
+        current_balance = _balance(conn, userid)
+        bank_balance = conn.execute('SELECT balance FROM bank').fetchone()[0]
+
+        # Moving money from user to bank
+        if amount < 0 and current_balance - _held(conn, userid) >= abs(amount):
+            conn.execute('UPDATE users SET balance = ? WHERE userid = ?', (current_balance + amount, userid))
+            conn.execute('UPDATE bank SET balance = ?', (bank_balance - amount,))
+        # Moving money from bank to user
+        elif amount > 0 and bank_balance >= amount:
+            conn.execute('UPDATE users SET balance = ? WHERE userid = ?', (current_balance + amount, userid))
+            conn.execute('UPDATE bank SET balance = ?', (bank_balance - amount,))
+        else:
+            raise ValueError("Insufficient funds in bank or user account.")
+        _record(conn, kind, [(userid, amount, current_balance + amount, 'bank')])
+        after_commit(lambda: cache.update({BANK_KEY: bank_balance - amount}))
+        return current_balance + amount, bank_balance - amount
+
+# Apply several balance changes at once, e.g. {'winner': 10, 'loser': -10}
+# Every delta lands in one UPDATE inside one transaction, a debit that would take a
+# user's available balance below zero rejects the whole settlement. Returns {userid: new_balance}
+# In a two party settlement each journal row names the other player as counterparty
+@_timed
+def settle(deltas, kind='adjust'):
+    merged = {}
+    for userid, amount in deltas.items():
+        merged[str(userid)] = merged.get(str(userid), 0) + amount
+    if not merged:
+        return {}
+
+    values = ', '.join(['(?, ?)'] * len(merged))
+    params = [x for item in merged.items() for x in item]
+    with transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO users (userid) VALUES (?)', [(x,) for x in merged])
+        rows = conn.execute(f'''
+            UPDATE users SET balance = users.balance + d.delta
+            FROM (SELECT column1 AS userid, column2 AS delta FROM (VALUES {values})) AS d
+            WHERE users.userid = d.userid AND (d.delta >= 0 OR users.balance - users.held + d.delta >= 0)
+            RETURNING userid, balance
+        ''', params).fetchall()
+        balances = {userid: float(balance) for userid, balance in rows}
+        if len(balances) != len(merged):
+            short = [x for x in merged if x not in balances]
+            raise ValueError(f"{', '.join(short)} has insufficient funds.")
+        parties = list(merged)
+        _record(conn, kind, [
+            (userid, amount, balances[userid], parties[1 - parties.index(userid)] if len(parties) == 2 else None)
+            for userid, amount in merged.items()
+        ])
+        return balances
+
+# Settle a two player bet, returns (winner_balance, loser_balance)
+@_timed
+def settle_wager(winner, loser, amount, kind='adjust'):
+    # {winner: amount, loser: -amount} would collapse to a single debit
+    if str(winner) == str(loser):
+        raise ValueError("A player can't bet against themselves.")
+    balances = settle({winner: amount, loser: -amount}, kind)
+    return balances[str(winner)], balances[str(loser)]
+
+# Reserve `amount` of a user's available balance, e.g. a bet while the game is played
+# Returns the hold id to capture or release later, raises ValueError if the user can't
+# cover it. A hold nobody captures or releases is freed by release_expired_holds()
+@_timed
+def place_hold(userid, amount, reason='bet', ttl=HOLD_TTL):
+    if amount <= 0:
+        raise ValueError("Hold amount must be positive.")
+    userid = str(userid)
+    now = int(time.time())
+    with transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO users (userid) VALUES (?)', (userid,))
+        row = conn.execute('''
+            UPDATE users SET held = held + ? WHERE userid = ? AND balance - held >= ? RETURNING held
+        ''', (amount, userid, amount)).fetchone()
+        if row is None:
+            raise ValueError(f"{userid} has insufficient funds.")
+        hold_id = conn.execute('''
+            INSERT INTO holds (userid, amount, reason, created, expires) VALUES (?, ?, ?, ?, ?)
+        ''', (userid, amount, reason, now, now + ttl)).lastrowid
+        after_commit(lambda: _set_held({userid: row[0]}))
+        return hold_id
+
+# Delete the holds matching `where` and take them off users.held
+# Returns {hold id: (userid, amount)}, with `expected` set fewer matches raise ValueError
+def _take_holds(conn, where, params, expected=None):
+    rows = conn.execute(f'DELETE FROM holds WHERE {where} RETURNING id, userid, amount', params).fetchall()
+    if expected is not None and len(rows) != expected:
+        raise ValueError("The bet hold has expired or was already settled.")
+    totals = {}
+    for _, userid, amount in rows:
+        totals[userid] = totals.get(userid, 0) + amount
+    remaining = {}
+    for userid, amount in totals.items():
+        remaining[userid] = conn.execute('''
+            UPDATE users SET held = MAX(0.0, held - ?) WHERE userid = ? RETURNING held
+        ''', (amount, userid)).fetchone()[0]
+    after_commit(lambda: _set_held(remaining))
+    return {hold_id: (userid, amount) for hold_id, userid, amount in rows}
+
+# Free a hold without moving money (game cancelled or tied), returns False if it was gone
+@_timed
+def release_hold(hold_id):
+    with transaction() as conn:
+        return bool(_take_holds(conn, 'id = ?', (int(hold_id),)))
+
+# Turn a hold into a debit of its amount, returns the user's new balance
+@_timed
+def capture_hold(hold_id, kind='adjust', counterparty=None):
+    with transaction() as conn:
+        [(userid, amount)] = _take_holds(conn, 'id = ?', (int(hold_id),), expected=1).values()
+        new_balance = conn.execute('''
+            UPDATE users SET balance = balance - ? WHERE userid = ? RETURNING balance
+        ''', (amount, userid)).fetchone()[0]
+        _record(conn, kind, [(userid, -amount, new_balance, counterparty)])
+        return new_balance
+
+# Settle a game whose stakes are on hold: free the holds and apply the deltas in the same
+# transaction, so the funds that were reserved are the ones paid out. Every hold must still
+# exist, a hold that expired rejects the settlement. The deltas move money between the
+# players only, so they must net to zero. Returns {userid: new_balance}
+@_timed
+def capture_holds(hold_ids, deltas, kind='adjust'):
+    if round(sum(deltas.values()), 2):
+        raise ValueError("A game's settlement has to net to zero.")
+    ids = [int(x) for x in hold_ids]
+    with transaction() as conn:
+        _take_holds(conn, f"id IN ({', '.join(['?'] * len(ids))})", ids, expected=len(ids))
+        return settle(deltas, kind)
+
+# Settle a game against the casino: free the player's stake and move `net` between the
+# player and the bank (negative when the house won) in one transaction
+# Returns (user_balance, bank_balance), raises ValueError if the bank can't pay the win
+@_timed
+def settle_house(hold_id, net, kind='house'):
+    with transaction() as conn:
+        [(userid, _)] = _take_holds(conn, 'id = ?', (int(hold_id),), expected=1).values()
+        if net:
+            return bank_transfer(userid, round(net, 2), kind)
+        return _balance(conn, userid), conn.execute('SELECT balance FROM bank').fetchone()[0]
+
+# Free every hold past its expiry, returns how many were released
+@_timed
+def release_expired_holds(now=None):
+    with transaction() as conn:
+        return len(_take_holds(conn, 'expires <= ?', (int(now or time.time()),)))
+
+# Raised inside a dry run to roll it back once the report is built
+class _DryRun(Exception):
+    pass
+
+# Apply many balance changes at once, rows are (userid, delta, memo) and a user may appear
+# more than once. The rows go into a temp table with executemany and are applied with one
+# UPDATE, all in one transaction: if any user's available balance would go negative (or,
+# with source='bank', the bank can't pay the net total) nothing is applied.
+# With dry_run everything runs and is rolled back, so the report shows what would happen.
+# Returns {'rows', 'users', 'total', 'bank_balance', 'balances': {userid: (before, after)}}
+@_timed
+def bulk_adjust(rows, kind='import', source='adjust', dry_run=False):
+    rows = [(str(userid), float(delta), memo or None) for userid, delta, memo in rows]
+    report = {}
+    try:
+        with savepoint('bulk_adjust') as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_rows (seq INTEGER PRIMARY KEY, userid TEXT NOT NULL, delta REAL NOT NULL)')
+            conn.execute('DELETE FROM bulk_rows')
+            conn.executemany('INSERT INTO bulk_rows (userid, delta) VALUES (?, ?)', [row[:2] for row in rows])
+            conn.execute('INSERT OR IGNORE INTO users (userid) SELECT DISTINCT userid FROM bulk_rows')
+            before = dict(conn.execute('SELECT userid, balance FROM users WHERE userid IN (SELECT userid FROM bulk_rows)'))
+            after = {userid: float(balance) for userid, balance in conn.execute('''
+                UPDATE users SET balance = users.balance + d.delta
+                FROM (SELECT userid, SUM(delta) AS delta FROM bulk_rows GROUP BY userid) AS d
+                WHERE users.userid = d.userid
+                RETURNING userid, balance
+            ''')}
+            short = [row[0] for row in conn.execute('''
+                SELECT userid FROM users WHERE userid IN (SELECT userid FROM bulk_rows) AND balance - held < -1e-9
+            ''')]
+            if short:
+                raise ValueError(f"{', '.join(short[:10])}{' and others' if len(short) > 10 else ''} would have insufficient funds.")
+
+            total = sum(delta for _, delta, _ in rows)
+            bank_balance = conn.execute('SELECT balance FROM bank').fetchone()[0]
+            if source == 'bank':
+                if bank_balance - total < 0:
+                    raise ValueError("Insufficient funds in bank.")
+                bank_balance -= total
+                conn.execute('UPDATE bank SET balance = ?', (bank_balance,))
+                after_commit(lambda: cache.update({BANK_KEY: bank_balance}))
+
+            # One journal row per input row, with the running balance it left the user at
+            running = dict(before)
+            journal = []
+            for userid, delta, _ in rows:
+                running[userid] += delta
+                journal.append((userid, delta, running[userid], 'bank' if source == 'bank' else None))
+            _record(conn, kind, journal, [memo for _, _, memo in rows])
+            conn.execute('DELETE FROM bulk_rows')
+
+            report = {
+                'rows': len(rows),
+                'users': len(after),
+                'total': total,
+                'bank_balance': bank_balance,
+                'balances': {userid: (before[userid], balance) for userid, balance in after.items()},
+            }
+            if dry_run:
+                raise _DryRun
+    except _DryRun:
+        pass
+    return report
+
+# Up to `limit` users as (userid, balance, held) with ids after `after`, in id order
+@_timed
+def balances_page(after='', limit=5000):
+    return connection().execute(
+        'SELECT userid, balance, held FROM users WHERE userid > ? ORDER BY userid LIMIT ?', (after, limit)
+    ).fetchall()
+
+# Every user's (userid, balance, held) in pages of page_size ordered by id, all from one
+# consistent snapshot. Keyset pagination on the primary key, memory stays at one page
+# (through the ledger service each page is its own read)
+def iter_balances(page_size=5000):
+    with snapshot() if client is None else nullcontext():
+        last = ''
+        while True:
+            page = balances_page(last, page_size)
+            if not page:
+                return
+            yield page
+            last = page[-1][0]
+
+# Richest users as [(rank, userid, balance)], starting at position `offset` (0-based)
+@_timed
+def get_leaderboard(offset=0, limit=10):
+    return leaderboard.page(offset, limit)
+
+# (rank, number of ranked users) for a user, rank is None while their balance is zero
+@_timed
+def get_rank(userid):
+    return leaderboard.rank(str(userid)), len(leaderboard)
+
+# Page through a user's journal, newest first
+# Pass the cursor returned with one page as `before` to get the next one (None when done)
+# Each page is a range scan on idx_transactions_user_ts, so it stays O(log n + limit)
+@_timed
+def get_history(userid, limit=10, before=None):
+    conn = connection()
+    if before is None:
+        rows = conn.execute('''
+            SELECT id, amount, balance, kind, counterparty, ts, memo FROM transactions
+            WHERE userid = ? ORDER BY ts DESC, id DESC LIMIT ?
+        ''', (str(userid), limit)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT id, amount, balance, kind, counterparty, ts, memo FROM transactions
+            WHERE userid = ? AND (ts, id) < (?, ?) ORDER BY ts DESC, id DESC LIMIT ?
+        ''', (str(userid), before[0], before[1], limit)).fetchall()
+
+    history = [
+        {'id': id, 'amount': amount, 'balance': balance, 'kind': kind, 'counterparty': counterparty, 'ts': ts, 'memo': memo}
+        for id, amount, balance, kind, counterparty, ts, memo in rows
+    ]
+    cursor = (rows[-1][5], rows[-1][0]) if len(rows) == limit else None
+    return history, cursor
+
+# Fold journal rows older than `older_than` seconds into journal_snapshots and delete them
+# Works in batches so the write lock is never held for long, freed pages are reused by new
+# rows so the file stops growing once the retention window is full. Returns rows removed
+@_timed
+def compact_journal(older_than, batch_size=5000):
+    cutoff = int(time.time()) - older_than
+    removed = 0
+    while True:
+        with transaction() as conn:
+            last = conn.execute('''
+                SELECT id FROM transactions WHERE ts < ? ORDER BY id LIMIT 1 OFFSET ?
+            ''', (cutoff, batch_size - 1)).fetchone()
+            bound = 'ts < ?' if last is None else 'ts < ? AND id <= ?'
+            params = (cutoff,) if last is None else (cutoff, last[0])
+            conn.execute(f'''
+                INSERT INTO journal_snapshots (userid, amount, entries, ts)
+                SELECT userid, SUM(amount), COUNT(*), MAX(ts) FROM transactions WHERE {bound} GROUP BY userid
+                ON CONFLICT (userid) DO UPDATE SET
+                    amount = amount + excluded.amount,
+                    entries = entries + excluded.entries,
+                    ts = MAX(ts, excluded.ts)
+            ''', params)
+            count = conn.execute(f'DELETE FROM transactions WHERE {bound}', params).rowcount
+        removed += count
+        if last is None or not count:
+            return removed
+
+# Group commit for balance writes
+# Collects writes arriving within `window` seconds (or up to `max_ops` of them) and applies
+# them in one transaction, so a burst pays for one commit instead of one each. Every op runs
+# in its own savepoint: one that fails (e.g. insufficient funds) only rejects its own future.
+# Futures resolve after COMMIT has returned, never before. With the default synchronous=NORMAL
+# a committed batch survives a bot crash but may be lost on power loss, durable=True switches
+# the coalescer's connection to synchronous=FULL and fsyncs every batch
+class WriteCoalescer:
+    def __init__(self, window=0.002, max_ops=128, durable=False):
+        self.window = window
+        self.max_ops = max_ops
+        self.durable = durable
+        self.commits = 0
+        self.ops = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='ledger-coalescer', daemon=True)
+        self._thread.start()
+
+    # Queue func(*args) (one of the functions in this module), returns a Future
+    def submit(self, func, *args):
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def change_balance(self, userid, amount):
+        return self.submit(change_balance, userid, amount)
+
+    def transfer(self, sender, receiver, amount):
+        return self.submit(transfer, sender, receiver, amount)
+
+    # Flush what is queued and stop the worker thread
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        if self.durable:
+            connection().execute('PRAGMA synchronous=FULL')
+
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_ops:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._apply(batch)
+
+    def _apply(self, batch):
+        results = []
+        try:
+            with transaction():
+                for future, func, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with savepoint():
+                            results.append((future, func(*args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed, nothing in the batch was applied
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.ops += len(results)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+# Several bot processes: with LEDGER_SOCKET set the ledger service (libs/LedgerService.py)
+# owns the database and every public function above becomes a call to it. Balances can
+# change under us, so nothing is cached in this process
+client = None
+if os.getenv('LEDGER_SOCKET') and not os.getenv('LEDGER_SERVICE'):
+    from libs import LedgerClient
+
+    client = LedgerClient.Client(os.getenv('LEDGER_SOCKET'))
+    cache.size = 0
+    for _name in LedgerClient.BANK_OPS:
+        globals()[_name] = _timed(client.stub(_name))
+
+    # The service creates and migrates the schema, check it answers
+    def init_db():
+        client.call('ping')
+else:
+    # Ensure database is ready
+    init_db()
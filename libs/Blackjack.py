@@ -0,0 +1,267 @@
+import os
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from libs import Bank
+from libs.Database import connection, transaction
+
+# Blackjack game sessions, small enough to keep thousands open and checkpointed to sqlite
+# after every move so a restart or reload_extensions picks the games up where they were
+# Cards are indexes into CARD_VALUES (one byte each), a session is a __slots__ record
+# holding two hands and the rest of the shoe as byte arrays
+
+CARD_VALUES = (2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11)  # 2-10, J, Q, K, A
+ACE = 12
+TURN_TIMEOUT = 60             # Seconds a player has to act before the game is called off
+MAX_CACHED_SESSIONS = int(os.getenv('MAX_CACHED_SESSIONS') or 2000)
+
+
+def new_shoe(decks=1, rng=random):
+    shoe = array('B', range(len(CARD_VALUES))) * (4 * decks)
+    rng.shuffle(shoe)
+    return shoe
+
+
+def hand_value(hand):
+    value = sum(CARD_VALUES[card] for card in hand)
+    aces = hand.count(ACE)
+    while value > 21 and aces:
+        value -= 10
+        aces -= 1
+    return value
+
+
+def hand_to_string(hand):
+    return ", ".join(str(CARD_VALUES[card]) for card in hand)
+
+
+class Session:
+    __slots__ = ('id', 'players', 'bet', 'holds', 'turn', 'hands', 'shoe', 'channel_id', 'message_id', 'updated')
+
+    def __init__(self, id, players, bet, holds, turn, hands, shoe, channel_id=0, message_id=0, updated=0):
+        self.id = id
+        self.players = players        # (player1 id, player2 id) as str
+        self.bet = bet
+        self.holds = holds            # (player1 hold id, player2 hold id)
+        self.turn = turn              # 0 or 1, index of the player to act
+        self.hands = hands            # (array('B'), array('B'))
+        self.shoe = shoe              # array('B'), drawn from the end
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.updated = updated
+
+    @classmethod
+    def deal(cls, player1, player2, bet, holds, rng=random):
+        shoe = new_shoe(rng=rng)
+        hands = (array('B', [shoe.pop(), shoe.pop()]), array('B', [shoe.pop(), shoe.pop()]))
+        return cls(None, (str(player1), str(player2)), bet, tuple(holds), 0, hands, shoe, updated=int(time.time()))
+
+    @property
+    def current_player(self):
+        return self.players[self.turn]
+
+    # Draw for the player to act, returns True when the game is over (they bust)
+    def hit(self):
+        self.hands[self.turn].append(self.shoe.pop())
+        self.updated = int(time.time())
+        return hand_value(self.hands[self.turn]) > 21
+
+    # Pass the turn, returns True when the game is over (the second player stood)
+    def stand(self):
+        self.updated = int(time.time())
+        if self.turn == 0:
+            self.turn = 1
+            return False
+        return True
+
+    # Index of the winning player, None on a tie
+    def winner(self):
+        value1, value2 = hand_value(self.hands[0]), hand_value(self.hands[1])
+        if value1 > 21:
+            return 1
+        if value2 > 21:
+            return 0
+        if value1 != value2:
+            return 0 if value1 > value2 else 1
+        return None
+
+
+def init_sessions():
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS game_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                player1 TEXT NOT NULL,
+                player2 TEXT NOT NULL,
+                bet REAL NOT NULL,
+                hold1 INTEGER NOT NULL,
+                hold2 INTEGER NOT NULL,
+                turn INTEGER NOT NULL,
+                hand1 BLOB NOT NULL,
+                hand2 BLOB NOT NULL,
+                shoe BLOB NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                updated INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_game_sessions_updated ON game_sessions (updated)')
+
+
+def _row(session):
+    return (
+        session.players[0], session.players[1], session.bet, session.holds[0], session.holds[1], session.turn,
+        session.hands[0].tobytes(), session.hands[1].tobytes(), session.shoe.tobytes(),
+        session.channel_id, session.message_id, session.updated,
+    )
+
+
+def _session(row):
+    id, player1, player2, bet, hold1, hold2, turn, hand1, hand2, shoe, channel_id, message_id, updated = row
+    return Session(
+        id, (player1, player2), bet, (hold1, hold2), turn,
+        (array('B', hand1), array('B', hand2)), array('B', shoe), channel_id, message_id, updated,
+    )
+
+
+# Checkpoint a session (inserting it the first time), returns its id
+# The stakes' holds are pushed out along with it so a long game never loses them
+def save_session(session):
+    with transaction() as conn:
+        if session.id is None:
+            session.id = conn.execute('''
+                INSERT INTO game_sessions (player1, player2, bet, hold1, hold2, turn, hand1, hand2, shoe, channel_id, message_id, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', _row(session)).lastrowid
+        else:
+            conn.execute('''
+                UPDATE game_sessions SET player1 = ?, player2 = ?, bet = ?, hold1 = ?, hold2 = ?, turn = ?, hand1 = ?,
+                    hand2 = ?, shoe = ?, channel_id = ?, message_id = ?, updated = ?
+                WHERE id = ?
+            ''', _row(session) + (session.id,))
+        conn.execute('UPDATE holds SET expires = MAX(expires, ?) WHERE id IN (?, ?)', (int(time.time()) + Bank.HOLD_TTL, *session.holds))
+        return session.id
+
+
+def load_session(session_id):
+    row = connection().execute('SELECT * FROM game_sessions WHERE id = ?', (session_id,)).fetchone()
+    return _session(row) if row else None
+
+
+# Settle a finished game: capture the stakes into the winner's balance (or release them
+# on a tie) and drop the session, all in one transaction. Returns {userid: new_balance}
+def finish_session(session, kind='blackjack'):
+    with transaction() as conn:
+        winner = session.winner()
+        if winner is None:
+            for hold_id in session.holds:
+                Bank.release_hold(hold_id)
+            balances = {}
+        else:
+            loser = session.players[1 - winner]
+            balances = Bank.capture_holds(session.holds, {session.players[winner]: session.bet, loser: -session.bet}, kind)
+        conn.execute('DELETE FROM game_sessions WHERE id = ?', (session.id,))
+        return balances
+
+
+# Call a game off: both stakes go back and the session is dropped
+def abandon_session(session):
+    with transaction() as conn:
+        for hold_id in session.holds:
+            Bank.release_hold(hold_id)
+        conn.execute('DELETE FROM game_sessions WHERE id = ?', (session.id,))
+
+
+# Sessions nobody has moved in `timeout` seconds
+def stale_sessions(timeout=TURN_TIMEOUT):
+    rows = connection().execute('SELECT * FROM game_sessions WHERE updated < ?', (int(time.time()) - timeout,)).fetchall()
+    return [_session(row) for row in rows]
+
+
+# Restart the turn clock of every open game, used on startup so downtime isn't held
+# against the players
+def resume_sessions():
+    now = int(time.time())
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE holds SET expires = MAX(expires, ?)
+            WHERE id IN (SELECT hold1 FROM game_sessions UNION SELECT hold2 FROM game_sessions)
+        ''', (now + Bank.HOLD_TTL,))
+        return conn.execute('UPDATE game_sessions SET updated = ?', (now,)).rowcount
+
+
+# Open sessions in memory, least recently used ones are dropped and read back from sqlite
+# when someone clicks on them again. Sessions being settled are fenced off so a second
+# click can't act on a copy read before the settlement committed
+class SessionStore:
+    def __init__(self, size=MAX_CACHED_SESSIONS):
+        self.size = size
+        self._sessions = OrderedDict()
+        self._closing = set()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            if session_id in self._closing:
+                return None
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session):
+        with self._lock:
+            if session.id in self._closing:
+                return
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            if len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    # Take a session out for good, returns False if someone else already did
+    def close(self, session_id):
+        with self._lock:
+            if session_id in self._closing:
+                return False
+            self._closing.add(session_id)
+            self._sessions.pop(session_id, None)
+            return True
+
+    # The session row is gone, its id can't come back so the fence can go too
+    def closed(self, session_id):
+        with self._lock:
+            self._closing.discard(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionStore()
+
+# Behind the ledger service (see Bank.client) the service owns game_sessions too and the
+# functions above run there, sessions travel as their row tuples
+if Bank.client is not None:
+    def save_session(session):
+        session.id = Bank.client.call('save_session', session.id, _row(session))
+        return session.id
+
+    def load_session(session_id):
+        row = Bank.client.call('load_session', session_id)
+        return _session(row) if row else None
+
+    def finish_session(session, kind='blackjack'):
+        return Bank.client.call('finish_session', (session.id,) + _row(session), kind)
+
+    def abandon_session(session):
+        Bank.client.call('abandon_session', (session.id,) + _row(session))
+
+    def stale_sessions(timeout=TURN_TIMEOUT):
+        return [_session(row) for row in Bank.client.call('stale_sessions', timeout)]
+
+    def resume_sessions():
+        return Bank.client.call('resume_sessions')
+else:
+    init_sessions()
@@ -0,0 +1,100 @@
+import csv
+import gzip
+import io
+import json
+import math
+import re
+from contextlib import nullcontext
+
+from libs import Bank
+from libs.Database import connection, snapshot
+
+# CSV in and out of the ledger for admins: bulk balance changes from an attachment and an
+# export of every balance. Imports are parsed here and applied by Bank.bulk_adjust in one
+# transaction, exports are written page by page so memory stays flat however many users
+
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+MAX_IMPORT_ROWS = 100000
+MAX_MEMO = 200
+EXPORT_PAGE_SIZE = 5000
+FORMATS = ('csv', 'jsonl')
+
+_mention = re.compile(r'^<@!?(\d+)>$')
+
+
+# Parse "userid,delta,memo" lines (header optional, memo optional, mentions accepted)
+# Returns (rows, errors), rows as (userid, delta, memo) and errors as "line N: reason"
+def parse_rows(data):
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    rows, errors = [], []
+    for number, fields in enumerate(csv.reader(io.StringIO(text)), 1):
+        if not fields or not ''.join(fields).strip():
+            continue
+        userid = fields[0].strip()
+        if number == 1 and userid.lower() in ('userid', 'user', 'id'):
+            continue
+        match = _mention.match(userid)
+        if match:
+            userid = match[1]
+        if not userid.isdigit():
+            errors.append(f'line {number}: "{userid[:40]}" is not a user id')
+            continue
+        try:
+            delta = float(fields[1])
+        except (IndexError, ValueError):
+            errors.append(f'line {number}: missing or invalid amount')
+            continue
+        if not math.isfinite(delta):
+            errors.append(f'line {number}: invalid amount')
+            continue
+        memo = ','.join(fields[2:]).strip()[:MAX_MEMO] if len(fields) > 2 else ''
+        rows.append((userid, round(delta, 2), memo))
+        if len(rows) > MAX_IMPORT_ROWS:
+            errors.append(f'more than {MAX_IMPORT_ROWS} rows')
+            break
+    return rows, errors
+
+
+# The result of Bank.bulk_adjust as CSV bytes, one line per user
+def report_csv(report):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(('userid', 'before', 'delta', 'after'))
+    for userid, (before, after) in sorted(report['balances'].items()):
+        writer.writerow((userid, f'{before:.2f}', f'{after - before:+.2f}', f'{after:.2f}'))
+    return out.getvalue().encode()
+
+
+# Write the bank and every user to fileobj (binary) as csv or jsonl, gzipped if asked
+# Reads EXPORT_PAGE_SIZE users at a time from one snapshot, returns how many were written
+def export_balances(fileobj, fmt='csv', compress=False, page_size=EXPORT_PAGE_SIZE):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, use one of {', '.join(FORMATS)}.")
+    raw = gzip.GzipFile(fileobj=fileobj, mode='wb') if compress else fileobj
+    out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    try:
+        # The bank and the user pages are read from the same snapshot (unless the database
+        # is behind the ledger service)
+        with snapshot() if Bank.client is None else nullcontext():
+            bank_balance = Bank.get_bank_balance() if Bank.client else connection().execute('SELECT balance FROM bank').fetchone()[0]
+            writer = csv.writer(out) if fmt == 'csv' else None
+            if writer:
+                writer.writerow(('userid', 'balance', 'held'))
+                writer.writerow(('bank', bank_balance, 0))
+            else:
+                out.write(json.dumps({'userid': 'bank', 'balance': bank_balance, 'held': 0}) + '\n')
+
+            count = 0
+            for page in Bank.iter_balances(page_size):
+                if writer:
+                    writer.writerows(page)
+                else:
+                    out.writelines(json.dumps({'userid': userid, 'balance': balance, 'held': held}) + '\n' for userid, balance, held in page)
+                count += len(page)
+            return count
+    finally:
+        # Detach so closing the wrapper doesn't close the caller's file
+        out.flush()
+        out.detach()
+        if compress:
+            raw.close()
@@ -0,0 +1,130 @@
+# Hashed chunk lookups for the auto-deposit town checks
+# A town's townBlocks are compiled once into a set of (chunk_x, chunk_z) tuples, so
+# checking a player is one floor division and one set lookup instead of a scan
+# over every block the town has claimed
+# With NumPy installed, large player lists are filtered in bulk: positions go into
+# arrays, chunk coords come from one vectorized floor division and membership is a
+# binary search against the packed chunk keys of every watched town
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 16
+
+# Below this many players the plain Python loop is faster than building arrays
+NUMPY_MIN_PLAYERS = 64
+
+# Chunk coordinates of a block position (same rounding as util.isInChunk)
+def chunk_of(x, z):
+    return int(x // CHUNK_SIZE), int(z // CHUNK_SIZE)
+
+
+# One int64 per chunk, so chunk sets can be searched as NumPy arrays
+def pack_chunk(cx, cz):
+    return (cx << 32) | (cz & 0xFFFFFFFF)
+
+
+def _pack_positions(xs, zs):
+    cx = np.floor_divide(xs, CHUNK_SIZE).astype(np.int64)
+    cz = np.floor_divide(zs, CHUNK_SIZE).astype(np.int64)
+    return (cx << 32) | (cz & 0xFFFFFFFF)
+
+
+# Indices of the keys found in the sorted array `packed`
+def _search(packed, keys):
+    if not len(packed):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    slots = np.minimum(np.searchsorted(packed, keys), len(packed) - 1)
+    hits = np.flatnonzero(packed[slots] == keys)
+    return hits, slots[hits]
+
+
+def _position_arrays(positions):
+    count = len(positions)
+    xs = np.fromiter((pos[0] for pos in positions), np.float64, count)
+    zs = np.fromiter((pos[1] for pos in positions), np.float64, count)
+    return xs, zs
+
+
+class ChunkIndex:
+    __slots__ = ('chunks',)
+
+    def __init__(self, town_blocks):
+        self.chunks = frozenset((int(cx), int(cz)) for cx, cz in town_blocks)
+
+    # `pos in index` is True when the (x, z) position is inside one of the chunks
+    def __contains__(self, pos):
+        return chunk_of(pos[0], pos[1]) in self.chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+# Chunk -> town lookup over several towns, used to place every online player at once
+class TownIndex:
+    def __init__(self):
+        self.towns = {}
+        self._owners = {}
+        self._arrays = None
+
+    # Add or refresh a town from its townBlocks, returns True if its claims changed
+    def update(self, town, town_blocks):
+        index = ChunkIndex(town_blocks)
+        old = self.towns.get(town)
+        if old is not None and old.chunks == index.chunks:
+            return False
+
+        if old is not None:
+            for chunk in old.chunks:
+                if self._owners.get(chunk) == town:
+                    del self._owners[chunk]
+        for chunk in index.chunks:
+            self._owners[chunk] = town
+        self.towns[town] = index
+        self._arrays = None
+        return True
+
+    def remove(self, town):
+        old = self.towns.pop(town, None)
+        if old is not None:
+            for chunk in old.chunks:
+                if self._owners.get(chunk) == town:
+                    del self._owners[chunk]
+            self._arrays = None
+
+    # Name of the town the (x, z) position is in, or None
+    def town_at(self, pos):
+        return self._owners.get(chunk_of(pos[0], pos[1]))
+
+    # Batched lookup: players is {name: (x, z)}, returns {town: {name: (x, z)}}
+    # Towns with nobody inside are left out
+    def locate(self, players):
+        if np is not None and len(players) >= NUMPY_MIN_PLAYERS:
+            return self._locate_numpy(players)
+
+        owners = self._owners
+        found = {}
+        for name, pos in players.items():
+            town = owners.get((int(pos[0] // CHUNK_SIZE), int(pos[1] // CHUNK_SIZE)))
+            if town is not None:
+                found.setdefault(town, {})[name] = pos
+        return found
+
+    def _locate_numpy(self, players):
+        if self._arrays is None:
+            names = list(self._owners.values())
+            keys = np.fromiter((pack_chunk(cx, cz) for cx, cz in self._owners), np.int64, len(self._owners))
+            order = np.argsort(keys)
+            self._arrays = (keys[order], [names[i] for i in order.tolist()])
+        packed, owners = self._arrays
+
+        items = list(players.items())
+        xs, zs = _position_arrays([pos for _, pos in items])
+        hits, slots = _search(packed, _pack_positions(xs, zs))
+        found = {}
+        for i, slot in zip(hits.tolist(), slots.tolist()):
+            name, pos = items[i]
+            found.setdefault(owners[slot], {})[name] = pos
+        return found
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Define paths
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # Parent directory of 'libs'
+DB_PATH = os.getenv('CASINO_DB_PATH') or os.path.join(BASE_DIR, 'store', 'users.db')  # Set CASINO_DB_PATH outside the repo, see README
+
+# Pragmas applied to every connection we open
+# WAL lets readers run while a write is being committed, NORMAL only fsyncs on checkpoints
+# (a crash can lose the last commits but never corrupts the file) and busy_timeout makes
+# sqlite wait for the lock instead of failing straight away with "database is locked"
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+)
+
+# How many prepared statements each connection keeps around
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+
+def _open():
+    # isolation_level=None puts the connection in autocommit mode, transactions are
+    # started explicitly by transaction() so we control when the write lock is taken
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+
+# Get the long lived connection for the current thread
+def connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation:
+        conn = _open()
+        _local.conn = conn
+        _local.depth = 0
+        _local.generation = _generation
+    return conn
+
+
+# Run a block of statements as one transaction
+# Nested calls join the outer transaction, so helpers can be composed freely
+@contextmanager
+def transaction():
+    conn = connection()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    # IMMEDIATE takes the write lock up front, a deferred transaction that later
+    # upgrades to a writer can fail with SQLITE_BUSY without honouring busy_timeout
+    conn.execute('BEGIN IMMEDIATE')
+    _local.depth = 1
+    _local.callbacks = []
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        _local.depth = 0
+        _local.callbacks = []
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    _local.depth = 0
+    callbacks, _local.callbacks = _local.callbacks, []
+    for callback in callbacks:
+        callback()
+
+
+# Run callback once the current transaction has committed (straight away outside one)
+# Callbacks registered inside a transaction or savepoint that rolls back are dropped
+def after_commit(callback):
+    if getattr(_local, 'depth', 0):
+        _local.callbacks.append(callback)
+    else:
+        callback()
+
+
+# Run a block inside its own savepoint within the current transaction
+# If the block raises only its own statements are undone, the outer transaction goes on
+@contextmanager
+def savepoint(name='op'):
+    with transaction() as conn:
+        conn.execute(f'SAVEPOINT {name}')
+        mark = len(_local.callbacks)
+        try:
+            yield conn
+        except BaseException:
+            del _local.callbacks[mark:]
+            conn.execute(f'ROLLBACK TO {name}')
+            conn.execute(f'RELEASE {name}')
+            raise
+        conn.execute(f'RELEASE {name}')
+
+
+# Read several statements from one consistent view of the database
+# A deferred transaction that only reads takes no write lock, in WAL mode writers carry on
+# and commit while it runs. Don't write inside it, use transaction() for that
+@contextmanager
+def snapshot():
+    conn = connection()
+    if _local.depth or conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.execute('COMMIT')
+
+
+# Close every connection opened by this process (used on shutdown)
+# Threads notice the bumped generation and reconnect on their next call
+def close_all():
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        while _connections:
+            _connections.pop().close()
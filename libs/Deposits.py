@@ -0,0 +1,290 @@
+import asyncio
+import math
+import random
+import time
+
+from libs import Metrics, Profiling
+from libs.Chunks import TownIndex
+from libs.EarthMC import RateLimited
+from libs.Matching import DepositMatcher
+
+# Auto-deposit watcher for any number of (town, receiver, chest) shops
+# One tick fetches players.json once, places every online player with a single
+# TownIndex lookup and asks the API for the balances of all watched players in one
+# batched query, so the cost grows with online players rather than towns x players
+
+TICK_INTERVAL = 3             # Seconds between ticks in normal traffic
+BUSY_INTERVAL = 1.5           # ... while someone is near a chest or balances are moving
+IDLE_MAX_INTERVAL = 15        # Ceiling for the backoff while every town is empty, kept short so
+                              # someone who walks in and pays straight away is still caught
+DISABLED_INTERVAL = 20        # First wait while AutoDeposits is off, backs off to DISABLED_MAX_INTERVAL
+DISABLED_MAX_INTERVAL = 300
+JITTER = 0.1                  # Fraction of the interval added or removed at random
+NEAR_CHEST_DISTANCE = 24      # Blocks from a chest that count as "about to pay"
+TOWN_REFRESH_INTERVAL = 300   # Seconds between re-reading the towns' claimed chunks
+STATS_FULL_REFRESH_TICKS = 4  # Re-read every watched player's balance every this many ticks
+SEEN_TIMEOUT = 12             # Seconds a player stays a candidate after leaving town
+
+_phase_seconds = Metrics.histogram('casino_deposit_phase_seconds', 'Time spent in each phase of a deposit tick', ('phase',))
+_ticks = Metrics.counter('casino_deposit_ticks_total', 'Deposit ticks by the activity they saw', ('state',))
+
+
+class Watch:
+    __slots__ = ('town', 'receiver', 'chest')
+
+    def __init__(self, town, receiver, chest):
+        self.town = town
+        self.receiver = receiver
+        self.chest = chest
+
+    def __repr__(self):
+        return f'Watch({self.town!r}, {self.receiver!r}, {self.chest!r})'
+
+
+# Picks the wait before the next tick from what the last tick saw
+# Busy ticks poll fast, empty towns back off exponentially up to IDLE_MAX_INTERVAL and a
+# 429 from the API pauses polling for as long as Retry-After asks
+class PollScheduler:
+    BUSY, NORMAL, IDLE = 'busy', 'normal', 'idle'
+
+    def __init__(self, interval=TICK_INTERVAL, busy_interval=BUSY_INTERVAL, idle_max=IDLE_MAX_INTERVAL, jitter=JITTER):
+        self.base_interval = interval
+        self.busy_interval = busy_interval
+        self.idle_max = idle_max
+        self.jitter = jitter
+        self.interval = interval
+        self.state = self.NORMAL
+        self.paused_until = 0
+        self._disabled_wait = DISABLED_INTERVAL
+
+    def record(self, state):
+        self.state = state
+        self._disabled_wait = DISABLED_INTERVAL
+        if state == self.BUSY:
+            self.interval = self.busy_interval
+        elif state == self.IDLE:
+            self.interval = min(self.idle_max, max(self.interval, self.base_interval) * 2)
+        else:
+            self.interval = self.base_interval
+
+    def rate_limited(self, retry_after):
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    # Wait while AutoDeposits is off, doubles every time up to DISABLED_MAX_INTERVAL
+    def disabled(self):
+        wait = self._disabled_wait
+        self._disabled_wait = min(DISABLED_MAX_INTERVAL, wait * 2)
+        return wait
+
+    def next_delay(self):
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(delay, self.paused_until - time.monotonic())
+
+
+class DepositWatcher:
+    # on_deposit(player, receiver, amount, watch) is awaited for every matched deposit
+    # enabled() is checked before each tick (the AutoDeposits toggle)
+    def __init__(self, client, watches, on_deposit, enabled=lambda: True):
+        self.client = client
+        self.watches = [x if isinstance(x, Watch) else Watch(*x) for x in watches]
+        self.on_deposit = on_deposit
+        self.enabled = enabled
+        self.towns = TownIndex()
+        self.towns_fetched = 0
+        self.ticks = 0
+        self.ticked = asyncio.Event()  # Set once the first tick has run (startup report)
+        self.positions = {}       # {town: {name: (x, z)}} from the last players.json
+        self.seen = {}            # {town: {name: {'pos': (x, z), 'epoch': seconds}}}
+        self.last_balances = {}   # {name: balance}
+        self.scheduler = PollScheduler()
+        self.matcher = DepositMatcher()
+        self._wake = asyncio.Event()
+        self._profiler = None      # Set by profile_ticks()
+        self._profile_left = 0
+        self._profiled = 0
+        self._on_profile = None
+
+    async def run(self):
+        while True:
+            if not self.enabled():
+                await self.sleep(self.scheduler.disabled())
+                continue
+            try:
+                self.scheduler.record(await self.profiled_tick())
+            except RateLimited as e:
+                print(f'AUTO-DEPOSIT: {e}')
+                self.scheduler.rate_limited(e.retry_after)
+            except Exception as e:
+                print(f'AUTO-DEPOSIT TICK ERROR: {e}')
+            self.ticked.set()
+            await self.sleep(self.scheduler.next_delay())
+
+    # Sleep until the next tick, or until wake() is called (e.g. AutoDeposits toggled on)
+    async def sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    # Profile the next `ticks` ticks with cProfile, then await on_profile(report_text)
+    # Only the ticks are profiled, not the sleeps between them (other coroutines that run
+    # while a tick awaits the API are included)
+    def profile_ticks(self, ticks, on_profile):
+        ticks = max(1, ticks)
+        self._profiler = Profiling.claim(f'{ticks} deposit ticks')
+        self._profile_left = ticks
+        self._profiled = 0
+        self._on_profile = on_profile
+
+    # Stop profile_ticks() early, the ticks profiled so far are still reported
+    def stop_profiling(self):
+        if self._profiler is None:
+            return False
+        self._profile_left = 0
+        return True
+
+    async def profiled_tick(self):
+        profiler = self._profiler
+        if profiler is None:
+            return await self.tick()
+
+        if self._profile_left:
+            profiler.enable()
+            try:
+                return await self.tick()
+            finally:
+                profiler.disable()
+                self._profiled += 1
+                self._profile_left -= 1
+                if not self._profile_left:
+                    await self._finish_profile()
+        await self._finish_profile()
+        return await self.tick()
+
+    async def _finish_profile(self):
+        profiler, on_profile, ticks = self._profiler, self._on_profile, self._profiled
+        self._profiler = self._on_profile = None
+        Profiling.release()
+        try:
+            await on_profile(Profiling.stats_text(profiler, title=f'Profile of {ticks} deposit ticks'))
+        except Exception as e:
+            print(f'AUTO-DEPOSIT PROFILE ERROR: {e}')
+
+    # Current polling state for monitoring
+    def status(self):
+        return {
+            'state': self.scheduler.state,
+            'interval': self.scheduler.interval,
+            'paused_for': max(0.0, self.scheduler.paused_until - time.monotonic()),
+            'requests_per_minute': self.client.budget.requests_per_minute(),
+            'ticks': self.ticks,
+            'profiling_ticks_left': self._profile_left,
+        }
+
+    # Load or refresh the claims of every watched town
+    async def refresh_towns(self):
+        self.towns_fetched = time.time()
+        for town in {x.town for x in self.watches}:
+            try:
+                blocks = await self.client.town_blocks(town)
+                if blocks:
+                    self.towns.update(town, blocks)
+            except Exception as e:
+                print(f'TOWN REFRESH ERROR ({town}): {e}')
+
+    async def tick(self):
+        if time.time() - self.towns_fetched >= TOWN_REFRESH_INTERVAL:
+            await self.refresh_towns()
+
+        with _phase_seconds.labels('fetch').time():
+            players = await self.client.fetch_players()
+        if players is not None:
+            with _phase_seconds.labels('filter').time():
+                online = {p['name']: (p['x'], p['z']) for p in players['players'] if isinstance(p, dict)}
+                self.positions = self.towns.locate(online)
+
+        epoch_now = int(time.time())
+        for town in {x.town for x in self.watches}:
+            seen = self.seen.setdefault(town, {})
+            for name, pos in self.positions.get(town, {}).items():
+                seen[name] = {'pos': pos, 'epoch': epoch_now}
+
+        receivers = {x.receiver for x in self.watches}
+        watched = receivers | {name for seen in self.seen.values() for name in seen}
+        with _phase_seconds.labels('stats').time():
+            differences = await self.poll_balances(receivers, watched)
+
+        # Called every tick, even a quiet one ages out the carried residue
+        with _phase_seconds.labels('match').time():
+            matches = self.match(receivers, differences)
+        for payer, receiver, amount, watch in matches:
+            with _phase_seconds.labels('confirm').time():
+                await self.on_deposit(payer, receiver, amount, watch)
+
+        self.last_balances = {k: v for k, v in self.last_balances.items() if k in watched}
+        # Stay a candidate for a few ticks even when the scheduler has backed off
+        seen_timeout = max(SEEN_TIMEOUT, 4 * self.scheduler.interval)
+        for town, seen in self.seen.items():
+            self.seen[town] = {k: v for k, v in seen.items() if epoch_now - v['epoch'] <= seen_timeout}
+        state = self.activity(differences)
+        _ticks.labels(state).inc()
+        return state
+
+    # BUSY when balances moved or someone stands near a chest, IDLE when every town is empty
+    def activity(self, differences):
+        if differences:
+            return PollScheduler.BUSY
+        visitors = False
+        for watch in self.watches:
+            for name, entry in self.seen.get(watch.town, {}).items():
+                if name == watch.receiver:
+                    continue
+                visitors = True
+                if math.dist(watch.chest, entry['pos']) <= NEAR_CHEST_DISTANCE:
+                    return PollScheduler.BUSY
+        return PollScheduler.NORMAL if visitors else PollScheduler.IDLE
+
+    # One batched stats query, returns {name: balance change since the last poll}
+    # Receivers are polled every tick, new arrivals once for a starting balance and
+    # everyone else on a full refresh or when a receiver's balance has moved
+    async def poll_balances(self, receivers, watched):
+        self.ticks += 1
+        full_refresh = self.ticks % STATS_FULL_REFRESH_TICKS == 0
+        query = watched if full_refresh else {x for x in watched if x in receivers or x not in self.last_balances}
+        balances = await self.client.balances(query)
+
+        receiver_moved = any(
+            x in self.last_balances and balances.get(x, self.last_balances[x]) != self.last_balances[x]
+            for x in receivers
+        )
+        if not full_refresh and receiver_moved:
+            balances.update(await self.client.balances([x for x in watched if x not in balances]))
+
+        differences = {}
+        for name, balance in balances.items():
+            if name in self.last_balances and self.last_balances[name] != balance:
+                differences[name] = balance - self.last_balances[name]
+            self.last_balances[name] = balance
+        return differences
+
+    # Explain this tick's receiver gains with the debits of players seen near their chests
+    # Returns [(payer, receiver, amount, watch)], watch being the shop the payer stood in
+    def match(self, receivers, differences):
+        gains = {x: differences[x] for x in receivers if differences.get(x, 0) > 0}
+        debits = {name: -value for name, value in differences.items() if value < 0 and name not in receivers}
+
+        candidates, shops = {}, {}
+        for watch in self.watches:
+            near = candidates.setdefault(watch.receiver, {})
+            for name, entry in self.seen.get(watch.town, {}).items():
+                distance = math.dist(watch.chest, entry['pos'])
+                if name not in near or distance < near[name]:
+                    near[name] = distance
+                    shops[watch.receiver, name] = watch
+
+        matches = self.matcher.match(gains, debits, candidates)
+        return [(payer, receiver, amount, shops[receiver, payer]) for payer, receiver, amount in matches]
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from libs import Metrics
+
+# orjson decodes the multi-megabyte players.json several times faster, use it if present
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+API_URL = 'https://api.earthmc.net/v3/aurora'
+MAP_URL = 'https://map.earthmc.net'
+
+# How long lookups are trusted, in seconds
+UUID_TTL = 24 * 3600          # Names only change on a rename
+DISCORD_TTL = 3600
+NEGATIVE_TTL = 300            # Unknown players and unlinked accounts are asked again after this
+
+
+# Size bounded LRU whose entries expire, None values are cached as "known missing"
+class TTLCache:
+    MISSING = object()
+
+    def __init__(self, size, ttl, negative_ttl=NEGATIVE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    # Cached value (may be None for a negative entry) or TTLCache.MISSING
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return self.MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+_http_seconds = Metrics.histogram('casino_earthmc_request_seconds', 'EarthMC API and map request latency', ('endpoint',))
+_http_responses = Metrics.counter('casino_earthmc_responses_total', 'EarthMC responses by status', ('endpoint', 'status'))
+
+
+# Requests per minute we allow ourselves across every EarthMC endpoint, and the burst
+REQUEST_BUDGET = 120
+REQUEST_BURST = 10
+
+
+# Raised when the API answers 429, retry_after is in seconds
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited by the EarthMC API, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, default=30):
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+# Token bucket shared by every request the client makes
+class RequestBudget:
+    def __init__(self, per_minute=REQUEST_BUDGET, burst=REQUEST_BURST):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._sent = deque()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self._sent.append(now)
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Requests sent over the last minute
+    def requests_per_minute(self):
+        cutoff = time.monotonic() - 60
+        while self._sent and self._sent[0] < cutoff:
+            self._sent.popleft()
+        return len(self._sent)
+
+
+# EarthMC API client sharing one keep-alive session between the deposit loop and Confirm
+class EarthMC:
+    def __init__(self, cache_size=5000):
+        self.session = None
+        self.uuid_cache = TTLCache(cache_size, UUID_TTL)
+        self.discord_cache = TTLCache(cache_size, DISCORD_TTL)
+        self.stats = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'unchanged': 0, 'rate_limited': 0}
+        self.budget = RequestBudget()
+        # Validators and body hash of the last players.json we processed
+        self._players_etag = None
+        self._players_modified = None
+        self._players_digest = None
+
+    # The session has to be created from inside the running event loop
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=15))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def post(self, endpoint, payload):
+        session = await self.start()
+        await self.budget.acquire()
+        with _http_seconds.labels(endpoint).time():
+            async with session.post(f'{API_URL}/{endpoint}', json=payload) as resp:
+                self.stats['requests'] += 1
+                _http_responses.labels(endpoint, resp.status).inc()
+                self._check_rate_limit(resp)
+                if resp.status != 200 or resp.content_type != 'application/json':
+                    return None
+                body = await resp.read()
+        self.stats['bytes'] += len(body)
+        return loads(body)
+
+    # The map's players.json, or None when it is the same as last time
+    # Sends If-None-Match/If-Modified-Since when the server gave us validators, and
+    # hashes the body so an identical payload is not decoded and filtered again
+    async def fetch_players(self):
+        headers = {}
+        if self._players_etag:
+            headers['If-None-Match'] = self._players_etag
+        if self._players_modified:
+            headers['If-Modified-Since'] = self._players_modified
+
+        session = await self.start()
+        await self.budget.acquire()
+        with _http_seconds.labels('players.json').time():
+            async with session.get(f'{MAP_URL}/tiles/players.json', headers=headers) as resp:
+                self.stats['requests'] += 1
+                _http_responses.labels('players.json', resp.status).inc()
+                self._check_rate_limit(resp)
+                if resp.status == 304:
+                    self.stats['not_modified'] += 1
+                    return None
+                if resp.status != 200 or resp.content_type != 'application/json':
+                    return {'players': []}
+                body = await resp.read()
+                self.stats['bytes'] += len(body)
+                self._players_etag = resp.headers.get('ETag')
+                self._players_modified = resp.headers.get('Last-Modified')
+
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if digest == self._players_digest:
+            self.stats['unchanged'] += 1
+            return None
+        self._players_digest = digest
+        return loads(body)
+
+    # {name: balance} for the given player names
+    async def balances(self, names):
+        if not names:
+            return {}
+        response = await self.post('players', {"query": list(names), "template": {"name": True, "stats": True}})
+        if not response:
+            return {}
+        # Keyed by the names we asked for, the API may return them in a different case
+        wanted = {name.lower(): name for name in names}
+        return {
+            wanted[x['name'].lower()]: x['stats']['balance'] for x in response
+            if isinstance(x, dict) and x.get('stats') and str(x.get('name')).lower() in wanted
+        }
+
+    def _check_rate_limit(self, resp):
+        if resp.status == 429:
+            self.stats['rate_limited'] += 1
+            raise RateLimited(parse_retry_after(resp.headers.get('Retry-After')))
+
+    async def town_blocks(self, town_name):
+        response = await self.post('towns', {"query": [town_name], "template": {"coordinates": True}})
+        return response[0]['coordinates']['townBlocks'] if response else None
+
+    # {name: uuid or None} for the given player names
+    async def resolve_uuids(self, names):
+        result, missing = {}, []
+        for name in names:
+            cached = self.uuid_cache.get(name.lower())
+            if cached is TTLCache.MISSING:
+                missing.append(name)
+            else:
+                result[name] = cached
+
+        if missing:
+            response = await self.post('players', {"query": missing, "template": {"name": True, "uuid": True}})
+            if response is None:
+                # API trouble, don't cache anything
+                return {**result, **{name: None for name in missing}}
+            found = {x['name'].lower(): x['uuid'] for x in response if isinstance(x, dict) and x.get('name') and x.get('uuid')}
+            for name in missing:
+                result[name] = found.get(name.lower())
+                self.uuid_cache.set(name.lower(), result[name])
+        return result
+
+    # {uuid: discord id or None} for the given minecraft uuids
+    async def resolve_discord_ids(self, uuids):
+        result, missing = {}, []
+        for uuid in uuids:
+            cached = self.discord_cache.get(uuid)
+            if cached is TTLCache.MISSING:
+                missing.append(uuid)
+            else:
+                result[uuid] = cached
+
+        if missing:
+            response = await self.post('discord', {"query": [{"type": "minecraft", "target": x} for x in missing]})
+            if response is None:
+                return {**result, **{uuid: None for uuid in missing}}
+            # Results come back in query order
+            for uuid, entry in zip(missing, response):
+                discord_id = int(entry['id']) if isinstance(entry, dict) and entry.get('id') else None
+                result[uuid] = discord_id
+                self.discord_cache.set(uuid, discord_id)
+        return result
+
+    # {name: discord id or None}, most calls are answered from the caches
+    async def discord_ids(self, names):
+        uuids = await self.resolve_uuids(names)
+        ids = await self.resolve_discord_ids([x for x in uuids.values() if x])
+        return {name: ids.get(uuid) if uuid else None for name, uuid in uuids.items()}
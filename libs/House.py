@@ -0,0 +1,248 @@
+import os
+import random
+import threading
+import time
+from array import array
+
+from libs import Bank
+from libs.Blackjack import ACE, CARD_VALUES, hand_value, new_shoe
+
+# Games against the casino: the player's stake is held, then captured into the bank on a
+# loss or paid out of the bank on a win. The edge comes from the payouts and dealer rules
+# below, the Monte Carlo in libs/Simulation.py measures the RTP they give and how large a
+# bet the bank can take without risking ruin
+
+COINFLIP_PAYOUT = float(os.getenv('HOUSE_COINFLIP_PAYOUT') or 1.96)  # Returned per 1 bet on a win
+DICE_EDGE = float(os.getenv('HOUSE_DICE_EDGE') or 0.02)
+DICE_SIDES = 100
+DICE_TARGETS = (1, 95)        # The player wins when the roll is at most their target
+BLACKJACK_DECKS = int(os.getenv('HOUSE_BLACKJACK_DECKS') or 6)
+BLACKJACK_PAYS = 1.5
+BLACKJACK_PENETRATION = 0.75  # Reshuffle once this much of the shoe has been dealt
+DEALER_HITS_SOFT_17 = os.getenv('HOUSE_DEALER_HITS_SOFT_17', '0') == '1'
+PLAYER_STANDS_ON = 17         # Player strategy assumed by the simulator
+
+RUIN_TARGET = float(os.getenv('HOUSE_RUIN_TARGET') or 0.01)  # Acceptable chance of ruin ...
+RUIN_ROUNDS = 2000                                          # ... within this many max bets in a row
+RUIN_PATHS = 1000
+DEFAULT_WIN_FRACTION = 0.002  # Until calibrate() has run, or without numpy
+# Part of the bank this process may promise to its open games, exposure is tracked per
+# process so with several bot processes each gets a share (runsharded.py sets it)
+BANK_SHARE = float(os.getenv('HOUSE_BANK_SHARE') or 1)
+
+GAMES = ('coinflip', 'dice', 'blackjack')
+
+# Largest amount of its own balance the bank may pay out on one game, per game
+win_fractions = dict.fromkeys(GAMES, DEFAULT_WIN_FRACTION)
+dice_win_fractions = {}  # target: win fraction, the risk of a dice bet changes with its odds
+calibration = {}  # game: {'rtp', 'edge', 'win_fraction'} from the last calibrate()
+_calibration_lock = threading.Lock()
+
+
+# Total returned per 1 bet when a dice bet on `target` wins
+def dice_multiplier(target):
+    return round((1 - DICE_EDGE) * DICE_SIDES / target, 4)
+
+
+def roll_dice(rng=random):
+    return rng.randint(1, DICE_SIDES)
+
+
+# Most a game can return per 1 bet, what the bank has to be able to cover
+def max_multiplier(game, target=None):
+    if game == 'coinflip':
+        return COINFLIP_PAYOUT
+    if game == 'dice':
+        return dice_multiplier(target or DICE_TARGETS[0])
+    return 1 + BLACKJACK_PAYS
+
+
+# Payouts promised to games still being played, so concurrent games can't together
+# promise more than the bank holds
+class Exposure:
+    def __init__(self):
+        self.open = 0.0
+        self._lock = threading.Lock()
+
+    # Reserve `amount` if the bank can still cover it on top of everything open
+    def reserve(self, amount, bank_balance):
+        with self._lock:
+            if self.open + amount > bank_balance * BANK_SHARE:
+                return False
+            self.open += amount
+            return True
+
+    def release(self, amount):
+        with self._lock:
+            self.open = max(0.0, self.open - amount)
+
+
+exposure = Exposure()
+
+
+# Largest part of the bank one game may pay out, per dice target for dice
+def win_fraction(game, target=None):
+    if game == 'dice':
+        return dice_win_fractions.get(target or DICE_TARGETS[0], win_fractions['dice'])
+    return win_fractions[game]
+
+
+# Largest bet the bank takes on `game` right now, never more than the bank has free
+def max_bet(game, bank_balance, target=None):
+    free = max(0.0, bank_balance * BANK_SHARE - exposure.open)
+    bet = free * win_fraction(game, target) / (max_multiplier(game, target) - 1)
+    return round(min(bet, free), 2)
+
+
+# A multi-deck shoe shared by every house blackjack table, reshuffled at the cut card
+class Shoe:
+    def __init__(self, decks=BLACKJACK_DECKS, penetration=BLACKJACK_PENETRATION, rng=random):
+        self.decks = decks
+        self.rng = rng
+        self.cut = int(52 * decks * (1 - penetration))
+        self.shuffle()
+
+    def shuffle(self):
+        self.cards = new_shoe(self.decks, self.rng)
+
+    def draw(self):
+        if len(self.cards) <= self.cut:
+            self.shuffle()
+        return self.cards.pop()
+
+
+shoe = Shoe()
+
+
+def is_natural(hand):
+    return len(hand) == 2 and hand_value(hand) == 21
+
+
+def dealer_should_hit(hand):
+    value = hand_value(hand)
+    if value < 17:
+        return True
+    if value == 17 and DEALER_HITS_SOFT_17:
+        # Soft when an ace is still counted as 11
+        hard = sum(CARD_VALUES[card] for card in hand) - 10 * hand.count(ACE)
+        return ACE in hand and hard + 10 == value
+    return False
+
+
+# One player against the dealer, the dealer's second card stays face down until play_dealer()
+class Hand:
+    __slots__ = ('player', 'dealer', 'started')
+
+    def __init__(self, source=shoe):
+        self.player = array('B', [source.draw()])
+        self.dealer = array('B', [source.draw()])
+        self.player.append(source.draw())
+        self.dealer.append(source.draw())
+        self.started = time.time()
+
+    # Either side was dealt a blackjack, the hand is over before the player acts
+    def settled_on_deal(self):
+        return is_natural(self.player) or is_natural(self.dealer)
+
+    # Returns True once the player is bust
+    def hit(self, source=shoe):
+        self.player.append(source.draw())
+        return hand_value(self.player) > 21
+
+    def play_dealer(self, source=shoe):
+        if hand_value(self.player) > 21:
+            return
+        while dealer_should_hit(self.dealer):
+            self.dealer.append(source.draw())
+
+    # The player's net result in units of the bet
+    def result(self):
+        player_natural, dealer_natural = is_natural(self.player), is_natural(self.dealer)
+        if player_natural or dealer_natural:
+            return 0.0 if player_natural and dealer_natural else (BLACKJACK_PAYS if player_natural else -1.0)
+        player, dealer = hand_value(self.player), hand_value(self.dealer)
+        if player > 21:
+            return -1.0
+        if dealer > 21 or player > dealer:
+            return 1.0
+        return 0.0 if player == dealer else -1.0
+
+
+# Sampler per game for the simulator, the player's net result of n rounds per 1 bet
+# Dice is measured at the lowest target, the most volatile bet the bank takes
+def samplers():
+    from libs import Simulation
+
+    return {
+        'coinflip': lambda n, rng: Simulation.coinflip(n, COINFLIP_PAYOUT, rng),
+        'dice': dice_sampler(DICE_TARGETS[0]),
+        'blackjack': lambda n, rng: Simulation.blackjack(
+            n, rng, BLACKJACK_DECKS, DEALER_HITS_SOFT_17, BLACKJACK_PAYS, PLAYER_STANDS_ON,
+        ),
+    }
+
+
+# Dice bets on one target
+def dice_sampler(target):
+    from libs import Simulation
+
+    multiplier = dice_multiplier(target)
+    return lambda n, rng: Simulation.dice(n, target, multiplier, rng, DICE_SIDES)
+
+
+# Largest win, as a fraction of the bank, keeping the chance of ruin within `rounds` max
+# bets at `target`
+def calibrate_win_fraction(sampler, multiplier, rounds, paths, target, rng):
+    from libs import Simulation
+
+    peaks = Simulation.path_peaks(sampler, rounds, paths, rng)
+    return float(min(Simulation.max_bet_fraction(peaks, target) * (multiplier - 1), 1.0))
+
+
+# Measure every game's RTP and the largest win, as a fraction of the bank, that keeps the
+# chance of ruin within RUIN_ROUNDS max bets at RUIN_TARGET. Dice is calibrated at every
+# target, its 'win_fraction' is the lowest of them and its 'by_target' has every target's
+# Needs numpy, takes seconds
+def calibrate(rounds=RUIN_ROUNDS, paths=RUIN_PATHS, target=RUIN_TARGET, seed=None):
+    import numpy as np
+    from libs import Simulation
+
+    rng = np.random.default_rng(seed)
+    results = {}
+    for game, sampler in samplers().items():
+        rtp = Simulation.rtp(sampler(rounds * paths, rng))
+        results[game] = {
+            'rtp': float(rtp),
+            'edge': float(1 - rtp),
+            'win_fraction': calibrate_win_fraction(sampler, max_multiplier(game), rounds, paths, target, rng),
+        }
+    dice_fractions = {
+        dice_target: calibrate_win_fraction(dice_sampler(dice_target), dice_multiplier(dice_target), rounds, paths, target, rng)
+        for dice_target in range(DICE_TARGETS[0], DICE_TARGETS[1] + 1)
+    }
+    results['dice']['win_fraction'] = min(dice_fractions.values())
+    results['dice']['by_target'] = dice_fractions
+    apply_calibration(results)
+    return results
+
+
+# Use the bet limits in a calibrate() result
+def apply_calibration(results):
+    for game, result in results.items():
+        win_fractions[game] = result['win_fraction']
+    dice_win_fractions.clear()
+    dice_win_fractions.update(results['dice'].get('by_target', {}))
+    calibration.clear()
+    calibration.update(results)
+
+
+# Calibrate once per process, later calls (e.g. after a cog reload) wait for or reuse the
+# first result. Behind the ledger service the service calibrates, once for every process
+def calibrate_once():
+    with _calibration_lock:
+        if not calibration:
+            if Bank.client is not None:
+                apply_calibration(Bank.client.submit('house_calibration').result())
+            else:
+                calibrate()
+        return dict(calibration)
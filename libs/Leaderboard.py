@@ -0,0 +1,127 @@
+import threading
+from bisect import bisect_left, insort
+
+# Every user with a positive balance in memory, richest first, for /leaderboard
+# Keys are (-balance, userid) so ties are broken by id. They are kept in sorted blocks of
+# a few hundred (a list of lists, like a B-tree one level deep) with a Fenwick tree over
+# the block lengths, so an update, a rank lookup or finding the start of a page is
+# O(log n) and reading the top page touches one block
+
+LOAD = 500  # Blocks are split past twice this many keys
+
+
+class RankIndex:
+    def __init__(self, load=LOAD):
+        self.load = load
+        self._blocks = []   # Sorted blocks of keys
+        self._maxes = []    # Last key of each block
+        self._tree = [0]    # Fenwick tree over len(block), 1-indexed
+        self._keys = {}     # userid: key
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Replace everything with {userid: balance}
+    def reset(self, balances):
+        keys = sorted((-balance, userid) for userid, balance in balances.items() if balance > 0)
+        with self._lock:
+            self._keys = {key[1]: key for key in keys}
+            self._blocks = [keys[i:i + self.load] for i in range(0, len(keys), self.load)]
+            self._maxes = [block[-1] for block in self._blocks]
+            self._rebuild()
+
+    # Apply new balances {userid: balance}, a user at zero or below leaves the board
+    def update(self, balances):
+        with self._lock:
+            for userid, balance in balances.items():
+                old = self._keys.pop(userid, None)
+                if old is not None:
+                    self._remove(old)
+                if balance > 0:
+                    key = self._keys[userid] = (-balance, userid)
+                    self._insert(key)
+
+    # 1-based position of a user, None if they have no balance
+    def rank(self, userid):
+        with self._lock:
+            key = self._keys.get(userid)
+            if key is None:
+                return None
+            i = bisect_left(self._maxes, key)
+            return self._prefix(i) + bisect_left(self._blocks[i], key) + 1
+
+    # Up to `limit` entries from position `offset` (0-based), as (rank, userid, balance)
+    def page(self, offset, limit):
+        with self._lock:
+            if offset >= len(self._keys) or limit <= 0:
+                return []
+            i, j = self._find(offset)
+            rows = []
+            while i < len(self._blocks) and len(rows) < limit:
+                for balance, userid in self._blocks[i][j:j + limit - len(rows)]:
+                    rows.append((offset + len(rows) + 1, userid, -balance))
+                i, j = i + 1, 0
+            return rows
+
+    def _insert(self, key):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._rebuild()
+            return
+        i = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, key)
+        self._maxes[i] = block[-1]
+        if len(block) > 2 * self.load:
+            self._blocks[i:i + 1] = [block[:self.load], block[self.load:]]
+            self._maxes[i:i + 1] = [block[self.load - 1], block[-1]]
+            self._rebuild()
+        else:
+            self._add(i, 1)
+
+    def _remove(self, key):
+        i = bisect_left(self._maxes, key)
+        block = self._blocks[i]
+        del block[bisect_left(block, key)]
+        if block:
+            self._maxes[i] = block[-1]
+            self._add(i, -1)
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+            self._rebuild()
+
+    def _rebuild(self):
+        tree = [0] * (len(self._blocks) + 1)
+        for i, block in enumerate(self._blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _add(self, i, delta):
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    # Keys in the blocks before block i
+    def _prefix(self, i):
+        total = 0
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    # (block, index in block) of the key at position pos
+    def _find(self, pos):
+        i, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if i + step < len(self._tree) and self._tree[i + step] <= pos:
+                i += step
+                pos -= self._tree[i]
+            step >>= 1
+        return i, pos
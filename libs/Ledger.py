@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from libs import Bank
+
+# Awaitable versions of the libs.Bank functions for use inside the bot
+# Every write goes through one dedicated writer thread so commits never block the
+# event loop and never fight each other for the sqlite write lock, reads run on a
+# small pool of their own (WAL lets them proceed while the writer is committing)
+READER_THREADS = 4
+
+# Set LEDGER_COALESCE_MS to group writes arriving within that many milliseconds into one
+# commit (see Bank.WriteCoalescer for the durability trade-off), off by default
+# Behind the ledger service (Bank.client set) the service does the coalescing, a client
+# process has no database of its own to batch into
+COALESCE_WINDOW = float(os.getenv('LEDGER_COALESCE_MS') or 0) / 1000
+COALESCE_MAX_OPS = int(os.getenv('LEDGER_COALESCE_MAX_OPS') or 128)
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger-writer')
+_readers = ThreadPoolExecutor(max_workers=READER_THREADS, thread_name_prefix='ledger-reader')
+_coalescer = Bank.WriteCoalescer(COALESCE_WINDOW, COALESCE_MAX_OPS) if COALESCE_WINDOW > 0 and Bank.client is None else None
+
+
+async def _run(executor, func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+
+async def _write(func, *args):
+    if _coalescer:
+        return await asyncio.wrap_future(_coalescer.submit(func, *args))
+    return await _run(_writer, func, *args)
+
+
+# Get user balance
+# Cached balances are answered straight away without a trip to the reader pool
+async def get_user_balance(userid):
+    balance = Bank.cache.peek(str(userid))
+    if balance is not None:
+        return balance
+    return await _run(_readers, Bank.get_user_balance, userid)
+
+# Balance minus what is on hold, answered from memory for cached users
+async def get_available_balance(userid):
+    balance = Bank.cache.peek(str(userid))
+    if balance is not None:
+        return balance - Bank.held.get(str(userid), 0.0)
+    return await _run(_readers, Bank.get_available_balance, userid)
+
+# Get bank balance
+async def get_bank_balance():
+    balance = Bank.cache.peek(Bank.BANK_KEY)
+    if balance is not None:
+        return balance
+    return await _run(_readers, Bank.get_bank_balance)
+
+# Leaderboard page and rank lookups, answered from the in-memory index (or the ledger
+# service's, through the reader pool)
+async def get_leaderboard(offset=0, limit=10):
+    if Bank.client is not None:
+        return await _run(_readers, Bank.get_leaderboard, offset, limit)
+    return Bank.get_leaderboard(offset, limit)
+
+async def get_rank(userid):
+    if Bank.client is not None:
+        return await _run(_readers, Bank.get_rank, userid)
+    return Bank.get_rank(userid)
+
+# Update user balance
+async def change_balance(userid, amount, kind='adjust', counterparty=None):
+    return await _write(Bank.change_balance, userid, amount, kind, counterparty)
+
+# Transfer between users
+async def transfer(sender, receiver, amount, kind='pay'):
+    return await _write(Bank.transfer, sender, receiver, amount, kind)
+
+# Transfer to/from bank
+async def bank_transfer(userid, amount, kind='reward'):
+    return await _write(Bank.bank_transfer, userid, amount, kind)
+
+# Apply several balance changes in one transaction
+async def settle(deltas, kind='adjust'):
+    return await _write(Bank.settle, deltas, kind)
+
+# Settle a two player bet
+async def settle_wager(winner, loser, amount, kind='adjust'):
+    return await _write(Bank.settle_wager, winner, loser, amount, kind)
+
+# Reserve part of a user's available balance, returns the hold id
+async def place_hold(userid, amount, reason='bet', ttl=Bank.HOLD_TTL):
+    return await _write(Bank.place_hold, userid, amount, reason, ttl)
+
+# Free a hold without moving money
+async def release_hold(hold_id):
+    return await _write(Bank.release_hold, hold_id)
+
+# Turn a hold into a debit
+async def capture_hold(hold_id, kind='adjust', counterparty=None):
+    return await _write(Bank.capture_hold, hold_id, kind, counterparty)
+
+# Free the holds of a game and settle it in one transaction
+async def capture_holds(hold_ids, deltas, kind='adjust'):
+    return await _write(Bank.capture_holds, hold_ids, deltas, kind)
+
+# Free a stake and settle a game against the bank in one transaction
+async def settle_house(hold_id, net, kind='house'):
+    return await _write(Bank.settle_house, hold_id, net, kind)
+
+# Apply a bulk import in one transaction (or report it with dry_run)
+async def bulk_adjust(rows, kind='import', source='adjust', dry_run=False):
+    return await _write(Bank.bulk_adjust, rows, kind, source, dry_run)
+
+# Free holds past their expiry
+async def release_expired_holds():
+    return await _write(Bank.release_expired_holds)
+
+# Page through a user's journal
+async def get_history(userid, limit=10, before=None):
+    return await _run(_readers, Bank.get_history, userid, limit, before)
+
+# Fold old journal rows into snapshots
+async def compact_journal(older_than):
+    return await _write(Bank.compact_journal, older_than)
+
+# Run any other function that writes to the database on the writer thread
+async def write(func, *args):
+    return await _write(func, *args)
+
+# Run any other read-only database function on the reader pool
+async def read(func, *args):
+    return await _run(_readers, func, *args)
+
+
+# Wait for queued writes and stop the worker threads (used on shutdown)
+def shutdown():
+    if _coalescer:
+        _coalescer.stop()
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
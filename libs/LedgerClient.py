@@ -0,0 +1,156 @@
+import itertools
+import marshal
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import Future
+
+# Client side of the ledger service (libs/LedgerService.py), the single process that owns
+# the database when the bot runs as several processes. With LEDGER_SOCKET set libs.Bank
+# swaps its public functions for calls through here, so callers don't change
+#
+# Protocol: every frame is a HEADER (payload length, request id, op or status) followed by
+# a marshal payload, the arguments tuple on the way in and the result (or error message)
+# on the way back. Requests are pipelined: a connection sends as many as it likes without
+# waiting, responses come back tagged with the request id, possibly out of order
+
+HEADER = struct.Struct('>IIH')
+MAX_FRAME = 64 * 1024 * 1024
+POOL_SIZE = int(os.getenv('LEDGER_POOL_SIZE') or 4)
+CALL_TIMEOUT = float(os.getenv('LEDGER_TIMEOUT') or 30)
+
+# Response statuses
+OK, VALUE_ERROR, ERROR = 0, 1, 2
+
+# Operations by number, the index in this tuple is what goes on the wire
+# Bank ops share the name of the libs.Bank function they run
+BANK_OPS = (
+    'get_user_balance', 'get_available_balance', 'get_bank_balance', 'change_balance', 'transfer',
+    'bank_transfer', 'settle', 'settle_wager', 'place_hold', 'release_hold', 'capture_hold', 'capture_holds',
+    'settle_house', 'release_expired_holds', 'get_history', 'compact_journal', 'get_leaderboard', 'get_rank',
+    'bulk_adjust', 'balances_page',
+)
+SESSION_OPS = ('save_session', 'load_session', 'finish_session', 'abandon_session', 'stale_sessions', 'resume_sessions')
+HOUSE_OPS = ('house_calibration',)
+OPS = ('ping',) + BANK_OPS + SESSION_OPS + HOUSE_OPS
+OP_CODES = {name: code for code, name in enumerate(OPS)}
+
+
+class ServiceError(Exception):
+    pass
+
+
+def encode(request_id, code, payload):
+    data = marshal.dumps(payload)
+    return HEADER.pack(len(data), request_id, code) + data
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError('Ledger service closed the connection')
+        buffer += chunk
+    return bytes(buffer)
+
+
+# One socket with a reader thread matching responses to the futures waiting on them
+class Connection:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._send_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._read_loop, name='ledger-client', daemon=True)
+        self._thread.start()
+
+    def submit(self, op, args):
+        future = Future()
+        with self._send_lock:
+            if self.closed:
+                raise ConnectionError('Ledger service connection is closed')
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self._pending[request_id] = future
+            try:
+                self.sock.sendall(encode(request_id, OP_CODES[op], args))
+            except OSError:
+                self._pending.pop(request_id, None)
+                self._close()
+                raise
+        return future
+
+    def _read_loop(self):
+        try:
+            while True:
+                length, request_id, status = HEADER.unpack(_recv_exact(self.sock, HEADER.size))
+                payload = marshal.loads(_recv_exact(self.sock, length))
+                future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if status == OK:
+                    future.set_result(payload)
+                elif status == VALUE_ERROR:
+                    future.set_exception(ValueError(payload))
+                else:
+                    future.set_exception(ServiceError(payload))
+        except (OSError, ValueError, EOFError) as e:
+            with self._send_lock:
+                self._close()
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError(f'Lost the ledger service: {e}'))
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    def close(self):
+        with self._send_lock:
+            self._close()
+
+
+# A fixed pool of pipelined connections shared by every thread, opened on first use and
+# reopened after the service restarts. Calls are never retried, a write may have applied
+class Client:
+    def __init__(self, path, size=POOL_SIZE, timeout=CALL_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._pool = [None] * size
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        index = next(self._next) % len(self._pool)
+        conn = self._pool[index]
+        if conn is None or conn.closed:
+            with self._lock:
+                conn = self._pool[index]
+                if conn is None or conn.closed:
+                    conn = self._pool[index] = Connection(self.path)
+        return conn
+
+    def submit(self, op, *args):
+        return self._connection().submit(op, args)
+
+    def call(self, op, *args):
+        return self.submit(op, *args).result(self.timeout)
+
+    # A function calling `op` with its (positional) arguments, named after it
+    def stub(self, op):
+        def call(*args):
+            return self.call(op, *args)
+        call.__name__ = call.__qualname__ = op
+        return call
+
+    def close(self):
+        for conn in self._pool:
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import marshal
+import os
+import signal
+import time
+
+# This process owns the database, libs.Bank must open it rather than connect to us
+os.environ['LEDGER_SERVICE'] = '1'
+
+from libs import Bank, Blackjack, House, Metrics  # noqa: E402
+from libs import Ledger as ledger  # noqa: E402
+from libs.LedgerClient import ERROR, HEADER, MAX_FRAME, OK, OPS, VALUE_ERROR, encode  # noqa: E402
+
+# The single writer behind several bot processes: serves the libs.Bank API (and the
+# blackjack session store) over a Unix socket with the protocol in libs/LedgerClient.py
+# Requests from every connection run through libs.Ledger, so writes are applied one at a
+# time on its writer thread in the order they arrived and reads use its reader pool and
+# balance cache, which stay correct because nothing else writes the file
+#
+#     python -m libs.LedgerService --socket store/ledger.sock
+
+DEFAULT_SOCKET = os.path.join(os.path.dirname(Bank.DB_PATH), 'ledger.sock')
+
+_request_seconds = Metrics.histogram('casino_ledger_request_seconds', 'Ledger service requests by op', ('op',))
+_connections = Metrics.gauge('casino_ledger_connections', 'Open ledger service connections')
+_clients = set()  # Connection tasks, cancelled on shutdown
+
+
+async def _save_session(session_id, row):
+    session = Blackjack._session((session_id,) + tuple(row))
+    return await ledger.write(Blackjack.save_session, session)
+
+
+async def _load_session(session_id):
+    session = await ledger.read(Blackjack.load_session, session_id)
+    return (session.id,) + Blackjack._row(session) if session else None
+
+
+async def _stale_sessions(timeout):
+    return [(session.id,) + Blackjack._row(session) for session in await ledger.read(Blackjack.stale_sessions, timeout)]
+
+
+async def _ping():
+    return True
+
+
+# op name: coroutine function taking the request's arguments
+HANDLERS = {
+    'ping': _ping,
+    'balances_page': lambda *args: ledger.read(Bank.balances_page, *args),
+    'save_session': _save_session,
+    'load_session': _load_session,
+    'finish_session': lambda row, kind: ledger.write(Blackjack.finish_session, Blackjack._session(tuple(row)), kind),
+    'abandon_session': lambda row: ledger.write(Blackjack.abandon_session, Blackjack._session(tuple(row))),
+    'stale_sessions': _stale_sessions,
+    'resume_sessions': lambda: ledger.write(Blackjack.resume_sessions),
+    'house_calibration': lambda: asyncio.to_thread(House.calibrate_once),
+}
+for _op in OPS:
+    if _op not in HANDLERS:
+        HANDLERS[_op] = getattr(ledger, _op)
+
+
+async def handle(request_id, code, payload, writer):
+    op = OPS[code] if code < len(OPS) else None
+    start = time.perf_counter()
+    try:
+        if op is None:
+            raise KeyError(f'unknown op {code}')
+        result = await HANDLERS[op](*marshal.loads(payload))
+        response = encode(request_id, OK, result)
+    except ValueError as e:
+        response = encode(request_id, VALUE_ERROR, str(e))
+    except Exception as e:
+        print(f'LEDGER SERVICE ERROR ({op}): {type(e).__name__}: {e}')
+        response = encode(request_id, ERROR, f'{type(e).__name__}: {e}')
+    _request_seconds.labels(op or 'unknown').observe(time.perf_counter() - start)
+    if not writer.is_closing():
+        writer.write(response)
+
+
+# Read frames off one connection and start each request straight away (pipelining)
+# Tasks are started in arrival order, so a connection's writes reach the writer thread in
+# the order they were sent. Responses go back as they finish
+async def serve_connection(reader, writer):
+    series = _connections.labels()
+    series.set(series.value + 1)
+    _clients.add(asyncio.current_task())
+    tasks = set()
+    try:
+        while True:
+            header = await reader.readexactly(HEADER.size)
+            length, request_id, code = HEADER.unpack(header)
+            if length > MAX_FRAME:
+                print(f'LEDGER SERVICE: frame of {length} bytes, closing the connection')
+                return
+            payload = await reader.readexactly(length)
+            task = asyncio.create_task(handle(request_id, code, payload, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if writer.transport.get_write_buffer_size() > MAX_FRAME:
+                await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        if tasks:
+            await asyncio.wait(tasks)
+        series.set(series.value - 1)
+        _clients.discard(asyncio.current_task())
+        writer.close()
+
+
+async def run(path, metrics_port=None):
+    if os.path.exists(path):
+        os.unlink(path)
+    # Only our own user may talk to the ledger (the protocol has no authentication), so the
+    # socket is created 0600 rather than chmod'ed after it is already listening
+    umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(serve_connection, path)
+    finally:
+        os.umask(umask)
+    if metrics_port:
+        await Metrics.serve(metrics_port)
+    print(f'Ledger service on {path} ({Bank.DB_PATH})')
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    # Stop taking requests, let the ones in flight answer, then drain the writer thread
+    server.close()
+    clients = list(_clients)
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    ledger.shutdown()
+    os.unlink(path)
+    print('Ledger service stopped')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single writer ledger service for multi-process deployments.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--metrics-port', type=int, help='serve /metrics for this process on this port')
+    args = parser.parse_args()
+    asyncio.run(run(args.socket, args.metrics_port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Deposit matching for the auto-deposit watcher
+# A receiver's balance gain in one tick can be the sum of several customers paying at
+# once. The matcher looks for the set of payer debits that adds up exactly to each
+# receiver's gain, preferring payers standing closest to the chest, and keeps what it
+# can't explain yet for a few ticks in case the other half shows up late
+
+# Payers considered per receiver, the nearest ones to the chest are kept
+MAX_CANDIDATES = 16
+# Partial sums tracked by the subset search before far away payers are dropped
+MAX_STATES = 200000
+# Ticks an unexplained gain or debit is carried forward before it is dropped
+RESIDUE_TICKS = 3
+
+
+# Money as integer cents so sums compare exactly
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def from_cents(cents):
+    return cents // 100 if cents % 100 == 0 else cents / 100
+
+
+# Cheapest subset of items whose amounts add up to target
+# items are (key, cents, distance), returns the chosen keys or None
+# Sparse DP over reachable sums: every state is sum -> (total distance, chosen keys),
+# sums above the target are never stored so the table is bounded by the target too
+def subset_sum(items, target):
+    best = {0: (0.0, ())}
+    for key, cents, distance in items:
+        if cents <= 0:
+            continue
+        additions = {}
+        for total, (cost, chosen) in best.items():
+            reached = total + cents
+            if reached > target:
+                continue
+            candidate = (cost + distance, chosen + (key,))
+            current = additions.get(reached) or best.get(reached)
+            if current is None or candidate[0] < current[0] or (candidate[0] == current[0] and len(candidate[1]) < len(current[1])):
+                additions[reached] = candidate
+        best.update(additions)
+        # Items come nearest first, so running out of room only drops far away payers
+        if len(best) > MAX_STATES:
+            break
+    found = best.get(target)
+    return found[1] if found else None
+
+
+class DepositMatcher:
+    def __init__(self, max_candidates=MAX_CANDIDATES, residue_ticks=RESIDUE_TICKS):
+        self.max_candidates = max_candidates
+        self.residue_ticks = residue_ticks
+        self.pending_gains = {}    # {receiver: [[cents, age], ...]} oldest first
+        self.pending_debits = []   # [[item id, payer, cents, age]]
+        self._next_id = 0
+
+    # gains {receiver: amount gained this tick}, debits {payer: amount paid this tick}
+    # candidates {receiver: {payer: distance to that receiver's chest}}
+    # Returns [(payer, receiver, amount)] for every deposit explained this tick
+    def match(self, gains, debits, candidates):
+        for receiver, amount in gains.items():
+            if amount > 0:
+                self.pending_gains.setdefault(receiver, []).append([to_cents(amount), 0])
+        for payer, amount in debits.items():
+            if amount > 0:
+                self.pending_debits.append([self._next_id, payer, to_cents(amount), 0])
+                self._next_id += 1
+
+        matches = []
+        claimed = set()
+        # Largest gains first, they are the hardest to explain
+        for receiver, gains_left in sorted(self.pending_gains.items(), key=lambda x: -sum(g[0] for g in x[1])):
+            near = candidates.get(receiver, {})
+            items = [
+                (item_id, cents, near[payer]) for item_id, payer, cents, _ in self.pending_debits
+                if item_id not in claimed and payer in near
+            ]
+            if not items:
+                continue
+            items.sort(key=lambda x: x[2])
+            items = items[:self.max_candidates]
+
+            # Everything still unexplained together first
+            attempts = [gains_left]
+            if len(gains_left) > 1:
+                # Then each gain on its own (newest first) so an unrelated income doesn't
+                # block the deposits that came after it, with one gain the sum already covers it
+                attempts.extend([g] for g in reversed(gains_left))
+            chosen, explained = None, None
+            for attempt in attempts:
+                chosen = subset_sum(items, sum(g[0] for g in attempt))
+                if chosen:
+                    explained = list(attempt)
+                    break
+            if not chosen:
+                continue
+
+            claimed.update(chosen)
+            for gain in explained:
+                gains_left.remove(gain)
+            paid = {}
+            for item_id, payer, cents, _ in self.pending_debits:
+                if item_id in chosen:
+                    paid[payer] = paid.get(payer, 0) + cents
+            matches.extend((payer, receiver, from_cents(cents)) for payer, cents in paid.items())
+
+        self.pending_debits = [x for x in self.pending_debits if x[0] not in claimed]
+        self._age()
+        return matches
+
+    def _age(self):
+        for receiver, gains_left in list(self.pending_gains.items()):
+            for entry in gains_left:
+                entry[1] += 1
+            gains_left[:] = [x for x in gains_left if x[1] < self.residue_ticks]
+            if not gains_left:
+                del self.pending_gains[receiver]
+        for entry in self.pending_debits:
+            entry[3] += 1
+        self.pending_debits = [x for x in self.pending_debits if x[3] < self.residue_ticks]
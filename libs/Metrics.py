@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import functools
+import re
+import threading
+import time
+
+# In-process metrics: counters and latency histograms, rendered in the Prometheus text
+# format for the local /metrics endpoint and summarised for the admin /stats command
+# Recording is a bisect and a few additions under a lock, cheap enough for every DB call
+
+# Latency buckets in seconds, from a cached balance read up to a slow API call
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Slash commands can wait on a button for half a minute
+COMMAND_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LOOP_LAG_INTERVAL = 0.5   # Seconds between event loop lag probes
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    # with histogram.time(): ...
+    def time(self):
+        return _Timer(self)
+
+    # Upper bound of the bucket holding the pct-th percentile (inf past the last bucket)
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+# A metric and its label names, each combination of label values is its own series
+class Family:
+    def __init__(self, kind, name, help, labels, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.factory = factory
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        series = self.series.get(values)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(values, self.factory())
+        return series
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.collectors = {}
+
+    def _family(self, kind, name, help, labels, factory):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = Family(kind, name, help, tuple(labels), factory)
+        return family
+
+    def counter(self, name, help, labels=()):
+        return self._family('counter', name, help, labels, Counter)
+
+    def gauge(self, name, help, labels=()):
+        return self._family('gauge', name, help, labels, Gauge)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._family('histogram', name, help, labels, lambda: Histogram(buckets))
+
+    # func() returns a flat dict of numbers (e.g. Bank.cache_stats), read at scrape time
+    def register_collector(self, name, func):
+        self.collectors[name] = func
+
+    def collect(self):
+        results = {}
+        for name, func in self.collectors.items():
+            try:
+                results[name] = func() or {}
+            except Exception as e:
+                print(f'METRICS COLLECTOR ERROR ({name}): {e}')
+                results[name] = {}
+        return results
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for values, series in list(family.series.items()):
+                labels = _labels(family.label_names, values)
+                if family.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(series.buckets + ('+Inf',), series.counts):
+                        cumulative += count
+                        lines.append(f'{family.name}_bucket{_labels(family.label_names, values, ("le", bound))} {cumulative}')
+                    lines.append(f'{family.name}_sum{labels} {series.sum}')
+                    lines.append(f'{family.name}_count{labels} {series.count}')
+                else:
+                    lines.append(f'{family.name}{labels} {series.value}')
+
+        for name, values in self.collect().items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric = _invalid_name.sub('_', f'casino_{name}_{key}')
+                    lines.append(f'# TYPE {metric} gauge')
+                    lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+_invalid_name = re.compile(r'[^a-zA-Z0-9_]')  # Collector keys become metric names
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+register_collector = registry.register_collector
+render = registry.render
+
+
+# Decorator timing every call of a sync function into histogram{label}, and counting the
+# calls that raise into errors{label}
+def timed(histogram, label, errors=None):
+    series = histogram.labels(label)
+    error_series = errors.labels(label) if errors is not None else None
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                if error_series is not None:
+                    error_series.inc()
+                raise
+            finally:
+                series.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+loop_lag = histogram('casino_event_loop_lag_seconds', 'How late the event loop woke up for a timer')
+loop_lag_max = gauge('casino_event_loop_lag_max_seconds', 'Worst event loop lag seen since startup')
+
+
+# Sleep for a fixed interval and record how much later than asked the loop woke us up
+# A blocked event loop (sync I/O, heavy CPU) shows up here before anywhere else
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    series, worst = loop_lag.labels(), loop_lag_max.labels()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        series.observe(lag)
+        if lag > worst.value:
+            worst.set(lag)
+
+
+# Serve render() on http://host:port/metrics for Prometheus, returns the aiohttp runner
+async def serve(port, host='127.0.0.1'):
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=render(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# [(family, label values, count, p50, p99)] for every histogram series, for /stats
+def summary(prefix=''):
+    rows = []
+    for family in list(registry.families.values()):
+        if family.kind != 'histogram' or not family.name.startswith(prefix):
+            continue
+        for values, series in sorted(family.series.items()):
+            if series.count:
+                rows.append((family.name, values, series.count, series.percentile(50), series.percentile(99)))
+    return rows
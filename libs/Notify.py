@@ -0,0 +1,247 @@
+import asyncio
+import io
+import time
+from collections import OrderedDict, deque
+
+import discord
+
+from libs import Metrics
+
+# Outgoing Discord messages that nobody has to wait for: deposit DMs, log channel lines,
+# reports and message edits. Callers enqueue and return at once, a few workers deliver in
+# the background under per-route token buckets so a busy period is smoothed out here
+# instead of running into Discord's rate limits. Log lines are coalesced into one message
+# per LOG_FLUSH_INTERVAL
+
+QUEUE_SIZE = 1000           # Pending DMs, sends and edits, more are dropped
+LOG_BUFFER = 2000           # Pending log lines, the oldest are dropped past this
+LOG_FLUSH_INTERVAL = 2.0    # Seconds between log channel messages
+MESSAGE_LIMIT = 2000        # Discord's message content limit
+WORKERS = 4                 # Deliveries in flight at once
+RETRIES = 3                 # Retries of a delivery that failed on a 5xx or connection error
+RETRY_DELAY = 1.0           # Doubled on every retry
+MAX_BUCKETS = 1000          # Route buckets kept, the least recently used go first
+
+# (per minute, burst) for each kind of route, and for everything together
+CHANNEL_RATE = (60, 5)      # Discord allows 5 messages per 5s per channel
+DM_RATE = (30, 3)
+GLOBAL_RATE = (2400, 40)    # Discord's global limit is 50 requests per second
+
+_delay = Metrics.histogram('casino_notify_delay_seconds', 'Time from enqueue to delivery', ('kind',), Metrics.COMMAND_BUCKETS)
+_outcomes = Metrics.counter('casino_notify_total', 'Notifications by outcome', ('kind', 'outcome'))
+
+
+# Token bucket for one route
+class Bucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# A queued delivery: kind is 'dm', 'send' or 'edit', target a user or channel id
+class Item:
+    __slots__ = ('kind', 'target', 'message_id', 'kwargs', 'attempt', 'queued')
+
+    def __init__(self, kind, target, kwargs, message_id=None):
+        self.kind = kind
+        self.target = int(target)
+        self.message_id = message_id
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.queued = time.perf_counter()
+
+
+class Dispatcher:
+    def __init__(self, size=QUEUE_SIZE, interval=LOG_FLUSH_INTERVAL, workers=WORKERS):
+        self.bot = None
+        self.log_channel_id = None
+        self.interval = interval
+        self.workers = workers
+        self.queue = asyncio.Queue(size)
+        self.lines = deque()
+        self.buckets = OrderedDict()
+        self.global_bucket = Bucket(*GLOBAL_RATE)
+        self.tasks = []
+        self._retries = set()
+        self.stats = {'sent': 0, 'failed': 0, 'dropped': 0, 'retried': 0, 'log_lines': 0, 'log_messages': 0}
+
+    # Start delivering for `bot`, safe to call again on every on_ready
+    def start(self, bot, log_channel_id=None):
+        self.bot = bot
+        self.log_channel_id = int(log_channel_id) if log_channel_id else None
+        if any(not task.done() for task in self.tasks):
+            return
+        self.tasks = [asyncio.create_task(self._flush_loop(), name='notify-logs')]
+        self.tasks += [asyncio.create_task(self._worker(), name=f'notify-{i}') for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks + list(self._retries):
+            task.cancel()
+        await self.flush()
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            _outcomes.labels(item.kind, 'dropped').inc()
+            print(f'NOTIFY QUEUE FULL, dropped a {item.kind} to {item.target}')
+            return False
+
+    # A line for the log channel, sent along with the others queued in the same interval
+    def log(self, line):
+        if len(self.lines) >= LOG_BUFFER:
+            self.lines.popleft()
+            self.stats['dropped'] += 1
+            _outcomes.labels('log', 'dropped').inc()
+        self.lines.append(str(line)[:MESSAGE_LIMIT - 1])  # Room for the newline that joins it
+
+    def dm(self, user_id, content=None, embed=None):
+        return self._put(Item('dm', user_id, {'content': content, 'embed': embed}))
+
+    # file is (filename, bytes), a discord.File can only be sent once and a retry needs another
+    def send(self, channel_id, content=None, embed=None, file=None):
+        return self._put(Item('send', channel_id, {'content': content, 'embed': embed, 'file': file}))
+
+    def edit(self, channel_id, message_id, **kwargs):
+        return self._put(Item('edit', channel_id, kwargs, message_id))
+
+    def _bucket(self, kind, target):
+        key = (kind == 'dm', target)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(*(DM_RATE if kind == 'dm' else CHANNEL_RATE))
+            if len(self.buckets) > MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    async def _deliver(self, item):
+        await self._bucket(item.kind, item.target).acquire()
+        await self.global_bucket.acquire()
+        kwargs = {key: value for key, value in item.kwargs.items() if value is not None or item.kind == 'edit'}
+        if 'file' in kwargs:
+            filename, data = kwargs['file']
+            kwargs['file'] = discord.File(io.BytesIO(data), filename=filename)
+
+        if item.kind == 'dm':
+            user = self.bot.get_user(item.target) or await self.bot.fetch_user(item.target)
+            await user.send(**kwargs)
+        elif item.kind == 'send':
+            await self.bot.get_partial_messageable(item.target).send(**kwargs)
+        else:
+            await self.bot.get_partial_messageable(item.target).get_partial_message(item.message_id).edit(**kwargs)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._deliver(item)
+                self.stats['sent'] += 1
+                _outcomes.labels(item.kind, 'sent').inc()
+                _delay.labels(item.kind).observe(time.perf_counter() - item.queued)
+            except (discord.Forbidden, discord.NotFound) as e:
+                # DMs closed, user left, message deleted: retrying won't help
+                self._failed(item, e)
+            except (discord.HTTPException, OSError, asyncio.TimeoutError) as e:
+                if item.attempt < RETRIES and (not isinstance(e, discord.HTTPException) or e.status >= 500):
+                    self._retry(item)
+                else:
+                    self._failed(item, e)
+            except Exception as e:
+                self._failed(item, e)
+            finally:
+                self.queue.task_done()
+
+    def _failed(self, item, error):
+        self.stats['failed'] += 1
+        _outcomes.labels(item.kind, 'failed').inc()
+        print(f'NOTIFY ERROR ({item.kind} to {item.target}): {error}')
+
+    # Requeue after a backoff without holding up a worker
+    def _retry(self, item):
+        delay = RETRY_DELAY * 2 ** item.attempt
+        item.attempt += 1
+        self.stats['retried'] += 1
+        _outcomes.labels(item.kind, 'retried').inc()
+
+        async def later():
+            await asyncio.sleep(delay)
+            self._put(item)
+
+        task = asyncio.create_task(later())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f'NOTIFY LOG FLUSH ERROR: {e}')
+
+    # Send the buffered log lines, as few messages as fit in MESSAGE_LIMIT
+    async def flush(self):
+        if not self.lines:
+            return
+        if self.bot is None or not self.log_channel_id:
+            while self.lines:
+                print(self.lines.popleft())
+            return
+
+        while self.lines:
+            chunk, size = [], 0
+            while self.lines and size + len(self.lines[0]) + 1 <= MESSAGE_LIMIT:
+                line = self.lines.popleft()
+                chunk.append(line)
+                size += len(line) + 1
+            item = Item('send', self.log_channel_id, {'content': '\n'.join(chunk)})
+            try:
+                await self._deliver(item)
+                self.stats['log_lines'] += len(chunk)
+                self.stats['log_messages'] += 1
+                _delay.labels('log').observe(time.perf_counter() - item.queued)
+            except Exception as e:
+                # Put the lines back for the next interval unless the channel is gone, whatever
+                # went wrong (a closed session, a bug) they are sent or counted, never just lost
+                if isinstance(e, (discord.Forbidden, discord.NotFound)):
+                    self._failed(item, e)
+                    continue
+                self.lines.extendleft(reversed(chunk))
+                print(f'NOTIFY LOG FLUSH ERROR: {e}')
+                return
+
+    def status(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'log_lines_pending': len(self.lines),
+            'retries_pending': len(self._retries),
+            **self.stats,
+        }
+
+
+dispatcher = Dispatcher()
+start = dispatcher.start
+log = dispatcher.log
+dm = dispatcher.dm
+send = dispatcher.send
+edit = dispatcher.edit
+
+Metrics.register_collector('notify', dispatcher.status)
@@ -0,0 +1,139 @@
+import asyncio
+import cProfile
+import io
+import linecache
+import pstats
+import time
+import tracemalloc
+
+# Live diagnostics for the running bot: a cProfile window, per-tick profiling of the
+# deposit loop, asyncio task dumps and tracemalloc snapshots. Everything returns plain
+# text so the caller can attach it to a message
+
+TOP = 40                  # Rows per report
+MAX_PROFILE_SECONDS = 600
+TRACEMALLOC_FRAMES = 10
+
+# Only one cProfile can be attached to the event loop thread at a time, this names it
+_active = None
+_stop = None
+_last_snapshot = None
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+# Claim the profiler for `owner` (a short description), returns a fresh cProfile.Profile
+def claim(owner):
+    global _active
+    if _active is not None:
+        raise ProfilerBusy(f'Already profiling: {_active}')
+    _active = owner
+    return cProfile.Profile()
+
+
+def release():
+    global _active
+    _active = None
+
+
+def active():
+    return _active
+
+
+# Profile the event loop thread for `seconds`, or until stop_window() is called
+# The window covers every coroutine and callback the loop runs meanwhile
+async def profile_window(seconds, top=TOP):
+    global _stop
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    profiler = claim(f'{seconds:.0f}s window')
+    _stop = asyncio.Event()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        await asyncio.wait_for(_stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        profiler.disable()
+        _stop = None
+        release()
+    return stats_text(profiler, top, f'Profile of {time.perf_counter() - started:.1f}s')
+
+
+# End a running profile_window() early, returns False if none is running
+def stop_window():
+    if _stop is None:
+        return False
+    _stop.set()
+    return True
+
+
+# Top `top` functions by cumulative and by own time
+def stats_text(profiler, top=TOP, title='Profile'):
+    out = io.StringIO()
+    out.write(f'{title}\n\n')
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs()
+    out.write('=== By cumulative time ===\n')
+    stats.sort_stats('cumulative').print_stats(top)
+    out.write('=== By own time ===\n')
+    stats.sort_stats('tottime').print_stats(top)
+    return out.getvalue()
+
+
+# Every pending asyncio task with the stack it is suspended at
+def task_dump():
+    tasks = sorted(asyncio.all_tasks(), key=lambda x: x.get_name())
+    out = io.StringIO()
+    out.write(f'{len(tasks)} tasks\n\n')
+    for task in tasks:
+        coro = task.get_coro()
+        out.write(f'--- {task.get_name()}: {getattr(coro, "__qualname__", coro)}\n')
+        task.print_stack(limit=TRACEMALLOC_FRAMES, file=out)
+        out.write('\n')
+    return out.getvalue()
+
+
+def tracemalloc_start(frames=TRACEMALLOC_FRAMES):
+    global _last_snapshot
+    _last_snapshot = None
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    return True
+
+
+def tracemalloc_stop():
+    global _last_snapshot
+    _last_snapshot = None
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    return True
+
+
+# Top allocation sites now, and what grew since the previous snapshot
+def tracemalloc_report(top=TOP):
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError('tracemalloc is not running')
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    out = io.StringIO()
+    out.write(f'Traced memory: {current / 1024 / 1024:.1f} MiB now, {peak / 1024 / 1024:.1f} MiB peak\n\n')
+    out.write('=== Largest allocation sites ===\n')
+    for stat in snapshot.statistics('lineno')[:top]:
+        out.write(f'{stat}\n')
+    if _last_snapshot is not None:
+        out.write('\n=== Growth since the last snapshot ===\n')
+        for stat in snapshot.compare_to(_last_snapshot, 'lineno')[:top]:
+            out.write(f'{stat}\n')
+    _last_snapshot = snapshot
+    return out.getvalue()
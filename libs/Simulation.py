@@ -0,0 +1,112 @@
+import numpy as np
+
+# Monte Carlo for the house games in libs/House.py, vectorised with numpy
+# Every sampler returns the player's net result of n rounds in units of the bet (+1 won
+# the bet, -1 lost it, +1.5 a blackjack), so RTP is 1 + mean and the house edge -mean
+
+CARD_VALUES = np.array((2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11), dtype=np.int16)  # Same order as libs.Blackjack
+ACE = 12
+BATCH = 250000
+
+
+def coinflip(n, payout, rng):
+    return np.where(rng.random(n) < 0.5, payout - 1, -1.0)
+
+
+# Roll 1..sides, the player wins when the roll is at most target
+def dice(n, target, multiplier, rng, sides=100):
+    return np.where(rng.integers(1, sides + 1, n) <= target, multiplier - 1, -1.0)
+
+
+# Draw one card per row from the remaining counts (rows, 13), without replacement
+def _draw(counts, rng):
+    rows = np.arange(len(counts))
+    cumulative = counts.cumsum(axis=1)
+    pick = (rng.random(len(counts)) * cumulative[:, -1]).astype(np.int64)
+    rank = (cumulative <= pick[:, None]).sum(axis=1)
+    counts[rows, rank] -= 1
+    return rank
+
+
+# Add a card to (total, soft aces) for the rows in mask, counting aces as 1 when needed
+def _add(total, aces, rank, mask):
+    total += np.where(mask, CARD_VALUES[rank], 0)
+    aces += mask & (rank == ACE)
+    while True:
+        soften = (total > 21) & (aces > 0)
+        if not soften.any():
+            return
+        total -= soften * 10
+        aces -= soften
+
+
+# Heads-up blackjack against the dealer, each round from a freshly shuffled shoe of `decks`
+# The player hits below stand_on, the dealer hits below 17 (and on soft 17 with hit_soft_17)
+def blackjack(n, rng, decks=6, hit_soft_17=False, blackjack_pays=1.5, stand_on=17):
+    results = np.empty(n)
+    for start in range(0, n, BATCH):
+        size = min(BATCH, n - start)
+        counts = np.full((size, 13), 4 * decks, dtype=np.int32)  # 10, J, Q, K are separate ranks
+        everyone = np.ones(size, dtype=bool)
+
+        player, player_aces = np.zeros(size, dtype=np.int16), np.zeros(size, dtype=np.int16)
+        dealer, dealer_aces = np.zeros(size, dtype=np.int16), np.zeros(size, dtype=np.int16)
+        for total, aces in ((player, player_aces), (dealer, dealer_aces), (player, player_aces), (dealer, dealer_aces)):
+            _add(total, aces, _draw(counts, rng), everyone)
+
+        player_natural = player == 21
+        dealer_natural = dealer == 21
+        playing = ~(player_natural | dealer_natural)
+
+        hitting = playing & (player < stand_on)
+        while hitting.any():
+            _add(player, player_aces, _draw(counts, rng), hitting)
+            hitting &= player < stand_on
+
+        drawing = playing & (player <= 21)
+        drawing &= (dealer < 17) | (hit_soft_17 & (dealer == 17) & (dealer_aces > 0))
+        while drawing.any():
+            _add(dealer, dealer_aces, _draw(counts, rng), drawing)
+            drawing &= (dealer < 17) | (hit_soft_17 & (dealer == 17) & (dealer_aces > 0))
+
+        net = np.sign(player - dealer).astype(np.float64)
+        net[dealer > 21] = 1.0
+        net[player > 21] = -1.0
+        net[dealer_natural] = -1.0
+        net[player_natural] = blackjack_pays
+        net[player_natural & dealer_natural] = 0.0
+        results[start:start + size] = net
+    return results
+
+
+def rtp(net):
+    return 1.0 + float(net.mean())
+
+
+# Highest running total each path of `rounds` player results reaches
+# The bank is ruined by bet b once b * max >= its starting balance, so one set of paths
+# answers the question for every bet size
+def path_peaks(sampler, rounds, paths, rng):
+    peaks = np.empty(paths)
+    per_batch = max(1, BATCH // rounds)
+    for start in range(0, paths, per_batch):
+        size = min(per_batch, paths - start)
+        net = sampler(size * rounds, rng).reshape(size, rounds)
+        peaks[start:start + size] = np.maximum(np.cumsum(net, axis=1).max(axis=1), 0.0)
+    return peaks
+
+
+# Chance the bank is ruined within `rounds` rounds when every round is a bet of
+# bet_fraction of its starting balance
+def ruin_probability(peaks, bet_fraction):
+    return float((peaks * bet_fraction >= 1.0).mean())
+
+
+# Largest bet, as a fraction of the bank, keeping the ruin chance at or below target
+# The sample quantile is noisy with a few hundred paths, so fewer paths than the expected
+# target * paths may reach the threshold (z standard errors, a one-sided 99% bound)
+def max_bet_fraction(peaks, target, z=2.33):
+    n = len(peaks)
+    allowed = int(max(0.0, n * target - z * np.sqrt(n * target * (1 - target))))
+    threshold = np.partition(peaks, n - 1 - allowed)[n - 1 - allowed]
+    return 1.0 / threshold if threshold > 0 else 1.0
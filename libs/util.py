@@ -1,61 +1,99 @@
-import os
-from dotenv import load_dotenv
-import discord
-import math
-
-# Get bot token from environment variable
-load_dotenv()
-TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-ADMINID = os.getenv('ADMINUSERID')
-SHOPOWNER = os.getenv('SHOP_OWNER')
-TOWN= os.getenv('TOWN')
-CHEST_X= os.getenv('CHEST_X')
-CHEST_Z= os.getenv('CHEST_Z')
-LOG_CHANNEL_ID= os.getenv('LOG_CHANNEL_ID')
-
-
-if not TOKEN:
-    print("Error: DISCORD_BOT_TOKEN environment variable not set")
-    exit(1)
-if not ADMINID:
-    print("Warning: ADMINUSERID environment variable not set")
-if not SHOPOWNER:
-    print("Warning: ShopOwner environment variable not set (Breaks auto-deposit)")
-
-def token():
-    return TOKEN
-
-def logchannel():
-    return LOG_CHANNEL_ID
-
-def chestcords():
-    return [CHEST_X, CHEST_Z]
-
-def town():
-    return TOWN 
-
-def is_admin(user_id):
-    return str(user_id) == ADMINID  # Ensure user_id is compared as a string
-
-def shop_owner():
-    o = str(SHOPOWNER)
-    return o
-
-def create_embed(title, description, color=discord.Color.blue()):
-    return discord.Embed(title=title, description=description, color=color)
-
-def coordDistance(pos1, pos2):
-    x1, z1 = pos1
-    x2, z2 = pos2
-    return math.sqrt((x2 - x1) ** 2 + (z2 - z1) ** 2)
-
-def isInChunk(chunk_coords, player_pos):
-    chunk_x, chunk_z = chunk_coords
-    player_x, player_z = player_pos
-
-    # Calculate the chunk coordinates of the player
-    player_chunk_x = player_x // 16
-    player_chunk_z = player_z // 16
-
-    # Check if the player's chunk matches the given chunk coordinates
+import os
+from dotenv import load_dotenv
+import discord
+import math
+
+# Get bot token from environment variable
+load_dotenv()
+TOKEN = os.getenv('DISCORD_BOT_TOKEN')
+ADMINID = os.getenv('ADMINUSERID')
+SHOPOWNER = os.getenv('SHOP_OWNER')
+TOWN= os.getenv('TOWN')
+CHEST_X= os.getenv('CHEST_X')
+CHEST_Z= os.getenv('CHEST_Z')
+LOG_CHANNEL_ID= os.getenv('LOG_CHANNEL_ID')
+JOURNAL_RETENTION_DAYS= os.getenv('JOURNAL_RETENTION_DAYS') or 90
+DEPOSIT_WATCHES= os.getenv('DEPOSIT_WATCHES')  # town:receiver:chest_x:chest_z;town:receiver:chest_x:chest_z
+METRICS_PORT= os.getenv('METRICS_PORT') or 9477  # Local Prometheus endpoint, 0 turns it off
+SHARD_COUNT= os.getenv('SHARD_COUNT')  # Total shards when running as several processes (see runsharded.py)
+SHARD_IDS= os.getenv('SHARD_IDS')  # Shards this process runs, comma separated
+
+
+if not TOKEN:
+    print("Error: DISCORD_BOT_TOKEN environment variable not set")
+    exit(1)
+if not ADMINID:
+    print("Warning: ADMINUSERID environment variable not set")
+if not SHOPOWNER:
+    print("Warning: ShopOwner environment variable not set (Breaks auto-deposit)")
+
+def token():
+    return TOKEN
+
+def logchannel():
+    return LOG_CHANNEL_ID
+
+def chestcords():
+    return [CHEST_X, CHEST_Z]
+
+def town():
+    return TOWN 
+
+def deposit_watches():
+    # Every shop chest to watch as (town, receiver, (chest_x, chest_z)), from DEPOSIT_WATCHES
+    # or the single TOWN/SHOP_OWNER/CHEST_X/CHEST_Z shop
+    if not DEPOSIT_WATCHES:
+        if not TOWN or not SHOPOWNER:
+            return []
+        return [(TOWN, SHOPOWNER, (float(CHEST_X or 0), float(CHEST_Z or 0)))]
+
+    watches = []
+    for entry in DEPOSIT_WATCHES.split(';'):
+        if entry.strip():
+            town_name, receiver, chest_x, chest_z = [x.strip() for x in entry.split(':')]
+            watches.append((town_name, receiver, (float(chest_x), float(chest_z))))
+    return watches
+
+def journal_retention():
+    return int(float(JOURNAL_RETENTION_DAYS) * 86400)  # Seconds of transaction history to keep
+
+def metrics_port():
+    return int(METRICS_PORT) or None
+
+def shard_count():
+    return int(SHARD_COUNT) if SHARD_COUNT else None
+
+def shard_ids():
+    return [int(x) for x in SHARD_IDS.split(',')] if SHARD_IDS else None
+
+def is_primary():
+    # The process that runs the once-per-deployment jobs (deposits, command sync, sweeps):
+    # the one with shard 0, or the only one
+    ids = shard_ids()
+    return ids is None or 0 in ids
+
+def is_admin(user_id):
+    return str(user_id) == ADMINID  # Ensure user_id is compared as a string
+
+def shop_owner():
+    o = str(SHOPOWNER)
+    return o
+
+def create_embed(title, description, color=discord.Color.blue()):
+    return discord.Embed(title=title, description=description, color=color)
+
+def coordDistance(pos1, pos2):
+    x1, z1 = pos1
+    x2, z2 = pos2
+    return math.sqrt((x2 - x1) ** 2 + (z2 - z1) ** 2)
+
+def isInChunk(chunk_coords, player_pos):
+    chunk_x, chunk_z = chunk_coords
+    player_x, player_z = player_pos
+
+    # Calculate the chunk coordinates of the player
+    player_chunk_x = player_x // 16
+    player_chunk_z = player_z // 16
+
+    # Check if the player's chunk matches the given chunk coordinates
     return player_chunk_x == chunk_x and player_chunk_z == chunk_z
\ No newline at end of file
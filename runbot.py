@@ -1,209 +1,309 @@
-import discord
-from discord import app_commands
-from discord.ext import commands, tasks
-
-from libs.Bank import get_bank_balance, change_balance, transfer, bank_transfer, get_user_balance, init_db
-from libs.util import is_admin, create_embed, token, shop_owner, coordDistance, isInChunk, logchannel, chestcords, town
-import os
-import time
-import asyncio
-import requests
-import aiohttp
-
-# Initialize the database
-try:
-    init_db()
-except Exception as e:
-    print(f"Error initializing database: {e}")
-    exit(1)
-
-# Create a lock
-deposit_lock = asyncio.Lock()
-config = {'AutoDeposits': True}
-
-# Functions
-async def Confirm(player: str, receiver: str, amount: int, channel: discord.channel):
-    try:
-        response = requests.post('https://api.earthmc.net/v3/aurora/players', json={"query": [player, receiver], "template": {"uuid": True}}).json()
-
-        uuids = [x['uuid'] for x in response if response and len(response) >= 1 and 'uuid' in x]
-
-        if len(uuids) != 2:
-            await channel.send(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
-            return
-
-        response = requests.post('https://api.earthmc.net/v3/aurora/discord', json={"query": [{"type": "minecraft", "target": uuids[0]}, {"type": "minecraft", "target": uuids[1]}]}).json()
-
-        discord_ids = [int(x['id']) for x in response if response and len(response) >= 1 and 'id' in x and x['id']]
-
-        if len(discord_ids) != 2:
-            await channel.send(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
-            return
-            
-        player_obj: discord.User = bot.get_user(discord_ids[0])
-        receiver_obj: discord.User = bot.get_user(discord_ids[1])
-
-        if not receiver_obj or not player_obj:
-            await channel.send(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
-            return
-
-        embed = create_embed(title='Deposit', description=f'✅ Deposited **{amount}g** into your account.')
-        if await player_obj.send(embed=embed):
-            embed = create_embed(title='Deposit', description=f"✅ Deposited **{amount}g** into {player_obj.name}'s account.")
-
-            await receiver_obj.send(embed=embed)
-            
-            current_balance = get_user_balance(player_obj.id)
-            new_balance = change_balance(player_obj.id, amount)
-
-            await channel.send(f"✅ Deposited **{amount}g** into {player_obj.name}'s account. (Received by {receiver_obj.name})")
-            print(f'{player_obj.name} deposited {amount}g > {receiver_obj.name}')
-
-    except Exception as e:
-        print(f'AUTO-DEPOSIT ERROR: {e}')
-        await channel.send(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
-        return
-
-
-async def deposit(town_name, receiver, chest_pos):
-    global config, logs_channel
-    logs_channel = int(logchannel())
-
-    async with deposit_lock:
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://api.earthmc.net/v3/aurora/towns', json={"query": [town_name], "template": {"coordinates": True}}) as resp:
-                response = await resp.json()
-            
-            if not response:
-                return
-            
-            channel = bot.get_channel(logs_channel)
-            if not channel:
-                print("CHANNEL NOT FOUND! RESTART")
-            
-            town_chunks = response[0]['coordinates']['townBlocks']
-            seen_in_town = {}
-            last_balances = {}
-            while True:
-                if not config['AutoDeposits']:
-                    await asyncio.sleep(20)
-                    continue
-
-                async with session.get('https://map.earthmc.net/tiles/players.json') as resp:
-                    if resp.status == 200 and resp.content_type == 'application/json':
-                        response = await resp.json()
-                    else:
-                        response = {'players': []}
-                
-                players_in_town = [receiver]
-                for item in seen_in_town:
-                    if item not in players_in_town:
-                        players_in_town.append(item)
-                
-                player_positions = {}
-                try:
-                    for player in response['players']:
-                        if isinstance(player, dict):
-                            player_pos = [player['x'], player['z']]
-                            player_name = player['name']
-                            if [x for x in town_chunks if isInChunk(x, player_pos)]:
-                                player_positions[player_name] = player_pos
-                                seen_in_town[player_name] = {'pos': player_pos, 'epoch': int(time.time())}
-                                if player_name not in players_in_town:
-                                    players_in_town.append(player_name)
-                except Exception:
-                    await asyncio.sleep(3)
-                    continue
-                
-                players_in_town = list(set(players_in_town))
-
-                if players_in_town:
-                    differences = []
-                    async with session.post('https://api.earthmc.net/v3/aurora/players', json={"query": players_in_town, "template": {"stats": True}}) as resp:
-                        if resp.status == 200 and resp.content_type == 'application/json':
-                            response = await resp.json()
-                        else:
-                            response = {'players': []}
-                    
-                    try:
-                        for index, player in enumerate(response):
-                            if isinstance(player, dict):
-                                player_name = players_in_town[index]
-                                player_balance = player['stats']['balance']
-                                if player_name in last_balances and last_balances[player_name] != player_balance:
-                                    bal_difference = player_balance - last_balances[player_name]
-                                    differences.append({'player': player_name, 'value': bal_difference})
-                                last_balances[player_name] = player_balance
-                    except Exception:
-                        await asyncio.sleep(3)
-                        continue
-                    
-                    receiver_difference = [int(y['value']) for y in differences if y['player'] == receiver and abs(y['value']) > 0]
-                    receiver_difference = receiver_difference[0] if len(receiver_difference) == 1 else None
-
-                    if receiver_difference and receiver_difference >= 1:
-                        potentials = [x for x in differences if x['value'] < 0 and x['player'] != receiver and receiver_difference == -x['value']]
-
-                        if len(potentials) > 1:
-                            closest = min(potentials, key=lambda p: coordDistance(chest_pos, player_positions[p['player']]))
-                            await Confirm(player=closest['player'], receiver=receiver, amount=receiver_difference, channel=channel)
-                        elif potentials:
-                            await Confirm(player=potentials[0]['player'], receiver=receiver, amount=receiver_difference, channel=channel)
-                
-                last_balances = {k: v for k, v in last_balances.items() if k in players_in_town}
-                epoch_now = int(time.time())
-                seen_in_town = {k: v for k, v in seen_in_town.items() if epoch_now - v['epoch'] <= 12}
-                
-                await asyncio.sleep(3)
-
-# Configure intents
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-
-# Create bot instance
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-#funcs
-async def load_extensions():
-    # Load existing extensions
-    await bot.load_extension(f'cogs.games')
-    await bot.load_extension(f'cogs.economy_management')
-    
-
-# Ready event with improved error handling
-@bot.event
-async def on_ready():
-    print(f"Bot is online as {bot.user}!")
-    try:
-        await load_extensions()
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} commands.")
-        asyncio.create_task(deposit(town_name=str(town()), receiver=str(shop_owner()), chest_pos=chestcords()))
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
-        
-
-@bot.command(name='reload_extensions')
-async def reload_extensions(ctx):
-    """Reload all bot extensions."""
-    if not is_admin(ctx.author.id):
-        await ctx.send("You do not have permission to use this command.")
-        return
-    
-    try:
-        # Unload and reload each extension
-        await bot.unload_extension(f'cogs.games')
-        await bot.unload_extension(f'cogs.economy_management')
-        
-        # Reload extensions
-        await bot.load_extension(f'cogs.games')
-        await bot.load_extension(f'cogs.economy_management')
-        
-        await ctx.send("All extensions reloaded successfully!")
-    except Exception as e:
-        await ctx.send(f"Error reloading extensions: {e}")
-
-# Run the bot
-if __name__ == "__main__":
-    bot.run(token())
+import time
+STARTED = time.perf_counter()  # For the startup report
+
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+
+from libs.Bank import init_db
+from libs.Database import DB_PATH
+from libs import Ledger as ledger
+from libs.util import is_admin, create_embed, token, logchannel, deposit_watches, metrics_port, shard_count, shard_ids, is_primary
+from libs.Deposits import DepositWatcher
+from libs.EarthMC import EarthMC
+from libs import Metrics, Notify, Profiling
+import os
+import json
+import hashlib
+import asyncio
+
+# Initialize the database
+try:
+    init_db()
+except Exception as e:
+    print(f"Error initializing database: {e}")
+    exit(1)
+
+# Create a lock
+deposit_lock = asyncio.Lock()
+config = {'AutoDeposits': True}
+earthmc = EarthMC()  # One keep-alive session and lookup cache for the deposit loop and Confirm
+watcher = None
+deposit_task = None
+loop_lag_task = None  # Held so the event loop lag monitor isn't garbage collected
+COMMANDS_FINGERPRINT = os.path.join(os.path.dirname(DB_PATH), 'commands.sha256')  # Tree as last synced
+
+# Seconds spent in each startup phase, printed once the first deposit tick has run (or at
+# ready when this process doesn't poll)
+startup = {}
+_phase_started = STARTED
+
+Metrics.register_collector('earthmc', lambda: earthmc.stats)
+Metrics.register_collector('deposit', lambda: watcher.status() if watcher else {})
+command_seconds = Metrics.histogram('casino_command_seconds', 'Slash command run time', ('command',), Metrics.COMMAND_BUCKETS)
+startup_seconds = Metrics.gauge('casino_startup_seconds', 'Seconds spent in each startup phase', ('phase',))
+command_errors = Metrics.counter('casino_command_errors_total', 'Slash commands that raised', ('command',))
+
+# Functions
+def startup_phase(name):
+    global _phase_started
+    now = time.perf_counter()
+    startup[name] = round(now - _phase_started, 3)
+    startup_seconds.labels(name).set(startup[name])
+    _phase_started = now
+
+def startup_report():
+    if 'total' in startup:
+        return
+    phases = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in startup.items())
+    startup['total'] = round(time.perf_counter() - STARTED, 3)
+    print(f"Startup: {phases} (total {startup['total']:.2f}s)")
+
+# Credit a matched deposit, the DMs and the log line are queued so the deposit loop never
+# waits on Discord
+async def Confirm(player: str, receiver: str, amount: int):
+    try:
+        discord_ids = await earthmc.discord_ids([player, receiver])
+
+        if not discord_ids.get(player) or not discord_ids.get(receiver):
+            Notify.log(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
+            return
+            
+        player_obj: discord.User = bot.get_user(discord_ids[player])
+        receiver_obj: discord.User = bot.get_user(discord_ids[receiver])
+
+        if not receiver_obj or not player_obj:
+            Notify.log(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
+            return
+
+        new_balance = await ledger.change_balance(str(player_obj.id), amount, 'deposit', receiver_obj.id)
+
+        Notify.dm(player_obj.id, embed=create_embed(title='Deposit', description=f'✅ Deposited **{amount}g** into your account.\nYour new balance: **{new_balance:.2f}**.'))
+        Notify.dm(receiver_obj.id, embed=create_embed(title='Deposit', description=f"✅ Deposited **{amount}g** into {player_obj.name}'s account."))
+        Notify.log(f"✅ Deposited **{amount}g** into {player_obj.name}'s account. (Received by {receiver_obj.name})")
+        print(f'{player_obj.name} deposited {amount}g > {receiver_obj.name}')
+
+    except Exception as e:
+        print(f'AUTO-DEPOSIT ERROR: {e}')
+        Notify.log(f"❌ Failed to deposit **{amount}g** into {player}'s account.")
+        return
+
+
+async def deposit(watches):
+    global config, logs_channel, watcher
+    logs_channel = int(logchannel())
+
+    async with deposit_lock:
+        channel = bot.get_channel(logs_channel)
+        if not channel:
+            print("CHANNEL NOT FOUND! RESTART")
+
+        async def on_deposit(player, receiver, amount, watch):
+            await Confirm(player=player, receiver=receiver, amount=amount)
+
+        watcher = DepositWatcher(earthmc, watches, on_deposit, enabled=lambda: config['AutoDeposits'])
+        await watcher.refresh_towns()
+        if not watcher.towns.towns:
+            startup_report()
+            return
+        run = asyncio.create_task(watcher.run())
+        await watcher.ticked.wait()
+        startup_phase('first_tick')
+        startup_report()
+        await run
+
+# Start the deposit loop unless it is already running (on_ready fires again on reconnects)
+def start_deposits():
+    global deposit_task
+    if deposit_task is None or deposit_task.done():
+        deposit_task = asyncio.create_task(deposit(deposit_watches()))
+
+# Configure intents
+intents = discord.Intents.default()
+intents.message_content = True
+intents.members = True
+
+# Command tree that stamps every slash command so its run time can be recorded
+class InstrumentedTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        name = interaction.command.qualified_name if interaction.command else 'unknown'
+        command_errors.labels(name).inc()
+        # on_app_command_completion only fires on success, time failed commands here
+        started = interaction.extras.get('started')
+        if started is not None:
+            command_seconds.labels(name).observe(time.perf_counter() - started)
+        await super().on_error(interaction, error)
+
+# Create bot instance, one process of several runs a slice of the shards (see runsharded.py)
+if shard_count():
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, tree_cls=InstrumentedTree, shard_count=shard_count(), shard_ids=shard_ids())
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, tree_cls=InstrumentedTree)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    started = interaction.extras.get('started')
+    if started is not None:
+        command_seconds.labels(command.qualified_name).observe(time.perf_counter() - started)
+
+#funcs
+async def load_extensions():
+    # Load existing extensions
+    await bot.load_extension(f'cogs.games')
+    await bot.load_extension(f'cogs.economy_management')
+    await bot.load_extension(f'cogs.diagnostics')
+
+# Hash of the app commands as they would be sent to Discord (and the application they
+# belong to), so a sync can be skipped when nothing changed since the last one
+def command_fingerprint():
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda x: (x.get('type', 1), x['name']))
+    data = json.dumps([bot.application_id, payload], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+# Global sync is slow and rate limited, only do it when the command tree changed
+# Returns the number of commands synced, None when skipped
+async def sync_commands(force=False):
+    fingerprint = command_fingerprint()
+    try:
+        with open(COMMANDS_FINGERPRINT) as f:
+            synced_fingerprint = f.read().strip()
+    except OSError:
+        synced_fingerprint = None
+    if fingerprint == synced_fingerprint and not force:
+        print("Command tree unchanged, skipped sync.")
+        return None
+
+    synced = await bot.tree.sync()
+    with open(COMMANDS_FINGERPRINT, 'w') as f:
+        f.write(fingerprint)
+    print(f"Synced {len(synced)} commands.")
+    return len(synced)
+
+# Runs once after login, before connecting to the gateway (on_ready runs on every reconnect)
+async def setup_hook():
+    global loop_lag_task
+    startup_phase('login')
+    await load_extensions()
+    startup_phase('cog_load')
+    # The command tree is global, with several processes only the primary syncs it
+    if is_primary():
+        try:
+            await sync_commands()
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
+    startup_phase('sync')
+
+    loop_lag_task = asyncio.create_task(Metrics.monitor_loop_lag())
+    if metrics_port():
+        try:
+            await Metrics.serve(metrics_port())
+            print(f"Metrics on http://127.0.0.1:{metrics_port()}/metrics")
+        except OSError as e:
+            print(f"Failed to start the metrics endpoint: {e}")
+
+bot.setup_hook = setup_hook
+
+# Ready event, also fired again after a reconnect
+@bot.event
+async def on_ready():
+    print(f"Bot is online as {bot.user}!")
+    if 'ready' not in startup:
+        startup_phase('ready')
+    Notify.start(bot, logchannel())
+    # The deposit loop credits the shared ledger, with several processes only the primary polls
+    if is_primary() and deposit_watches():
+        start_deposits()
+    else:
+        startup_report()
+
+
+@bot.command(name='reload_extensions')
+async def reload_extensions(ctx):
+    """Reload all bot extensions."""
+    if not is_admin(ctx.author.id):
+        await ctx.send("You do not have permission to use this command.")
+        return
+    
+    try:
+        # Unload and reload each extension
+        await bot.unload_extension(f'cogs.games')
+        await bot.unload_extension(f'cogs.economy_management')
+        await bot.unload_extension(f'cogs.diagnostics')
+        
+        # Reload extensions
+        await bot.load_extension(f'cogs.games')
+        await bot.load_extension(f'cogs.economy_management')
+        await bot.load_extension(f'cogs.diagnostics')
+
+        synced = await sync_commands() if is_primary() else None
+        await ctx.send("All extensions reloaded successfully!" + (f" Synced {synced} commands." if synced is not None else ""))
+    except Exception as e:
+        await ctx.send(f"Error reloading extensions: {e}")
+
+@bot.command(name='sync_commands')
+async def force_sync(ctx):
+    """Sync the slash commands with Discord even if they look unchanged."""
+    if not is_admin(ctx.author.id):
+        await ctx.send("You do not have permission to use this command.")
+        return
+
+    try:
+        synced = await sync_commands(force=True)
+        await ctx.send(f"Synced {synced} commands.")
+    except Exception as e:
+        await ctx.send(f"Error syncing commands: {e}")
+
+@bot.command(name='deposit_status')
+async def deposit_status(ctx):
+    """Show the auto-deposit polling state."""
+    if not is_admin(ctx.author.id):
+        await ctx.send("You do not have permission to use this command.")
+        return
+
+    if not watcher:
+        await ctx.send("Auto-deposit is not running.")
+        return
+
+    status = watcher.status()
+    await ctx.send(
+        f"State: **{status['state']}**, polling every **{status['interval']:.1f}s**"
+        f" ({status['requests_per_minute']} API requests in the last minute, {status['ticks']} ticks)"
+        + (f", paused for {status['paused_for']:.0f}s by the API rate limit" if status['paused_for'] else "")
+    )
+
+@bot.command(name='deposit_profile')
+async def deposit_profile(ctx, ticks: str = '10'):
+    """Profile the next auto-deposit ticks (or `stop` early)."""
+    if not is_admin(ctx.author.id):
+        await ctx.send("You do not have permission to use this command.")
+        return
+
+    if not watcher:
+        await ctx.send("Auto-deposit is not running.")
+        return
+
+    if ticks == 'stop':
+        await ctx.send("Profile stops after the current tick." if watcher.stop_profiling() else "No deposit profile is running.")
+        return
+
+    async def on_profile(report):
+        channel = bot.get_channel(int(logchannel() or 0)) or ctx.channel
+        Notify.send(
+            channel.id, f"Deposit tick profile requested by {ctx.author.mention}",
+            file=(f"deposit-profile-{time.strftime('%Y%m%d-%H%M%S')}.txt", report.encode())
+        )
+
+    try:
+        watcher.profile_ticks(int(ticks), on_profile)
+        await ctx.send(f"Profiling the next **{int(ticks)}** deposit ticks.")
+    except (Profiling.ProfilerBusy, ValueError) as e:
+        await ctx.send(f"Error: {e}")
+
+# Run the bot
+if __name__ == "__main__":
+    startup_phase('import')
+    bot.run(token())
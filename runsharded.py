@@ -0,0 +1,75 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Run the bot as several processes: one ledger service owning store/users.db
+# (libs/LedgerService.py) and WORKERS copies of runbot.py splitting the shards between
+# them, all talking to the ledger over its Unix socket. Stops everything when any of them
+# exits or on Ctrl-C
+#
+#     python runsharded.py --workers 4 --shards 8
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOCKET = os.path.join(ROOT, 'store', 'ledger.sock')
+SOCKET_WAIT = 30  # Seconds to wait for the ledger service to come up
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ledger service and several sharded bot processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--shards', type=int, help='total shards (default one per worker)')
+    parser.add_argument('--socket', default=SOCKET)
+    parser.add_argument('--metrics-port', type=int, default=9477, help='ledger service port, worker i uses this + 1 + i (0 turns it off)')
+    args = parser.parse_args()
+    shards = args.shards or args.workers
+    workers = min(args.workers, shards)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    service = [sys.executable, '-m', 'libs.LedgerService', '--socket', args.socket]
+    if args.metrics_port:
+        service += ['--metrics-port', str(args.metrics_port)]
+    processes = [subprocess.Popen(service, cwd=ROOT)]
+
+    try:
+        deadline = time.monotonic() + SOCKET_WAIT
+        while not os.path.exists(args.socket):
+            if processes[0].poll() is not None or time.monotonic() > deadline:
+                print('Error: the ledger service did not start')
+                return 1
+            time.sleep(0.1)
+
+        for i in range(workers):
+            env = dict(
+                os.environ,
+                LEDGER_SOCKET=args.socket,
+                SHARD_COUNT=str(shards),
+                SHARD_IDS=','.join(str(shard) for shard in range(i, shards, workers)),
+                METRICS_PORT=str(args.metrics_port + 1 + i if args.metrics_port else 0),
+                HOUSE_BANK_SHARE=str(1 / workers),
+            )
+            processes.append(subprocess.Popen([sys.executable, 'runbot.py'], cwd=ROOT, env=env))
+        print(f'Ledger service and {workers} bot processes running {shards} shards')
+
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        print('A process exited, stopping the rest')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Bots first so nothing is left writing when the ledger service drains
+        for process in processes[:0:-1] + processes[:1]:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())